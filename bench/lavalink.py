@@ -0,0 +1,423 @@
+"""A stand-in Lavalink v4 node for load testing, no audio is ever played.
+
+It answers the REST endpoints and player websocket wavelink uses, with
+configurable latency, failure rates and a synthetic track catalog:
+
+    python -m bench.lavalink --port 2333 --latency 40 --jitter 60 --failure-rate 0.02
+
+Any path or URL loads as a track named after it, search prefixes such as
+``ytmsearch:`` search the catalog. Tracks "play" for ``--track-seconds`` and
+then end, so autoplay and queue refills happen like they would on a real node.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import random
+import secrets
+import time
+import zlib
+
+from pathlib import PurePath
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from aiohttp import WSMsgType, web
+
+from bench.search_index import phrase
+
+
+SEARCH_PREFIXES = ("ytsearch:", "ytmsearch:", "scsearch:")
+SEARCH_RESULTS = 5
+STATS_INTERVAL = 60
+
+Payload = Dict[str, Any]
+
+
+def encode(info: Payload) -> str:
+    # Real encoded tracks are opaque to the bot, this just has to round-trip.
+    return base64.b64encode(json.dumps(info).encode()).decode()
+
+def decode(encoded: str) -> Payload:
+    info = json.loads(base64.b64decode(encoded))
+    return {"encoded": encoded, "info": info, "pluginInfo": {}}
+
+def track(uri: str, title: str, author: str, length: int, source: str) -> Payload:
+    info = {
+        "identifier": uri,
+        "isSeekable": True,
+        "author": author,
+        "length": length,
+        "isStream": False,
+        "position": 0,
+        "title": title,
+        "uri": uri,
+        "artworkUrl": None,
+        "isrc": None,
+        "sourceName": source
+    }
+    return {"encoded": encode(info), "info": info, "pluginInfo": {}}
+
+
+class Settings:
+    def __init__(self, password: str = "youshallnotpass", latency: float = 0.0,
+                 jitter: float = 0.0, failure_rate: float = 0.0, missing_rate: float = 0.0,
+                 play_failure_rate: float = 0.0, track_seconds: float = 30.0,
+                 catalog: int = 5000, seed: int = 0) -> None:
+        self.password = password
+        # REST latency in milliseconds, each request waits latency plus up to jitter.
+        self.latency = latency
+        self.jitter = jitter
+        # Share of track loads answered with a load error or with nothing at all.
+        self.failure_rate = failure_rate
+        self.missing_rate = missing_rate
+        # Share of played tracks that fail with a TrackExceptionEvent.
+        self.play_failure_rate = play_failure_rate
+        self.track_seconds = track_seconds
+        self.catalog = catalog
+        self.seed = seed
+
+
+class Session:
+    """A websocket client and the players it created."""
+    def __init__(self, socket: web.WebSocketResponse) -> None:
+        self.id = secrets.token_hex(8)
+        self.socket = socket
+        self.players: Dict[int, Dict[str, Any]] = {}
+        self.resuming = False
+        self.timeout = 60
+
+    async def send(self, data: Payload) -> None:
+        if not self.socket.closed:
+            await self.socket.send_json(data)
+
+
+class Simulator:
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        self.rng = random.Random(settings.seed)
+        self.sessions: Dict[str, Session] = {}
+        self.started = time.monotonic()
+        self.requests = 0
+
+        rng = random.Random(settings.seed)
+        artists = [phrase(rng, 2) for _ in range(max(1, settings.catalog // 20))]
+        self.catalog: List[Payload] = [
+            track(f"https://sim.invalid/watch?v={i:08}", phrase(rng, 4), rng.choice(artists),
+                  rng.randint(90, 420) * 1000, "youtube")
+            for i in range(settings.catalog)
+        ]
+        self.by_uri = {entry["info"]["uri"]: entry for entry in self.catalog}
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.authorize])
+        app.on_shutdown.append(self.close_sessions)
+        app.add_routes([
+            web.get("/v4/websocket", self.websocket),
+            web.get("/v4/info", self.info),
+            web.get("/v4/stats", self.stats_route),
+            web.get("/version", self.version),
+            web.get("/v4/loadtracks", self.load_tracks),
+            web.get("/v4/decodetrack", self.decode_track),
+            web.post("/v4/decodetracks", self.decode_tracks),
+            web.patch("/v4/sessions/{session}", self.update_session),
+            web.get("/v4/sessions/{session}/players", self.players),
+            web.get("/v4/sessions/{session}/players/{guild}", self.player),
+            web.patch("/v4/sessions/{session}/players/{guild}", self.update_player),
+            web.delete("/v4/sessions/{session}/players/{guild}", self.destroy_player)
+        ])
+        return app
+
+    @web.middleware
+    async def authorize(self, request: web.Request, handler) -> web.StreamResponse:
+        if request.headers.get("Authorization") != self.settings.password:
+            return error(request, 401, "Unauthorized")
+
+        if request.path != "/v4/websocket":
+            self.requests += 1
+            delay = self.settings.latency + self.rng.uniform(0, self.settings.jitter)
+            if delay:
+                await asyncio.sleep(delay / 1000)
+
+        return await handler(request)
+
+    def session(self, request: web.Request) -> Session:
+        session = self.sessions.get(request.match_info["session"])
+        if session is None:
+            raise web.HTTPNotFound(text=json.dumps(error_body(request, 404, "Session not found")),
+                                   content_type="application/json")
+        return session
+
+    async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+        socket = web.WebSocketResponse()
+        await socket.prepare(request)
+
+        session = Session(socket)
+        self.sessions[session.id] = session
+        await session.send({"op": "ready", "resumed": False, "sessionId": session.id})
+
+        stats = asyncio.create_task(self.send_stats(session))
+        try:
+            async for message in socket:
+                if message.type == WSMsgType.ERROR:
+                    break
+        finally:
+            stats.cancel()
+            for player in session.players.values():
+                cancel(player)
+            del self.sessions[session.id]
+
+        return socket
+
+    async def close_sessions(self, app: web.Application) -> None:
+        # Like a node going down, clients see their websocket close.
+        for session in list(self.sessions.values()):
+            await session.socket.close()
+
+    async def send_stats(self, session: Session) -> None:
+        while True:
+            await session.send({"op": "stats", **self.stats()})
+            await asyncio.sleep(STATS_INTERVAL)
+
+    def stats(self) -> Payload:
+        players = [player for session in self.sessions.values() for player in session.players.values()]
+        return {
+            "players": len(players),
+            "playingPlayers": sum(1 for player in players if player["track"] and not player["paused"]),
+            "uptime": int((time.monotonic() - self.started) * 1000),
+            "memory": {"free": 0, "used": 0, "allocated": 0, "reservable": 0},
+            "cpu": {"cores": 1, "systemLoad": 0.0, "lavalinkLoad": 0.0},
+            "frameStats": None
+        }
+
+    async def info(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "version": {"semver": "4.0.0", "major": 4, "minor": 0, "patch": 0,
+                        "preRelease": None, "build": None},
+            "buildTime": 0,
+            "git": {"branch": "simulator", "commit": "0", "commitTime": 0},
+            "jvm": "none",
+            "lavaplayer": "none",
+            "sourceManagers": ["youtube", "local", "http"],
+            "filters": [],
+            "plugins": []
+        })
+
+    async def stats_route(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    async def version(self, request: web.Request) -> web.Response:
+        return web.Response(text="4.0.0")
+
+    async def load_tracks(self, request: web.Request) -> web.Response:
+        identifier = request.query.get("identifier", "")
+        roll = self.rng.random()
+        if roll < self.settings.failure_rate:
+            return web.json_response({"loadType": "error", "data": {
+                "message": "Simulated load failure", "severity": "common", "cause": "simulator"
+            }})
+        elif roll < self.settings.failure_rate + self.settings.missing_rate:
+            return web.json_response({"loadType": "empty", "data": {}})
+
+        if identifier.startswith(SEARCH_PREFIXES):
+            results = self.search(identifier.partition(":")[2])
+            if not results:
+                return web.json_response({"loadType": "empty", "data": {}})
+            return web.json_response({"loadType": "search", "data": results})
+
+        found = self.by_uri.get(identifier) or self.resolve(identifier)
+        if found is None:
+            return web.json_response({"loadType": "empty", "data": {}})
+
+        return web.json_response({"loadType": "track", "data": found})
+
+    def search(self, query: str) -> List[Payload]:
+        query = query.lower()
+        results = [entry for entry in self.catalog
+                   if query in entry["info"]["title"].lower() or query in entry["info"]["author"].lower()]
+        if len(results) < SEARCH_RESULTS and self.catalog:
+            # Real searches nearly always find something, fill up with stable picks.
+            rng = random.Random(zlib.crc32(query.encode()))
+            results += rng.sample(self.catalog, min(SEARCH_RESULTS - len(results), len(self.catalog)))
+
+        return results[:SEARCH_RESULTS]
+
+    def resolve(self, identifier: str) -> Optional[Payload]:
+        """Paths and URLs outside the catalog load as a track named after them."""
+        url = urlparse(identifier)
+        if url.scheme in ("http", "https"):
+            source = "http"
+        elif identifier.startswith("/") or PurePath(identifier).suffix:
+            source = "local"
+        else:
+            return None
+
+        name = PurePath(url.path or identifier).stem or identifier
+        length = 90_000 + zlib.crc32(identifier.encode()) % 330_000
+        return track(identifier, name, "Unknown artist", length, source)
+
+    async def decode_track(self, request: web.Request) -> web.Response:
+        try:
+            return web.json_response(decode(request.query["encodedTrack"]))
+        except (KeyError, ValueError):
+            return error(request, 400, "Invalid encoded track")
+
+    async def decode_tracks(self, request: web.Request) -> web.Response:
+        try:
+            return web.json_response([decode(encoded) for encoded in await request.json()])
+        except (TypeError, ValueError):
+            return error(request, 400, "Invalid encoded tracks")
+
+    async def update_session(self, request: web.Request) -> web.Response:
+        session = self.session(request)
+        data = await request.json()
+        session.resuming = data.get("resuming", session.resuming)
+        session.timeout = data.get("timeout", session.timeout)
+
+        return web.json_response({"resuming": session.resuming, "timeout": session.timeout})
+
+    async def players(self, request: web.Request) -> web.Response:
+        session = self.session(request)
+        return web.json_response([player_response(guild_id, player)
+                                  for guild_id, player in session.players.items()])
+
+    async def player(self, request: web.Request) -> web.Response:
+        session = self.session(request)
+        guild_id = int(request.match_info["guild"])
+        if guild_id not in session.players:
+            return error(request, 404, "Player not found")
+
+        return web.json_response(player_response(guild_id, session.players[guild_id]))
+
+    async def update_player(self, request: web.Request) -> web.Response:
+        session = self.session(request)
+        guild_id = int(request.match_info["guild"])
+        no_replace = request.query.get("noReplace", "false").lower() == "true"
+        data = await request.json()
+
+        player = session.players.setdefault(guild_id, {
+            "track": None, "volume": 100, "paused": False, "voice": {}, "filters": {},
+            "started": 0.0, "end": None
+        })
+        for key in ("volume", "voice", "filters"):
+            if key in data:
+                player[key] = data[key]
+
+        if "paused" in data and data["paused"] != player["paused"]:
+            player["paused"] = data["paused"]
+            if player["track"]:
+                if player["paused"]:
+                    cancel(player)
+                else:
+                    self.schedule_end(session, guild_id, player)
+
+        if "track" in data and not (no_replace and player["track"]):
+            await self.play(session, guild_id, player, data["track"])
+
+        return web.json_response(player_response(guild_id, player))
+
+    async def destroy_player(self, request: web.Request) -> web.Response:
+        session = self.session(request)
+        player = session.players.pop(int(request.match_info["guild"]), None)
+        if player:
+            cancel(player)
+
+        return web.Response(status=204)
+
+    async def play(self, session: Session, guild_id: int, player: Dict[str, Any],
+                   requested: Payload) -> None:
+        previous = player["track"]
+        cancel(player)
+        player["track"] = None
+
+        if previous:
+            reason = "replaced" if requested.get("encoded") else "stopped"
+            await self.event(session, guild_id, "TrackEndEvent", previous, reason=reason)
+
+        encoded = requested.get("encoded")
+        if not encoded:
+            return
+
+        current = {**decode(encoded), "userData": requested.get("userData", {})}
+        if self.rng.random() < self.settings.play_failure_rate:
+            await self.event(session, guild_id, "TrackExceptionEvent", current, exception={
+                "message": "Simulated playback failure", "severity": "common", "cause": "simulator"
+            })
+            await self.event(session, guild_id, "TrackEndEvent", current, reason="loadFailed")
+            return
+
+        player["track"] = current
+        player["started"] = time.monotonic()
+        await self.event(session, guild_id, "TrackStartEvent", current)
+        if not player["paused"]:
+            self.schedule_end(session, guild_id, player)
+
+    def schedule_end(self, session: Session, guild_id: int, player: Dict[str, Any]) -> None:
+        async def finish() -> None:
+            await asyncio.sleep(self.settings.track_seconds)
+            ended, player["track"], player["end"] = player["track"], None, None
+            await self.event(session, guild_id, "TrackEndEvent", ended, reason="finished")
+
+        player["end"] = asyncio.create_task(finish())
+
+    async def event(self, session: Session, guild_id: int, kind: str,
+                    current: Payload, **fields: Any) -> None:
+        await session.send({"op": "event", "type": kind, "guildId": str(guild_id),
+                            "track": current, **fields})
+
+
+def cancel(player: Dict[str, Any]) -> None:
+    if player["end"]:
+        player["end"].cancel()
+        player["end"] = None
+
+def player_response(guild_id: int, player: Dict[str, Any]) -> Payload:
+    position = 0
+    if player["track"]:
+        position = int((time.monotonic() - player["started"]) * 1000)
+
+    return {
+        "guildId": str(guild_id),
+        "track": player["track"],
+        "volume": player["volume"],
+        "paused": player["paused"],
+        "state": {"time": int(time.time() * 1000), "position": position, "connected": True, "ping": 0},
+        "voice": player["voice"],
+        "filters": player["filters"]
+    }
+
+def error_body(request: web.Request, status: int, message: str) -> Payload:
+    return {"timestamp": int(time.time() * 1000), "status": status, "error": message,
+            "message": message, "path": request.path}
+
+def error(request: web.Request, status: int, message: str) -> web.Response:
+    return web.json_response(error_body(request, status, message), status=status)
+
+async def start(simulator: Simulator, host: str = "127.0.0.1", port: int = 2333) -> web.AppRunner:
+    """Serve `simulator` in the running event loop, clean up with ``runner.cleanup()``."""
+    runner = web.AppRunner(simulator.app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    return runner
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2333)
+    parser.add_argument("--password", default="youshallnotpass")
+    parser.add_argument("--latency", type=float, default=0.0, help="base REST latency in ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random REST latency in ms")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of track loads that error")
+    parser.add_argument("--missing-rate", type=float, default=0.0, help="share of track loads that find nothing")
+    parser.add_argument("--play-failure-rate", type=float, default=0.0,
+                        help="share of played tracks that raise a track exception")
+    parser.add_argument("--track-seconds", type=float, default=30.0, help="how long every track plays")
+    parser.add_argument("--catalog", type=int, default=5000, help="tracks available to searches")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    settings = Settings(args.password, args.latency, args.jitter, args.failure_rate, args.missing_rate,
+                        args.play_failure_rate, args.track_seconds, args.catalog, args.seed)
+    web.run_app(Simulator(settings).app(), host=args.host, port=args.port)
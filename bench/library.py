@@ -0,0 +1,84 @@
+"""Generate a synthetic tagged music library.
+
+Files are tiny silent WAVs carrying RIFF INFO tags, which TinyTag reads like
+any other format. Artist popularity follows a Zipf distribution, so a few
+artists own many albums while most have one or two, like a real library.
+
+    python -m bench.library /tmp/bench-library --songs 10000
+"""
+import argparse
+import random
+import struct
+
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+
+from bench.search_index import phrase
+
+
+GENRES = ["Rock", "Pop", "Jazz", "Electronic", "Hip-Hop", "Classical", "Metal", "Folk"]
+# 50ms of 8kHz mono silence, tagging is what matters here.
+SILENCE = b"\0\0" * 400
+
+
+def info_chunk(tags: Dict[str, str]) -> bytes:
+    body = b"INFO"
+    for key, value in tags.items():
+        data = value.encode() + b"\0"
+        body += key.encode() + struct.pack("<I", len(data)) + data
+        if len(data) % 2:
+            body += b"\0"
+
+    return b"LIST" + struct.pack("<I", len(body)) + body
+
+def wav(tags: Dict[str, str]) -> bytes:
+    fmt = struct.pack("<HHIIHH", 1, 1, 8000, 16000, 2, 16)
+    body = (b"WAVE"
+            + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+            + b"data" + struct.pack("<I", len(SILENCE)) + SILENCE
+            + info_chunk(tags))
+
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+def songs(count: int, seed: int) -> Iterator[Tuple[str, str, str, str, int]]:
+    """Yield (artist, album, title, genre, track number) for `count` songs."""
+    rng = random.Random(seed)
+    artists = [phrase(rng, 3) for _ in range(max(1, count // 40))]
+    # Zipf-like weights, the first artists get most of the albums.
+    weights = [1 / rank for rank in range(1, len(artists) + 1)]
+
+    produced = 0
+    while produced < count:
+        artist = rng.choices(artists, weights)[0]
+        album = phrase(rng, 3)
+        genre = rng.choice(GENRES)
+
+        for number in range(1, min(rng.randint(8, 14), count - produced) + 1):
+            yield artist, album, phrase(rng, 5), genre, number
+            produced += 1
+
+def generate(path: Path, count: int, seed: int = 0) -> int:
+    """Write `count` songs below `path`, skipping the work if it was already done."""
+    marker = path / f".generated-{count}-{seed}"
+    if marker.exists():
+        return count
+
+    for i, (artist, album, title, genre, number) in enumerate(songs(count, seed)):
+        directory = path / artist / album
+        directory.mkdir(parents=True, exist_ok=True)
+
+        tags = {"IART": artist, "IPRD": album, "INAM": title, "IGNR": genre, "ITRK": str(number)}
+        (directory / f"{number:02} {i}.wav").write_bytes(wav(tags))
+
+    marker.touch()
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--songs", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"Generated {generate(args.path, args.songs, args.seed)} songs in {args.path}")
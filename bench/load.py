@@ -0,0 +1,334 @@
+"""Drive the Music cog's commands for many simulated guilds at once.
+
+Commands run through the real cog against BENCH_DATABASE and a Lavalink
+node, by default simulators from bench/lavalink.py started in-process.
+Discord itself is faked: every guild gets a text channel, a voice channel and
+a member, and song pickers are answered with the first result right away.
+
+    python -m bench.run --sizes 10000       # fill the bench database first
+    python -m bench.load --guilds 300 --commands 20 --latency 40 --jitter 60
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import asyncpg
+import discord
+import wavelink
+
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from discord.ext import commands
+
+from bench.lavalink import Settings, Simulator, start
+from bench.run import git_commit, percentiles
+from bench.search_index import phrase
+from cogs.music import Music
+from cogs.utils.nodes import NodeBalancer
+from config import CONFIG
+
+
+# First simulated guild id, far from anything Discord hands out.
+BASE_ID = 1 << 40
+PLAYLIST_NAME = "load"
+# Relative weights of the commands every guild sends.
+COMMANDS = {"play": 4, "playlist play": 1, "queue": 3, "skip": 2}
+
+
+class FakeUser:
+    def __init__(self, user_id: int, voice: Optional["FakeVoiceState"] = None) -> None:
+        self.id = user_id
+        self.bot = voice is None
+        self.voice = voice
+        self.mention = f"<@{user_id}>"
+
+
+class FakeVoiceState:
+    def __init__(self, channel: "FakeVoiceChannel") -> None:
+        self.channel = channel
+
+
+class FakeMessage:
+    async def delete(self) -> None:
+        pass
+
+    async def add_reaction(self, emoji: str) -> None:
+        pass
+
+
+class FakeTextChannel:
+    def __init__(self, channel_id: int) -> None:
+        self.id = channel_id
+        self.mention = f"<#{channel_id}>"
+        self.sent = 0
+
+    async def send(self, content: Optional[str] = None, *, view: Optional[discord.ui.View] = None,
+                   **kwargs: Any) -> FakeMessage:
+        self.sent += 1
+        if view is not None:
+            # Answer pickers right away, like a user clicking the first result.
+            view.current_choice = 0
+            view.stop()
+
+        return FakeMessage()
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild: "FakeGuild", channel_id: int) -> None:
+        self.guild = guild
+        self.id = channel_id
+        self.members: List[FakeUser] = []
+
+    async def connect(self, *, cls, **kwargs: Any) -> wavelink.Player:
+        player = cls(self.guild.bot, self)
+        player._guild = self.guild
+        player.node._players[self.guild.id] = player
+
+        # What discord.py's voice handshake would hand the player.
+        player._voice_state = {"voice": {"session_id": f"sim-{self.guild.id}"},
+                               "channel_id": str(self.id)}
+        await player.on_voice_server_update({"token": "sim", "endpoint": "sim.invalid"})
+
+        self.guild.voice_client = player
+        return player
+
+
+class FakeGuild:
+    def __init__(self, bot: commands.Bot, guild_id: int) -> None:
+        self.bot = bot
+        self.id = guild_id
+        self.voice_client: Optional[wavelink.Player] = None
+        self.text = FakeTextChannel(guild_id + 1)
+        self.voice = FakeVoiceChannel(self, guild_id + 2)
+        self.member = FakeUser(guild_id + 3, FakeVoiceState(self.voice))
+        self.voice.members.append(self.member)
+
+    async def change_voice_state(self, *, channel: Optional[FakeVoiceChannel], **kwargs: Any) -> None:
+        if channel is None:
+            self.voice_client = None
+
+
+class FakeContext:
+    def __init__(self, guild: FakeGuild) -> None:
+        self.bot = guild.bot
+        self.guild = guild
+        self.author = guild.member
+        self.channel = guild.text
+        self.message = FakeMessage()
+
+    @property
+    def voice_client(self) -> Optional[wavelink.Player]:
+        return self.guild.voice_client
+
+    async def send(self, content: Optional[str] = None, **kwargs: Any) -> FakeMessage:
+        kwargs.pop("ephemeral", None)
+        return await self.channel.send(content, **kwargs)
+
+
+class LoadBot(commands.Bot):
+    """A bot that never logs in, wavelink only needs its user id."""
+    def __init__(self) -> None:
+        super().__init__(command_prefix=".ko", intents=discord.Intents.default())
+        self.fake_user = FakeUser(BASE_ID - 1)
+
+    @property
+    def user(self) -> FakeUser:
+        return self.fake_user
+
+
+class Results:
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Counter] = defaultdict(Counter)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        total = sum(len(samples) for samples in self.latencies.values())
+        report: Dict[str, Any] = {
+            "seconds": round(elapsed, 3),
+            "commands": total,
+            "commands_per_second": round(total / elapsed, 1)
+        }
+        for name, samples in sorted(self.latencies.items()):
+            report[name] = {"count": len(samples), "errors": dict(self.errors[name])}
+            if len(samples) > 1:
+                report[name]["ms"] = percentiles(samples)
+
+        return report
+
+
+async def init_connection(conn: asyncpg.Connection) -> None:
+    # Same codecs as the bot's pool.
+    await conn.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+async def create_playlists(db: asyncpg.Pool, guilds: List[FakeGuild], size: int,
+                           rng: random.Random) -> bool:
+    track_ids = await db.fetchval("SELECT array_agg(track_id) FROM tracks")
+    if not track_ids:
+        return False
+
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            for guild in guilds:
+                playlist_id = await conn.fetchval(
+                    """INSERT INTO playlist (guild_id, user_id, playlist_name)
+                        VALUES ($1, $2, $3) RETURNING playlist_id""",
+                    guild.id, guild.member.id, PLAYLIST_NAME
+                )
+                await conn.executemany(
+                    "INSERT INTO playlist_tracks (playlist_id, track_id) VALUES ($1, $2)",
+                    [(playlist_id, rng.choice(track_ids)) for _ in range(size)]
+                )
+
+    return True
+
+async def drop_playlists(db: asyncpg.Pool) -> None:
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """DELETE FROM playlist_tracks WHERE playlist_id IN
+                    (SELECT playlist_id FROM playlist WHERE guild_id >= $1)""",
+                BASE_ID
+            )
+            await conn.execute("DELETE FROM playlist WHERE guild_id >= $1", BASE_ID)
+
+async def drive(cog: Music, guild: FakeGuild, queries: List[str], commands_count: int,
+                think: float, allowed: Dict[str, int], results: Results,
+                rng: random.Random) -> None:
+    ctx = FakeContext(guild)
+    names, weights = zip(*allowed.items())
+
+    for _ in range(commands_count):
+        # Spread the guilds out instead of firing everything at once.
+        await asyncio.sleep(rng.expovariate(1 / think) if think else 0)
+
+        name = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            if name == "play":
+                await cog.play.callback(cog, ctx, query=rng.choice(queries))
+            elif name == "playlist play":
+                await cog.playlist_play.callback(cog, ctx, PLAYLIST_NAME)
+            elif name == "queue":
+                await cog.queue.callback(cog, ctx)
+            else:
+                await cog.skip.callback(cog, ctx)
+        except Exception as e:
+            results.errors[name][type(e).__name__] += 1
+        results.latencies[name].append((time.perf_counter() - start) * 1000)
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    simulators: List[Simulator] = []
+    runners = []
+    uris = args.lavalink
+    if not uris:
+        uris = []
+        for port in range(args.port, args.port + args.nodes):
+            simulator = Simulator(Settings(args.password, args.latency, args.jitter, args.failure_rate,
+                                           args.missing_rate, args.play_failure_rate, args.track_seconds,
+                                           args.catalog, args.seed))
+            simulators.append(simulator)
+            runners.append(await start(simulator, port=port))
+            uris.append(f"http://127.0.0.1:{port}")
+
+    bot = LoadBot()
+    async with bot:
+        bot.db = await asyncpg.create_pool(user=CONFIG["DB_USER"], database=args.database,
+                                           host="127.0.0.1", init=init_connection,
+                                           max_size=args.pool_size)
+
+        bot.nodes = NodeBalancer([wavelink.Node(uri=uri, password=args.password, inactive_player_timeout=None)
+                                  for uri in uris])
+        await bot.nodes.connect(bot)
+        while len(bot.nodes.connected()) < len(uris):
+            await asyncio.sleep(0.05)
+
+        # Loading the cog warms the pool and builds the search index, like at startup.
+        cog = Music(bot)
+        await bot.add_cog(cog)
+        if args.no_index:
+            cog.listener.stop()
+            cog.index = None
+
+        guilds = [FakeGuild(bot, BASE_ID + i * 10) for i in range(args.guilds)]
+        await drop_playlists(bot.db)
+        allowed = dict(COMMANDS)
+        if not await create_playlists(bot.db, guilds, args.playlist_size, rng):
+            print("No stored tracks in the database, skipping playlist play.")
+            del allowed["playlist play"]
+
+        titles = [row['song_name'] for row in await bot.db.fetch(
+            "SELECT song_name FROM song ORDER BY random() LIMIT $1", args.queries
+        )]
+        # Remote queries miss the library and go through Lavalink searches.
+        queries = titles + [phrase(rng, 3) for _ in range(int(len(titles) * args.remote_share) or args.queries)]
+
+        results = Results()
+        started = time.perf_counter()
+        await asyncio.gather(*(drive(cog, guild, queries, args.commands, args.think, allowed,
+                                     results, random.Random(rng.random())) for guild in guilds))
+        report = results.report(time.perf_counter() - started)
+        report["messages_sent"] = sum(guild.text.sent for guild in guilds)
+        report["node_players"] = {node.identifier: len(node.players) for node in bot.nodes.nodes}
+        if simulators:
+            report["lavalink_requests"] = sum(simulator.requests for simulator in simulators)
+
+        for guild in guilds:
+            if guild.voice_client:
+                await guild.voice_client.disconnect()
+
+        await drop_playlists(bot.db)
+        await bot.remove_cog(cog.qualified_name)
+        bot.nodes.close()
+        await wavelink.Pool.close()
+        await bot.db.close()
+
+    for runner in runners:
+        await runner.cleanup()
+
+    return {
+        "commit": git_commit(),
+        "guilds": args.guilds,
+        "commands_per_guild": args.commands,
+        "lavalink": "simulator" if simulators else uris,
+        "index": not args.no_index,
+        "results": report
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=200)
+    parser.add_argument("--commands", type=int, default=20, help="commands sent by every guild")
+    parser.add_argument("--think", type=float, default=0.5, help="mean seconds between a guild's commands")
+    parser.add_argument("--playlist-size", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=500, help="library titles sampled for play")
+    parser.add_argument("--remote-share", type=float, default=0.25,
+                        help="extra queries, relative to the sampled titles, that only Lavalink can find")
+    parser.add_argument("--no-index", action="store_true", help="search through SQL only")
+    parser.add_argument("--database", default=CONFIG.get("BENCH_DATABASE", "yadmbdb_bench"))
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--lavalink", nargs="+", help="use these nodes instead of in-process simulators")
+    parser.add_argument("--nodes", type=int, default=1, help="in-process simulators to spread players over")
+    parser.add_argument("--password", default=CONFIG["LL_PASS"])
+    parser.add_argument("--port", type=int, default=2334, help="port of the first in-process simulator")
+    parser.add_argument("--latency", type=float, default=20.0)
+    parser.add_argument("--jitter", type=float, default=30.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--missing-rate", type=float, default=0.0)
+    parser.add_argument("--play-failure-rate", type=float, default=0.0)
+    parser.add_argument("--track-seconds", type=float, default=20.0)
+    parser.add_argument("--catalog", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write the JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"Results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,198 @@
+"""Time library ingestion, track search and playlist loads at several library sizes.
+
+Needs a local PostgreSQL database that can be wiped, BENCH_DATABASE in
+config.py (default yadmbdb_bench). Results are written as JSON so runs can
+be compared between commits:
+
+    python -m bench.run --sizes 1000 10000 100000 --output bench/results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+import asyncpg
+
+from pathlib import Path
+from typing import Any, Dict, List
+
+import db_setup
+
+from bench.library import generate
+from cogs.music import SEARCH_LIMIT
+from cogs.utils.repository import PLAYLIST_QUERY, PLAYLIST_TRACKS_QUERY, SEARCH_QUERY
+from cogs.utils.search_index import SONGS_QUERY, SearchIndex
+from cogs.utils.tracks import STORED_PAYLOADS
+from config import CONFIG
+
+
+BENCH_GUILD = 1
+PLAYLIST_SIZES = [50, 500]
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    quantiles = statistics.quantiles(samples, n=100)
+    return {
+        "p50": round(quantiles[49], 3),
+        "p95": round(quantiles[94], 3),
+        "p99": round(quantiles[98], 3)
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+async def connect() -> asyncpg.Connection:
+    return await asyncpg.connect(user=CONFIG["DB_USER"],
+                                 database=CONFIG.get("BENCH_DATABASE", "yadmbdb_bench"),
+                                 host="127.0.0.1")
+
+async def reset(conn: asyncpg.Connection) -> None:
+    await conn.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+    await db_setup.migrate(conn)
+
+async def bench_ingest(conn: asyncpg.Connection, library: Path, workers: int) -> Dict[str, Any]:
+    start = time.perf_counter()
+    await db_setup.sync_lib(conn, {}, db_setup.walk_lib(library), workers)
+    elapsed = time.perf_counter() - start
+
+    songs = await conn.fetchval("SELECT count(*) FROM song")
+    await conn.execute("ANALYZE")
+
+    return {
+        "seconds": round(elapsed, 3),
+        "songs": songs,
+        "files_per_second": round(songs / elapsed, 1)
+    }
+
+async def search_queries(conn: asyncpg.Connection, count: int, rng: random.Random) -> List[str]:
+    """Partial titles and artist names, the way people type them into /play."""
+    rows = await conn.fetch(
+        """SELECT song_name, artist_name FROM song
+            LEFT JOIN artist ON song.artist_id = artist.artist_id
+            ORDER BY random() LIMIT $1""",
+        count
+    )
+
+    queries = []
+    for row in rows:
+        text = row['song_name'] if rng.random() < 0.7 else row['artist_name']
+        queries.append(text[:rng.randint(min(4, len(text)), len(text))])
+
+    return queries
+
+async def bench_search(conn: asyncpg.Connection, queries: List[str]) -> Dict[str, Any]:
+    database = []
+    for query in queries:
+        start = time.perf_counter()
+        await conn.fetch(SEARCH_QUERY, query, f"%{query}%", SEARCH_LIMIT)
+        database.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    index = SearchIndex.from_records(await conn.fetch(SONGS_QUERY))
+    build = time.perf_counter() - start
+
+    memory = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, SEARCH_LIMIT)
+        memory.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "queries": len(queries),
+        "database_ms": percentiles(database),
+        "index_build_seconds": round(build, 3),
+        "index_ms": percentiles(memory)
+    }
+
+async def bench_playlists(conn: asyncpg.Connection, rng: random.Random,
+                          repeats: int) -> Dict[str, Any]:
+    """The database side of playlist play, up to the first resolved window."""
+    track_ids = await conn.fetchval("SELECT array_agg(track_id) FROM tracks")
+    results = {}
+
+    for size in PLAYLIST_SIZES:
+        if size > len(track_ids):
+            continue
+
+        name = f"bench-{size}"
+        playlist_id = await conn.fetchval(
+            """INSERT INTO playlist (guild_id, user_id, playlist_name)
+                VALUES ($1, $1, $2) RETURNING playlist_id""",
+            BENCH_GUILD, name
+        )
+        await conn.executemany(
+            "INSERT INTO playlist_tracks (playlist_id, track_id) VALUES ($1, $2)",
+            [(playlist_id, track_id) for track_id in rng.sample(track_ids, size)]
+        )
+
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            playlist = await conn.fetchrow(PLAYLIST_QUERY, name, BENCH_GUILD)
+            tracks = await conn.fetch(PLAYLIST_TRACKS_QUERY, playlist['playlist_id'])
+            await conn.fetch(STORED_PAYLOADS, [track['track_uri'] for track in tracks[:CONFIG.get("QUEUE_WINDOW", 5)]])
+            samples.append((time.perf_counter() - start) * 1000)
+
+        results[str(size)] = percentiles(samples)
+
+    return results
+
+async def run(sizes: List[int], library_root: Path, workers: int,
+              queries: int, seed: int) -> Dict[str, Any]:
+    conn = await connect()
+    rng = random.Random(seed)
+    results = []
+
+    for size in sizes:
+        library = library_root / str(size)
+        generate(library, size, seed)
+
+        await reset(conn)
+        print(f"Benchmarking {size} songs")
+        results.append({
+            "songs": size,
+            "ingest": await bench_ingest(conn, library, workers),
+            "search": await bench_search(conn, await search_queries(conn, queries, rng)),
+            "playlist_load_ms": await bench_playlists(conn, rng, queries // 10 or 1)
+        })
+
+    server = await conn.fetchval("SHOW server_version")
+    await conn.close()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "postgresql": server,
+        "cpus": os.cpu_count(),
+        "workers": workers,
+        "results": results
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    parser.add_argument("--library", type=Path,
+                        default=Path(tempfile.gettempdir()) / "yadmb-bench-library",
+                        help="where synthetic libraries are generated, they are reused between runs")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write the JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.sizes, args.library, args.workers, args.queries, args.seed))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"Results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,85 @@
+"""Memory footprint and query latency of the in-memory search index.
+
+Run from the repository root:
+
+    python -m bench.search_index --songs 100000
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+import tracemalloc
+
+from cogs.utils.search_index import SearchIndex
+
+
+SYLLABLES = [c + v for c in "bcdfghjklmnprstvwz" for v in "aeiou"]
+
+
+def word(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3)))
+
+def phrase(rng: random.Random, words: int) -> str:
+    return " ".join(word(rng) for _ in range(rng.randint(1, words))).title()
+
+def build(songs: int, seed: int) -> tuple[SearchIndex, list[str]]:
+    rng = random.Random(seed)
+    artists = [phrase(rng, 2) for _ in range(max(1, songs // 50))]
+    albums = [phrase(rng, 3) for _ in range(max(1, songs // 10))]
+
+    index = SearchIndex()
+    titles = []
+    for song_id in range(songs):
+        title = phrase(rng, 4)
+        titles.append(title)
+        index.add(song_id, title, rng.choice(artists), rng.choice(albums),
+                  f"/music/{song_id:08}.flac")
+
+    return index, titles
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--songs", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    build(args.songs, args.seed)
+    build_time = time.perf_counter() - start
+
+    # Built a second time since tracing slows the build down considerably.
+    # The titles kept for queries share their strings with the index.
+    tracemalloc.start()
+    index, titles = build(args.songs, args.seed)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rng = random.Random(args.seed + 1)
+    latencies = []
+    for _ in range(args.queries):
+        title = rng.choice(titles)
+        # Autocomplete style partial input.
+        query = title[:rng.randint(3, len(title))] if len(title) > 3 else title
+
+        start = time.perf_counter()
+        index.search(query, 25)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(json.dumps({
+        "songs": args.songs,
+        "build_seconds": round(build_time, 3),
+        "memory_bytes": memory,
+        "memory_bytes_per_100k_songs": round(memory * 100_000 / args.songs),
+        "query_ms": {
+            "p50": round(quantiles[49], 3),
+            "p95": round(quantiles[94], 3),
+            "p99": round(quantiles[98], 3)
+        }
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
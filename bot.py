@@ -1,39 +1,93 @@
+import argparse
 import asyncio
+import json
 import logging
+import signal
+import time
 import asyncpg
 import discord
 import wavelink
 
 from discord.ext import commands
+from pathlib import Path
+from typing import List, Optional
 
+from cogs.utils import metrics, shards
+from cogs.utils.startup import phases
+from cogs.utils.nodes import NodeBalancer, configured_nodes
+from cogs.utils.now_playing import NowPlayingManager
 from config import CONFIG
 
 
 cogs = {
-    "cogs.music"
+    "cogs.music",
+    "cogs.sessions"
 }
 
-class Bot(commands.Bot):
-    def __init__(self) -> None:
+async def init_connection(conn: asyncpg.Connection) -> None:
+    await conn.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+    conn.add_query_logger(metrics.record_query)
+
+
+class Bot(commands.AutoShardedBot):
+    def __init__(self, shard_ids: Optional[List[int]] = None, shard_count: Optional[int] = None,
+                 process: int = 0, pool_size: int = 10, lavalink_connections: int = 100,
+                 heartbeat: Optional[Path] = None) -> None:
         intents: discord.Intents = discord.Intents.default()
         intents.message_content = True
 
         discord.utils.setup_logging(level=logging.INFO)
-        super().__init__(command_prefix=".ko", intents=intents)
+        super().__init__(command_prefix=".ko", intents=intents,
+                         shard_ids=shard_ids, shard_count=shard_count)
+
+        # Set by supervisor.py when several processes share the host.
+        self.process = process
+        self.pool_size = pool_size
+        self.lavalink_connections = lavalink_connections
+        self.heartbeat = heartbeat
+        self.now_playing = NowPlayingManager()
+        self.setup_done: Optional[float] = None
 
 
     async def setup_hook(self) -> None:
-        for cog in cogs:
-            try:
-                await self.load_extension(cog)
-            except Exception as e:
-                print(f"{type(e).__name__} : {e}")
+        # Lavalink connects in the background, cogs only need the database
+        # to warm up and may load while Lavalink is still connecting.
+        self.nodes = NodeBalancer(configured_nodes(self.lavalink_connections))
+        lavalink = asyncio.create_task(self.connect_lavalink())
+
+        async with phases.phase("database"):
+            # Every connection of the pool is opened here, not on first use.
+            pool = await asyncpg.create_pool(user=CONFIG["DB_USER"], database=CONFIG["DB_DATABASE"], host="127.0.0.1",
+                                             init=init_connection, min_size=self.pool_size, max_size=self.pool_size)
+            self.db: metrics.TimedPool = metrics.TimedPool(pool)
+
+        async with phases.phase("cogs"):
+            for cog in cogs:
+                try:
+                    await self.load_extension(cog)
+                except Exception as e:
+                    print(f"{type(e).__name__} : {e}")
 
-        nodes = [wavelink.Node(uri=CONFIG["LL_HOST"], password=CONFIG["LL_PASS"])]
+        await lavalink
 
-        await wavelink.Pool.connect(nodes=nodes, client=self, cache_capacity=100)
+        if CONFIG.get("METRICS_PORT"):
+            # Every process on the host gets its own port.
+            await metrics.serve(CONFIG["METRICS_PORT"] + self.process)
 
-        self.db: asyncpg.pool.Pool = await asyncpg.create_pool(user=CONFIG["DB_USER"], database=CONFIG["DB_DATABASE"], host="127.0.0.1")
+        if self.heartbeat:
+            self.heartbeat_task = asyncio.create_task(shards.beat(self, self.heartbeat, self.process))
+
+        self.setup_done = time.perf_counter()
+
+    async def connect_lavalink(self) -> None:
+        async with phases.phase("lavalink"):
+            await self.nodes.connect(self)
+
+    async def on_ready(self) -> None:
+        # Fired again after every reconnect, only the first one ends startup.
+        if self.setup_done is not None and "total" not in phases.times:
+            phases.record("gateway", time.perf_counter() - self.setup_done)
+            phases.done()
 
     async def on_wavelink_track_start(self, payload: wavelink.TrackStartEventPayload) -> None:
         player: wavelink.Player | None = payload.player
@@ -56,9 +110,47 @@ class Bot(commands.Bot):
         if track.album.name:
             embed.add_field(name="Album", value=track.album.name)
 
-        await player.home.send(embed=embed)
-
-bot = Bot()
+        self.now_playing.update(player.guild.id, player.home, track.encoded, embed)
+
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState,
+                                    after: discord.VoiceState) -> None:
+        # However the player left, by command, kick or lost connection.
+        if member.id == self.user.id and after.channel is None:
+            self.now_playing.forget(member.guild.id)
+
+    async def on_wavelink_inactive_player(self, player: wavelink.Player) -> None:
+        self.now_playing.forget(player.guild.id)
+
+    async def close(self) -> None:
+        self.now_playing.close()
+        await super().close()
+
+parser = argparse.ArgumentParser(description="Run the bot, or some of its shards next to supervisor.py.")
+parser.add_argument("--shard-ids", type=int, nargs="+", help="shards run by this process, all of them by default")
+parser.add_argument("--shard-count", type=int, help="shards across every process, needed with --shard-ids")
+parser.add_argument("--process", type=int, default=0, help="index of this process on the host")
+parser.add_argument("--pool-size", type=int, default=CONFIG.get("DB_POOL_SIZE", 10),
+                    help="database connections kept by this process")
+parser.add_argument("--lavalink-connections", type=int, default=CONFIG.get("LL_CONNECTIONS", 100),
+                    help="concurrent requests this process makes to each Lavalink node")
+parser.add_argument("--heartbeat", type=Path, help="keep writing shard health to this file")
+args = parser.parse_args()
+if args.shard_ids and not args.shard_count:
+    parser.error("--shard-ids needs --shard-count")
+
+bot = Bot(args.shard_ids, args.shard_count, args.process, args.pool_size,
+          args.lavalink_connections, args.heartbeat)
+
+@bot.before_invoke
+async def start_command_timer(ctx: commands.Context) -> None:
+    ctx.started = time.perf_counter()
+
+@bot.after_invoke
+async def record_command_time(ctx: commands.Context) -> None:
+    started = getattr(ctx, "started", None)
+    if started is not None:
+        status = "error" if ctx.command_failed else "ok"
+        metrics.COMMAND_LATENCY.observe(time.perf_counter() - started, ctx.command.qualified_name, status)
 
 @bot.command(name="sync")
 async def slash_sync(ctx: commands.Context) -> None:
@@ -73,6 +165,8 @@ async def ping(ctx: commands.Context) -> None:
 
 
 async def main() -> None:
+    # Shut down cleanly on SIGTERM too, so the sessions cog saves the players first.
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(bot.close()))
     async with bot:
         await bot.start(CONFIG["BOT_TOKEN"])
 
@@ -0,0 +1,81 @@
+"""Build the local library similarity model the bot keeps playing from once a queue runs out.
+
+Songs are linked by how often they sit close together in playlists, by
+shared albums and artists, and by genre and year. The result is a
+directory of NumPy arrays the bot memory maps at startup. Run it after
+db_setup.py, and again whenever the library or the playlists have changed
+enough to matter.
+"""
+import argparse
+import asyncio
+import time
+import asyncpg
+
+from pathlib import Path
+from typing import Dict, List
+
+from cogs.utils.recommend import build, save
+from config import CONFIG
+
+
+# "Unknown" is what db_setup.py stores for a missing tag, it groups nothing.
+# The payload is what the bot stored when the song was last resolved.
+SONGS_QUERY = """
+    SELECT song_path, song_genre, song_year,
+           CASE WHEN song_encoded IS NOT NULL
+               THEN (jsonb_build_object('encoded', song_encoded) || song_info)::text END AS payload,
+           CASE WHEN artist_name <> 'Unknown' THEN song.artist_id END AS artist_id,
+           CASE WHEN album_name <> 'Unknown' THEN song.album_id END AS album_id
+    FROM song
+        LEFT JOIN artist ON song.artist_id = artist.artist_id
+        LEFT JOIN album ON song.album_id = album.album_id
+"""
+PLAYLISTS_QUERY = """
+    SELECT playlist_id, track_uri FROM playlist_tracks
+        INNER JOIN tracks ON playlist_tracks.track_id = tracks.track_id
+        ORDER BY playlist_id, playlist_track_id
+"""
+
+
+async def run(output: Path) -> None:
+    conn: asyncpg.connection.Connection = await asyncpg.connect(user=CONFIG["DB_USER"],
+                                                                database=CONFIG["DB_DATABASE"],
+                                                                host="127.0.0.1")
+    try:
+        songs = await conn.fetch(SONGS_QUERY)
+        entries = await conn.fetch(PLAYLISTS_QUERY)
+    finally:
+        await conn.close()
+
+    start = time.perf_counter()
+    rows = {song['song_path']: row for row, song in enumerate(songs)}
+    playlists: Dict[int, List[int]] = {}
+    for entry in entries:
+        # Remote tracks aren't in the library, the songs around them still count.
+        row = rows.get(entry['track_uri'])
+        if row is not None:
+            playlists.setdefault(entry['playlist_id'], []).append(row)
+
+    model = build([song['song_path'] for song in songs],
+                  [song['artist_id'] for song in songs],
+                  [song['album_id'] for song in songs],
+                  [song['song_genre'] for song in songs],
+                  [song['song_year'] for song in songs],
+                  [song['payload'] for song in songs],
+                  list(playlists.values()))
+    save(model, output)
+
+    size = sum(array.nbytes for array in model.values())
+    playable = sum(song['payload'] is not None for song in songs)
+    print(f"Built neighbours for {len(songs)} songs from {len(playlists)} playlists "
+          f"in {time.perf_counter() - start:.1f}s, {size / 2 ** 20:.1f} MiB in {output}.")
+    print(f"{playable} songs can be picked, the others haven't been played yet.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", type=Path, default=Path(CONFIG.get("RECOMMEND_MODEL", "recommend")),
+                        help="directory to write the model to")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.output))
@@ -0,0 +1,121 @@
+"""Fail if any query the bot runs plans a sequential scan on a large table.
+
+Every query is run under EXPLAIN ANALYZE inside a transaction that is rolled
+back, with parameters taken from rows that exist in the database. Run it
+after db_setup.py against a database with a realistically sized library.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import asyncpg
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Tuple
+
+from cogs.music import PLAYLIST_PAGE, SEARCH_LIMIT
+from cogs.sessions import SESSIONS_QUERY
+from cogs.utils.repository import (ALBUM_SEARCH_QUERY, ALBUM_TRACKS_QUERY, CREATE_PLAYLIST, IMPORT_MATCH_QUERY,
+                                   IMPORT_TRACK_IDS, PLAYLIST_PAGE_QUERY, PLAYLIST_PREVIOUS_PAGE_QUERY,
+                                   PLAYLIST_QUERY, PLAYLIST_SIZE_QUERY, PLAYLIST_TRACKS_QUERY, SEARCH_QUERY,
+                                   TRACK_SEARCH_QUERY)
+from cogs.utils.search_index import CHANGED_SONGS_QUERY
+from cogs.utils.tracks import (FORGET_SONG, FORGET_TRACK, SONG_GAIN, STORE_SONG, STORE_TRACK,
+                               STORED_PAYLOAD, STORED_PAYLOADS)
+from config import CONFIG
+from db_setup import CLAIM_SHARD, SHARD_ATTEMPTS, SHARD_SONGS, SHARD_TIMEOUT, SONGS_BY_HASH
+
+
+async def sample(conn: asyncpg.Connection) -> Dict[str, Any]:
+    song = await conn.fetchrow("SELECT song_name, song_path FROM song LIMIT 1")
+    album = await conn.fetchrow("SELECT album_id, album_name FROM album LIMIT 1")
+    playlist = await conn.fetchrow("SELECT playlist_id, guild_id, playlist_name FROM playlist LIMIT 1")
+    track = await conn.fetchrow("SELECT track_name, track_uri FROM tracks LIMIT 1")
+
+    return {
+        "song_name": song['song_name'] if song else "song",
+        "song_path": song['song_path'] if song else "/song.flac",
+        "album_id": album['album_id'] if album else 0,
+        "album_name": album['album_name'] if album else "album",
+        "playlist_id": playlist['playlist_id'] if playlist else 0,
+        "guild_id": playlist['guild_id'] if playlist else 0,
+        "playlist_name": playlist['playlist_name'] if playlist else "playlist",
+        "track_name": track['track_name'] if track else "track",
+        "track_uri": track['track_uri'] if track else "/track.flac",
+    }
+
+def checks(values: Dict[str, Any]) -> List[Tuple[str, str, tuple]]:
+    song, album, track = values['song_name'], values['album_name'], values['track_name']
+    return [
+        ("search_track", SEARCH_QUERY, (song, f"%{song}%", SEARCH_LIMIT)),
+        ("playlist lookup", PLAYLIST_QUERY, (values['playlist_name'], values['guild_id'])),
+        ("playlist tracks", PLAYLIST_TRACKS_QUERY, (values['playlist_id'],)),
+        ("playlist page", PLAYLIST_PAGE_QUERY, (values['playlist_id'], 0, PLAYLIST_PAGE)),
+        ("playlist prev page", PLAYLIST_PREVIOUS_PAGE_QUERY, (values['playlist_id'], 2 ** 31 - 1, PLAYLIST_PAGE)),
+        ("playlist size", PLAYLIST_SIZE_QUERY, (values['playlist_id'],)),
+        ("playlist create", CREATE_PLAYLIST, (values['guild_id'], 0, values['playlist_name'])),
+        ("playlist add search", TRACK_SEARCH_QUERY, (f"%{track}%", track, SEARCH_LIMIT)),
+        ("album search", ALBUM_SEARCH_QUERY, (f"%{album}%", album, SEARCH_LIMIT)),
+        ("album tracks", ALBUM_TRACKS_QUERY, (values['album_id'],)),
+        ("playlist import", IMPORT_MATCH_QUERY, ([values['song_path'], "/missing.flac"],
+                                                 [None, song], [None, None])),
+        ("import track ids", IMPORT_TRACK_IDS, ([values['song_path']],)),
+        ("stored payloads", STORED_PAYLOADS, ([values['track_uri']],)),
+        ("stored payload", STORED_PAYLOAD, (values['song_path'],)),
+        ("store track", STORE_TRACK, (values['track_uri'], "encoded", "{}")),
+        ("store song", STORE_SONG, (values['song_path'], "encoded", "{}")),
+        ("forget track", FORGET_TRACK, (values['track_uri'],)),
+        ("forget song", FORGET_SONG, (values['song_path'],)),
+        ("song gain", SONG_GAIN, (values['song_path'],)),
+        ("index refresh", CHANGED_SONGS_QUERY, (datetime.now(timezone.utc),)),
+        ("session restore", SESSIONS_QUERY, ([values['guild_id']],)),
+        ("ingest claim", CLAIM_SHARD, ("check_plans", SHARD_TIMEOUT, SHARD_ATTEMPTS)),
+        ("shard songs", SHARD_SONGS, ([os.path.dirname(values['song_path'])],)),
+        ("moved songs", SONGS_BY_HASH, (["hash"],)),
+    ]
+
+def plan_nodes(plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from plan_nodes(child)
+
+async def run(min_rows: int) -> bool:
+    conn: asyncpg.connection.Connection = await asyncpg.connect(user=CONFIG["DB_USER"],
+                                                                database=CONFIG["DB_DATABASE"],
+                                                                host="127.0.0.1")
+
+    sizes = {row['relname']: row['reltuples'] for row in await conn.fetch(
+        "SELECT relname, reltuples FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace"
+    )}
+    large = {name for name, rows in sizes.items() if rows >= min_rows}
+
+    ok = True
+    for name, query, params in checks(await sample(conn)):
+        tr = conn.transaction()
+        await tr.start()
+        try:
+            result = await conn.fetchval(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}", *params)
+        finally:
+            await tr.rollback()
+
+        plan = json.loads(result)[0]
+        scans = [node['Relation Name'] for node in plan_nodes(plan['Plan'])
+                 if node['Node Type'] == "Seq Scan" and node['Relation Name'] in large]
+
+        status = "FAIL" if scans else "ok"
+        print(f"{status:4} {name:20} {plan['Execution Time']:8.2f} ms"
+              + (f"  seq scan on {', '.join(scans)}" if scans else ""))
+        ok = ok and not scans
+
+    await conn.close()
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--min-rows", type=int, default=10_000,
+                        help="tables with at least this many rows count as large")
+    args = parser.parse_args()
+
+    sys.exit(0 if asyncio.run(run(args.min_rows)) else 1)
@@ -1,11 +1,68 @@
 from dataclasses import field
+import asyncio
+import itertools
+import logging
+import math
 import discord
 import wavelink
 
-from typing import Dict, cast, List, Optional
+from collections import deque
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterator, cast, List, Optional
+from discord import app_commands
 from discord.ext import commands
 from discord.ui import Button, View
 
+from cogs.utils import metrics
+from cogs.utils.listener import Listener
+from cogs.utils.repository import Repository
+from cogs.utils.search_index import SONGS_QUERY, SearchIndex
+from cogs.utils.startup import phases
+from cogs.utils.tracks import TrackRef, TrackStore, search, split_payload
+from config import CONFIG
+
+if TYPE_CHECKING:
+    from cogs.utils.recommend import Recommendations
+
+
+log = logging.getLogger(__name__)
+
+
+SEARCH_LIMIT = 5
+AUTOCOMPLETE_LIMIT = 25
+# Lavalink searches allowed in flight while loading a playlist or album.
+RESOLVE_CONCURRENCY = CONFIG.get("RESOLVE_CONCURRENCY", 8)
+# Resolved tracks kept in the player's queue ahead of playback, the rest of a
+# playlist or album waits as unresolved refs.
+QUEUE_WINDOW = CONFIG.get("QUEUE_WINDOW", 5)
+QUEUE_PAGE = 15
+PLAYLIST_PAGE = 15
+# Seconds the page buttons stay usable.
+PAGINATOR_TIMEOUT = 300
+# Evens out the loudness of local songs with their ReplayGain tags.
+NORMALIZE_LOUDNESS = CONFIG.get("NORMALIZE_LOUDNESS", True)
+# Failed tracks listed by name after loading a playlist.
+FAILED_SHOWN = 5
+# Entries read from an imported playlist file.
+IMPORT_LIMIT = 5000
+# Directory of the model built by build_recommendations.py, local songs
+# picked from it keep the music going once the queue runs out.
+RECOMMEND_MODEL = Path(CONFIG.get("RECOMMEND_MODEL", "recommend"))
+# Recently played tracks that won't be picked again.
+RECENT_TRACKS = 50
+
+def duration(length: Optional[int]) -> str:
+    """Format a length in milliseconds as ``m:ss`` or ``h:mm:ss``."""
+    if length is None:
+        return "?:??"
+
+    minutes, seconds = divmod(length // 1000, 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02}:{seconds:02}"
+
+    return f"{minutes}:{seconds:02}"
+
 
 class ChoiceButton(Button['Choice']):
     def __init__(self, label, choice: int):
@@ -41,9 +98,264 @@ class MusicChoicePicker(View):
         self.stop()
 
 
+class Paginator(View):
+    """Flips through the pages of an embed with previous and next buttons.
+
+    Subclasses build the pages in :meth:`page`, which is only called for
+    the page being shown.
+    """
+    def __init__(self, total: int, size: int, current: int = 0, length: Optional[int] = None) -> None:
+        super().__init__(timeout=PAGINATOR_TIMEOUT)
+        self.total = total
+        self.size = size
+        self.current = current
+        # Milliseconds for every entry together, if known.
+        self.length = length
+        self.message: Optional[discord.Message] = None
+
+    @property
+    def pages(self) -> int:
+        return max(math.ceil(self.total / self.size), 1)
+
+    async def page(self, number: int, step: int) -> discord.Embed:
+        """Build page `number`, `step` is how many pages away the shown one is."""
+        raise NotImplementedError
+
+    def footer(self, embed: discord.Embed) -> discord.Embed:
+        text = f"Page {self.current + 1}/{self.pages} ({self.total} songs"
+        if self.length:
+            text += f", {duration(self.length)}"
+
+        return embed.set_footer(text=text + ")")
+
+    def update_buttons(self) -> None:
+        self.previous.disabled = self.current <= 0
+        self.next.disabled = self.current >= self.pages - 1
+
+    async def start(self, ctx: commands.Context) -> None:
+        embed = await self.page(self.current, 0)
+        self.update_buttons()
+        if self.pages == 1:
+            # Nothing to flip through.
+            await ctx.send(embed=embed)
+            self.stop()
+            return
+
+        self.message = await ctx.send(embed=embed, view=self)
+
+    async def turn(self, interaction: discord.Interaction, step: int) -> None:
+        number = min(max(self.current + step, 0), self.pages - 1)
+        embed = await self.page(number, number - self.current)
+        self.current = number
+        self.update_buttons()
+
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.gray)
+    async def previous(self, interaction: discord.Interaction, button: Button):
+        await self.turn(interaction, -1)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.gray)
+    async def next(self, interaction: discord.Interaction, button: Button):
+        await self.turn(interaction, 1)
+
+    async def on_timeout(self) -> None:
+        if self.message is None:
+            return
+
+        try:
+            await self.message.edit(view=None)
+        except discord.HTTPException:
+            pass
+
+
+class PlaylistPages(Paginator):
+    """Pages of a stored playlist, each fetched on its own by keyset."""
+    def __init__(self, repo: Repository, playlist_id: int, name: str, total: int, length: Optional[int]) -> None:
+        super().__init__(total, PLAYLIST_PAGE, length=length)
+        self.repo = repo
+        self.playlist_id = playlist_id
+        self.name = name
+        # Bounds of the page being shown.
+        self.first_id = 0
+        self.last_id = 0
+
+    async def page(self, number: int, step: int) -> discord.Embed:
+        if number == 0:
+            tracks = await self.repo.playlist_page(self.playlist_id, 0, self.size)
+        elif step < 0:
+            tracks = await self.repo.playlist_page_before(self.playlist_id, self.first_id, self.size)
+        elif step > 0:
+            tracks = await self.repo.playlist_page(self.playlist_id, self.last_id, self.size)
+        else:
+            # The same page again.
+            tracks = await self.repo.playlist_page(self.playlist_id, self.first_id - 1, self.size)
+
+        if tracks:
+            self.first_id = tracks[0]['playlist_track_id']
+            self.last_id = tracks[-1]['playlist_track_id']
+
+        start = number * self.size
+        embed = discord.Embed(title=self.name)
+        embed.description = "".join(f"{i}). {track['track_name']} `{duration(track['track_length'])}`\n"
+                                    for i, track in enumerate(tracks, start + 1))
+        self.current = number
+        return self.footer(embed)
+
+
+class QueuePages(Paginator):
+    """Pages of a player's queue, sliced out when they are shown."""
+    def __init__(self, player: wavelink.Player, current: int = 0) -> None:
+        super().__init__(0, QUEUE_PAGE, current)
+        self.player = player
+        self.total = self.size_now()
+        self.current = min(max(current, 0), self.pages - 1)
+
+    def size_now(self) -> int:
+        return len(self.player.queue) + len(getattr(self.player, "pending", ()))
+
+    def upcoming(self) -> Iterator[wavelink.Playable | TrackRef]:
+        return itertools.chain(self.player.queue, getattr(self.player, "pending", ()))
+
+    async def page(self, number: int, step: int) -> discord.Embed:
+        # The queue moves on between pages.
+        self.total = self.size_now()
+        self.length = sum(track.length or 0 for track in self.upcoming())
+        number = min(number, self.pages - 1)
+        start = number * self.size
+
+        # Queued refs are listed as they are, nothing gets resolved for this.
+        entries = itertools.islice(self.upcoming(), start, start + self.size)
+
+        embed = discord.Embed(title="Queue")
+        embed.description = "".join(f"{i}). {track.title} - {track.author or 'Unknown'} `{duration(track.length)}`\n"
+                                    for i, track in enumerate(entries, start + 1))
+        self.current = number
+        return self.footer(embed)
+
+
 class Music(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.index: Optional[SearchIndex] = None
+        self.index_lock = asyncio.Lock()
+        self.listener: Optional[Listener] = None
+        self.repo = Repository(bot)
+        self.recommend: Optional["Recommendations"] = None
+        self.tracks = TrackStore(bot, CONFIG.get("TRACK_CACHE_SIZE", 1000))
+
+    async def cog_load(self) -> None:
+        # setup_hook connects the database before loading cogs, so the
+        # first commands after a restart find everything warm.
+        async with phases.phase("statements"):
+            await self.repo.warm()
+
+        async with phases.phase("search index"):
+            await self.refresh_index(None)
+
+        async with phases.phase("recommendations"):
+            self.load_recommendations()
+
+        self.listener = Listener(self.bot.db)
+        self.listener.add("library_changed", self.refresh_index)
+        self.repo.listen(self.listener)
+        self.listener.start()
+
+    async def cog_unload(self) -> None:
+        if self.listener:
+            self.listener.stop()
+
+    def load_recommendations(self) -> None:
+        if not RECOMMEND_MODEL.is_dir():
+            return
+
+        try:
+            from cogs.utils.recommend import Recommendations
+        except ImportError:
+            log.warning("The recommendation model needs numpy, install it with `pip install numpy`.")
+            return
+
+        try:
+            # Mapped, pages are read in as lookups touch them.
+            self.recommend = Recommendations.load(RECOMMEND_MODEL)
+        except (OSError, ValueError) as e:
+            log.warning("Loading the recommendation model failed: %s", e)
+        else:
+            log.info("Loaded recommendations for %d songs.", len(self.recommend))
+
+    async def refresh_index(self, payload: Optional[str]) -> None:
+        async with self.index_lock:
+            async with self.bot.db.acquire() as db:
+                if self.index is None:
+                    records = await db.fetch(SONGS_QUERY)
+                    # Building the full index is CPU bound, keep the bot responsive.
+                    self.index = await asyncio.to_thread(SearchIndex.from_records, records)
+                else:
+                    await self.index.refresh(db)
+
+    @commands.Cog.listener()
+    async def on_wavelink_track_exception(self, payload: wavelink.TrackExceptionEventPayload) -> None:
+        # The stored payload is stale, resolve it again next time.
+        uri = getattr(payload.track.extras, "uri", None)
+        if uri:
+            await self.tracks.forget(uri)
+
+    @commands.Cog.listener()
+    async def on_wavelink_track_start(self, payload: wavelink.TrackStartEventPayload) -> None:
+        player = payload.player
+        if not player:
+            return
+
+        if NORMALIZE_LOUDNESS:
+            await self.normalize(player, payload.track)
+
+        if not getattr(player, "pending", None):
+            return
+
+        failed = await self.fill_queue(player)
+        if failed:
+            await player.home.send(f"Skipped {len(failed)} tracks that could not be loaded.")
+
+    @commands.Cog.listener()
+    async def on_wavelink_track_end(self, payload: wavelink.TrackEndEventPayload) -> None:
+        player = payload.player
+        if not player or self.recommend is None or payload.reason != "finished":
+            return
+
+        if player.queue or getattr(player, "pending", None):
+            return
+
+        uri = getattr(payload.track.extras, "uri", None)
+        if not uri:
+            return
+
+        recent = {getattr(track.extras, "uri", None) for track in player.queue.history[-RECENT_TRACKS:]}
+        found = self.recommend.next(uri, recent)
+        if found is None:
+            metrics.RECOMMENDATIONS.inc("none")
+            return
+
+        # Built from the payload kept in the model, without asking the
+        # database or Lavalink.
+        track = self.tracks.build(*found)
+        if track is None:
+            metrics.RECOMMENDATIONS.inc("dropped")
+            return
+
+        await player.play(track)
+        metrics.RECOMMENDATIONS.inc("played")
+
+    async def normalize(self, player: wavelink.Player, track: wavelink.Playable) -> None:
+        """Scale the player by the track's gain, on top of the volume users set."""
+        uri = getattr(track.extras, "uri", None) or track.uri
+        level = await self.tracks.level(uri) if uri else 1.0
+
+        filters = player.filters
+        if (filters.volume or 1.0) == level:
+            return
+
+        filters.volume = level
+        await player.set_filters(filters)
 
     @commands.hybrid_command()
     async def skip(self, ctx: commands.Context) -> None:
@@ -83,6 +395,7 @@ class Music(commands.Cog):
             return
 
         await player.disconnect()
+        ctx.bot.now_playing.forget(ctx.guild.id)
         try:
             await ctx.message.add_reaction("\u2705")
         except discord.NotFound:
@@ -108,25 +421,19 @@ class Music(commands.Cog):
         await ctx.send(f"Adjusted the volume to: `{value}`.")
     
     @commands.hybrid_command()
-    async def queue(self, ctx: commands.Context) -> None:
+    async def queue(self, ctx: commands.Context, page: int = 1) -> None:
         """Lists the songs currently in the queue."""
         player: wavelink.Player = cast(wavelink.Player, ctx.voice_client)
         if not player:
             await ctx.send("No one is currently playing anything.")
             return
-        
-        embed = discord.Embed(title="Queue")
-        queue_size = len(player.queue)
-        queue_limit = 15
 
-        if queue_size <= 15:
-            queue_limit = len(player.queue)
-        elif queue_size == 0:
+        pages = QueuePages(player, page - 1)
+        if pages.total == 0:
             await ctx.send("There is nothing in the queue")
             return
 
-        embed.add_field(name="", value="".join(f"{i + 1}). {player.queue[i].title} - {player.queue[i].author}\n" for i in range(0, queue_limit)))
-        await ctx.send(embed=embed)
+        await pages.start(ctx)
 
     @commands.hybrid_command(name="play")
     async def play(self, ctx: commands.Context, *, query: str) -> None:
@@ -153,12 +460,23 @@ class Music(commands.Cog):
             else:
                 track: wavelink.Playable = tracks[0]
 
-            await player.queue.put_wait(track)
+            if player.pending or player.fill_lock.locked():
+                # Keep the song behind the playlist that is still being loaded.
+                player.pending.append(TrackRef.from_track(track))
+            else:
+                await player.queue.put_wait(track)
             await ctx.send(f"Added **`{track.title}`** to the queue.")
 
         if not player.playing:
-            # Play now since we aren't playing anything...
-            await player.play(player.queue.get(), volume=30)
+            if player.queue:
+                # Play now since we aren't playing anything...
+                await player.play(player.queue.get(), volume=30)
+            else:
+                # Queued behind refs, playback starts with the first one that
+                # resolves, after any fill that is already running.
+                failed = await self.fill_queue(player)
+                if failed:
+                    await ctx.send(f"Skipped {len(failed)} tracks that could not be loaded.")
 
         # Optionally delete the invokers message...
         try:
@@ -166,6 +484,11 @@ class Music(commands.Cog):
         except discord.HTTPException:
             pass
     
+    @play.autocomplete("query")
+    async def play_autocomplete(self, interaction: discord.Interaction,
+                                current: str) -> List[app_commands.Choice[str]]:
+        return self.track_choices(current)
+
     @commands.hybrid_group(name="playlist")
     async def playlist(self, ctx: commands.Context) -> None:
         pass
@@ -173,178 +496,145 @@ class Music(commands.Cog):
     @playlist.command(name="create")
     async def playlist_create(self, ctx: commands.Context, name: str) -> None:
         """Create a playlist in this server."""
-        async with self.bot.db.acquire() as db:
-            search_query = """
-                SELECT COUNT(playlist_id) FROM playlist 
-                    WHERE playlist_name LIKE $1 AND
-                    guild_id = $2;
-            """
-
-            result = await db.fetchval(search_query, f"{name}", ctx.guild.id)
-            if result:
-                await ctx.send("A playlist with that name already exists in this guild.",
-                                ephemeral=True)
-                return
-        
-            add_query = """
-                INSERT INTO playlist (guild_id, user_id, playlist_name)
-                    VALUES ($1, $2, $3)
-            """
-            result = await db.execute(add_query, ctx.guild.id, ctx.author.id, name)
-            await ctx.send(f"Playlist `{name}` has been created in this guild.")
+        if await self.repo.create_playlist(ctx.guild.id, ctx.author.id, name) is None:
+            await ctx.send("A playlist with that name already exists in this guild.",
+                            ephemeral=True)
+            return
+
+        await ctx.send(f"Playlist `{name}` has been created in this guild.")
 
     @playlist.command(name="add")
     async def playlist_add(self, ctx: commands.Context, playlist: str, song: str) -> None:
         """Add a song into a specific playlist"""
-        async with self.bot.db.acquire() as db:
-            search_query = """
-                SELECT playlist_id FROM playlist 
-                    WHERE playlist_name LIKE $1 AND
-                    guild_id = $2;
-            """
-            playlist_id = await db.fetchval(search_query, f"{playlist}", ctx.guild.id)
-            if playlist_id <= 0:
-                await ctx.send("That playlist does not exist.",
-                                ephemeral=True)
-                return
-            
-            track_query = """
-                SELECT * FROM tracks
-                    WHERE track_name ILIKE $1
-            """
-
-            track_id = await db.fetch(track_query, f"%{song}%")
-            choice = 0
-            add_query = """
-                INSERT INTO playlist_tracks (playlist_id, track_id)
-                    VALUES ($1, $2)
-            """
-            if len(track_id) == 1:
-                await db.execute(add_query, playlist_id, track_id[0]['track_id'])
-                await ctx.send(f"That song has been added to {playlist}",
-                                ephemeral=True)
+        # No connection is held while the picker waits on the user.
+        playlist_info = await self.repo.find_playlist(playlist, ctx.guild.id)
+        if not playlist_info:
+            await ctx.send("That playlist does not exist.",
+                            ephemeral=True)
+            return
 
-                return
-            elif len(track_id) > 1:
+        playlist_id = playlist_info['playlist_id']
+        track_id = await self.repo.search_tracks(song, SEARCH_LIMIT)
+        choice = 0
+        if track_id:
+            if len(track_id) > 1:
                 norm_tracks = self.normalized_tracks(track_id, 5)
                 choice = await self.music_choices(ctx, norm_tracks)
                 if choice is None:
                     return
-                
-                await db.execute(add_query, playlist_id, track_id[choice]['track_id'])
-                await ctx.send(f"That song has been added to {playlist}",
-                                ephemeral=True)
 
-                return
-            
-            search_result = await self.search_track(ctx, song)
-            if search_result is None:
-                return
-            
-            choice, search = search_result
-            new_track_query = """
-                INSERT INTO tracks (track_name, track_uri)
-                    VALUES ($1, $2)
-                RETURNING track_id
-            """
-
-            if len(search) == 1:
-                choice = 0
-
-            track_id = await db.fetchval(new_track_query,
-                                              search[choice].title,
-                                              search[choice].uri)
-            await db.execute(add_query, playlist_id, track_id)
-
-            await ctx.send(f"{search[choice]} has been added into the playlist {playlist}.")
+            await self.repo.add_tracks(playlist_id, [track_id[choice]['track_id']])
+            await ctx.send(f"That song has been added to {playlist}",
+                            ephemeral=True)
+
+            return
+
+        search_result = await self.search_track(ctx, song)
+        if search_result is None:
+            return
+
+        choice, search = search_result
+        if len(search) == 1:
+            choice = 0
+
+        encoded, info = split_payload(search[choice].raw_data)
+        await self.repo.add_new_track(playlist_id, search[choice].title, search[choice].uri, encoded, info)
+
+        await ctx.send(f"{search[choice]} has been added into the playlist {playlist}.")
     
+    @playlist_add.autocomplete("song")
+    async def playlist_add_autocomplete(self, interaction: discord.Interaction,
+                                        current: str) -> List[app_commands.Choice[str]]:
+        return self.track_choices(current)
+
     @playlist.command(name="album")
     async def playlist_album(self, ctx: commands.Context, album: str) -> None:
         """Play a specifc album in the local library."""
-        async with self.bot.db.acquire() as db:
-            album_query = """
-                SELECT * FROM album
-                    WHERE album_name ILIKE $1
-                    LIMIT 5;
-            """
-
-            albums = await db.fetch(album_query, f"%{album}%")
-            choice = 0
-            if not albums:
-                return
-            elif len(albums) > 1:
-                embed = discord.Embed(title="Album search results.")
-                embed.add_field(name="", value="".join(f"{i + 1}). {album['album_name']}\n" for i, album in enumerate(albums)))
-                view = MusicChoicePicker(albums)
+        albums = await self.repo.search_albums(album, SEARCH_LIMIT)
+        choice = 0
+        if not albums:
+            return
+        elif len(albums) > 1:
+            embed = discord.Embed(title="Album search results.")
+            embed.add_field(name="", value="".join(f"{i + 1}). {album['album_name']}\n" for i, album in enumerate(albums)))
+            view = MusicChoicePicker(albums)
 
-                await ctx.send(view=view, embed=embed, ephemeral=True)
+            await ctx.send(view=view, embed=embed, ephemeral=True)
 
-                await view.wait()
-                if view.current_choice is None:
-                    return
-                else:
-                    choice= view.current_choice
-            
-            tracks_query = """
-                SELECT song_path FROM song
-                    WHERE album_id = $1;
-            """
+            await view.wait()
+            if view.current_choice is None:
+                return
+            else:
+                choice= view.current_choice
 
-            tracks = await db.fetch(tracks_query, albums[choice]["album_id"])
+        tracks = await self.repo.album_tracks(albums[choice]["album_id"])
 
         player = await self.get_player(ctx)
         if not player:
             return
-        
-        for track in tracks:
-            uri = track['song_path']
-            result: wavelink.Search = await wavelink.Playable.search(uri, source=None)
-            if not result:
-                result = await wavelink.Playable.search(uri)
-
-                if not result:
-                    yt = wavelink.TrackSource.YouTube
-                    result = await wavelink.Playable.search(uri, source=yt)
-            
-            await player.queue.put_wait(result[0])
-        if not player.playing:
-            # Play now since we aren't playing anything...
-            await player.play(player.queue.get(), volume=30)
-            
-        await ctx.send(f"{albums[choice]["album_name"]} has been added to the queue.")
+
+        refs = [TrackRef(track['song_path'], track['song_name'], track['artist_name'],
+                         length=track['track_length'])
+                for track in tracks]
+        await self.queue_tracks(ctx, player, refs, albums[choice]['album_name'])
 
     @playlist.command(name="import")
-    async def playlist_import(self, ctx: commands.Context) -> None:
-        pass
+    async def playlist_import(self, ctx: commands.Context, playlist: str, file: discord.Attachment) -> None:
+        """Add the songs of an M3U, PLS or CSV playlist file into a playlist."""
+        # Rarely used, keep the csv module out of startup.
+        from cogs.utils.playlist_files import parse as parse_playlist
+
+        try:
+            entries = parse_playlist(file.filename, await file.read())
+        except ValueError as e:
+            await ctx.send(str(e), ephemeral=True)
+            return
+
+        if not entries:
+            await ctx.send("That file has no songs in it.", ephemeral=True)
+            return
+
+        await ctx.defer()
+        if len(entries) > IMPORT_LIMIT:
+            # Sent as a followup, the defer is the interaction's response.
+            await ctx.send(f"Only the first {IMPORT_LIMIT} of {len(entries)} entries will be imported.")
+            entries = entries[:IMPORT_LIMIT]
+
+        playlist_info = await self.repo.find_playlist(playlist, ctx.guild.id)
+        if not playlist_info:
+            await ctx.send("That playlist does not exist.",
+                            ephemeral=True)
+            return
+
+        paths = await self.repo.import_entries(playlist_info['playlist_id'], entries)
+
+        # Positions are counted from 1, the same entry can appear several times.
+        unmatched = list(dict.fromkeys(entry.path or entry.title for position, entry in enumerate(entries, 1)
+                                       if position not in paths))
+        message = f"Added {len(paths)} songs to {playlist}."
+        if unmatched:
+            shown = "\n".join(f"`{name}`" for name in unmatched[:FAILED_SHOWN])
+            message += f"\n{len(unmatched)} entries are not in the library:\n{shown}"
+            if len(unmatched) > FAILED_SHOWN:
+                message += f"\n...and {len(unmatched) - FAILED_SHOWN} more."
+
+        await ctx.send(message)
 
     @playlist.command(name="list")
     async def playlist_list(self, ctx: commands.Context, playlist: str) -> None:
         """List songs in a specific playlist"""
-        async with self.bot.db.acquire() as db:
-            playlist_query = """
-                SELECT playlist_id, playlist_name FROM playlist 
-                    WHERE playlist_name LIKE $1 AND
-                    guild_id = $2;
-            """
-
-            playlist_info = await db.fetchrow(playlist_query, f"{playlist}", ctx.guild.id)
-            if not playlist_info:
-                await ctx.send("That playlist does not exist.",
-                                ephemeral=True)
-                return
-
-            tracks_query = """
-                SELECT * FROM playlist_tracks 
-                    INNER JOIN tracks ON playlist_tracks.track_id=tracks.track_id
-                    WHERE playlist_id = $1
-            """
-            tracks = await db.fetch(tracks_query, playlist_info['playlist_id'])
+        playlist_info = await self.repo.find_playlist(playlist, ctx.guild.id)
+        if not playlist_info:
+            await ctx.send("That playlist does not exist.",
+                            ephemeral=True)
+            return
 
-            embed = discord.Embed(title=playlist_info['playlist_name'])
-            if len(tracks) >= 1:
-                embed.add_field(name="", value="".join(f"{i + 1}). {track['track_name']}\n" for i, track in enumerate(tracks)))
+        size = await self.repo.playlist_size(playlist_info['playlist_id'])
 
-            await ctx.send(embed=embed)
+        # Every page is fetched with its own connection when it is shown.
+        pages = PlaylistPages(self.repo, playlist_info['playlist_id'], playlist_info['playlist_name'],
+                              size['total'], size['length'])
+        await pages.start(ctx)
     
     @playlist.command(name="play")
     async def playlist_play(self, ctx: commands.Context, playlist: str) -> None:
@@ -356,42 +646,17 @@ class Music(commands.Cog):
         if not player:
             return
 
-        async with self.bot.db.acquire() as db:
-            playlist_query = """
-                SELECT playlist_id, playlist_name FROM playlist 
-                    WHERE playlist_name LIKE $1 AND
-                    guild_id = $2;
-            """
+        playlist_info = await self.repo.find_playlist(playlist, ctx.guild.id)
+        if not playlist_info:
+            await ctx.send("That playlist does not exist.",
+                            ephemeral=True)
+            return
 
-            playlist_info = await db.fetchrow(playlist_query, f"{playlist}", ctx.guild.id)
-            if not playlist_info:
-                await ctx.send("That playlist does not exist.",
-                                ephemeral=True)
-                return
+        tracks = await self.repo.playlist_tracks(playlist_info['playlist_id'])
 
-            tracks_query = """
-                SELECT * FROM playlist_tracks 
-                    INNER JOIN tracks ON playlist_tracks.track_id=tracks.track_id
-                    WHERE playlist_id = $1
-            """
-            tracks = await db.fetch(tracks_query, playlist_info['playlist_id'])
-
-            for track in tracks:
-                uri = track['track_uri']
-                result: wavelink.Search = await wavelink.Playable.search(uri, source=None)
-                if not result:
-                    result = await wavelink.Playable.search(uri)
-
-                    if not result:
-                        yt = wavelink.TrackSource.YouTube
-                        result = await wavelink.Playable.search(uri, source=yt)
-                
-                await player.queue.put_wait(result[0])
-            if not player.playing:
-                # Play now since we aren't playing anything...
-                await player.play(player.queue.get(), volume=30)
-            
-            await ctx.send(f"{playlist} has been added to the queue.")
+        refs = [TrackRef(track['track_uri'], track['track_name'], length=track['track_length'])
+                for track in tracks]
+        await self.queue_tracks(ctx, player, refs, playlist)
 
     @commands.command(name="clear")
     async def queue_clear(self, ctx: commands.Context) -> None:
@@ -404,57 +669,110 @@ class Music(commands.Cog):
             return
         
         player.queue.clear()
+        player.pending.clear()
         await ctx.send("Queue cleared.")
 
+    async def queue_tracks(self, ctx: commands.Context, player: wavelink.Player,
+                           refs: List[TrackRef], name: str) -> None:
+        """Queue `refs` lazily, resolving only the first window right away."""
+        player.pending.extend(refs)
+        failed = await self.fill_queue(player)
+
+        message = f"{name} has been added to the queue."
+        if failed:
+            shown = "\n".join(f"`{uri}`" for uri in failed[:FAILED_SHOWN])
+            message += f"\n{len(failed)} tracks could not be loaded:\n{shown}"
+            if len(failed) > FAILED_SHOWN:
+                message += f"\n...and {len(failed) - FAILED_SHOWN} more."
+
+        await ctx.send(message)
+
+    async def fill_queue(self, player: wavelink.Player) -> List[str]:
+        """Resolve pending refs until the player's queue holds a full window.
+
+        Playback starts with the first track resolved if the player is idle.
+        Returns the URIs that could not be loaded.
+        """
+        failed: List[str] = []
+        async with player.fill_lock:
+            while player.pending and len(player.queue) < QUEUE_WINDOW:
+                count = min(QUEUE_WINDOW - len(player.queue), len(player.pending))
+                window = [player.pending.popleft() for _ in range(count)]
+
+                async for uri, track in self.tracks.load_refs(window, RESOLVE_CONCURRENCY):
+                    if track is None:
+                        failed.append(uri)
+                    elif not player.playing:
+                        # Play now since we aren't playing anything...
+                        await player.play(track, volume=30)
+                    else:
+                        await player.queue.put_wait(track)
+
+        return failed
+
     async def search_track(self, ctx: commands.Context,
                            query: str) -> tuple[int, wavelink.Search] | None:
         choice = 0
         tracks = None
-        async with self.bot.db.acquire() as db:
-            result = await db.fetch(
-                """SELECT song_path, song_name, artist_id FROM song
-                        WHERE song_name ILIKE $1""",
-                f"%{query}%"
-            )
-
-            if len(result) > 1:
-                result = await db.fetch(
-                    """SELECT song_name, artist_name, song_path FROM song
-                        LEFT JOIN artist ON song.artist_id = artist.artist_id
-                        WHERE song_name ILIKE $1 LIMIT 5""",
-                    f"%{query}%"
-                )
+        if self.index is not None:
+            result = self.index.search(query, SEARCH_LIMIT)
+        else:
+            result = await self.repo.search_songs(query, SEARCH_LIMIT)
+
+        if len(result) > 1:
+            choice = await self.music_choices(ctx, result)
+
+            if choice is None:
+                return None
+
+            result = result[choice]['song_path']
+            tracks = await self.local_track(ctx, result)
+            if tracks is None:
+                return None
+        elif len(result) == 1:
+            result = result[0]['song_path']
+            tracks = await self.local_track(ctx, result)
+            if tracks is None:
+                return None
+        else:
+            # Search via Youtube Music.
+            tracks: wavelink.Search = await search(query)
+            if not isinstance(tracks, wavelink.Playlist) and len(tracks) > 1:
+                result = self.normalized_tracks(tracks, 5)
                 choice = await self.music_choices(ctx, result)
 
                 if choice is None:
                     return None
+            elif not tracks:
+                # Otherwise search through normal Youtube.
+                yt = wavelink.TrackSource.YouTube
+                tracks: wavelink.Search = await search(query, source=yt)
 
-                result = result[choice]['song_path']
-                tracks: wavelink.Search = await wavelink.Playable.search(result,
-                                                                        source=None)
-            elif len(result) == 1:
-                result = result[0]['song_path']
-                tracks: wavelink.Search = await wavelink.Playable.search(result,
-                                                                        source=None)
-            else:
-                # Search via Youtube Music.
-                tracks: wavelink.Search = await wavelink.Playable.search(query)
-                if not isinstance(tracks, wavelink.Playlist) and len(tracks) > 1:
-                    result = self.normalized_tracks(tracks, 5)
-                    choice = await self.music_choices(ctx, result)
-
-                    if choice is None:
-                        return None
-                elif not tracks:
-                    # Otherwise search through normal Youtube.
-                    yt = wavelink.TrackSource.YouTube
-                    tracks: wavelink.Search = await wavelink.Playable.search(query, source=yt)
-
-                    if not tracks:
-                        await ctx.send("No tracks can be found with that query.")
-                        return None
-            
-            return (choice, tracks)
+                if not tracks:
+                    await ctx.send("No tracks can be found with that query.")
+                    return None
+        
+        return (choice, tracks)
+
+    async def local_track(self, ctx: commands.Context, path: str) -> List[wavelink.Playable] | None:
+        track = await self.tracks.load(path)
+        if track is None:
+            await ctx.send("That song could not be loaded.")
+            return None
+
+        return [track]
+
+    def track_choices(self, current: str) -> List[app_commands.Choice[str]]:
+        # Autocomplete has to answer within Discord's 3 second window, only
+        # the in-memory index is fast enough for that.
+        if self.index is None or len(current) < 2:
+            return []
+
+        return [
+            app_commands.Choice(name=f"{song['song_name']} - {song['artist_name']}"[:100],
+                                value=song['song_name'][:100])
+            for song in self.index.search(current, AUTOCOMPLETE_LIMIT)
+        ]
 
     @classmethod
     def normalized_tracks(cls, tracks: wavelink.Search | Dict, limit: int) -> List[Dict]:
@@ -497,14 +815,22 @@ class Music(commands.Cog):
 
         if not player:
             try:
-                player = await ctx.author.voice.channel.connect(cls=wavelink.Player)  # type: ignore
+                channel = ctx.author.voice.channel
+                player = await channel.connect(cls=ctx.bot.nodes.player())  # type: ignore
             except AttributeError:
                 await ctx.send("Please join a voice channel first before using this command.")
                 return None
             except discord.ClientException:
                 await ctx.send("I was unable to join this voice channel. Please try again.")
                 return None
+            except wavelink.InvalidNodeException:
+                await ctx.send("No music server is available right now. Please try again later.")
+                return None
         
+        if not hasattr(player, "pending"):
+            player.pending = deque()
+            player.fill_lock = asyncio.Lock()
+
         if not hasattr(player, "home"):
             player.home = ctx.channel
         elif player.home != ctx.channel:
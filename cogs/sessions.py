@@ -0,0 +1,178 @@
+import asyncio
+import logging
+
+from collections import deque
+from typing import Any, List, Optional
+
+import asyncpg
+import discord
+import wavelink
+
+from discord.ext import commands
+
+from cogs.utils.metrics import players
+from cogs.utils.tracks import TrackRef, split_payload
+from config import CONFIG
+
+
+log = logging.getLogger(__name__)
+
+# Seconds between snapshots of every player.
+SNAPSHOT_INTERVAL = CONFIG.get("SESSION_SNAPSHOT_INTERVAL", 30)
+# Voice connections opened at once while restoring.
+RESTORE_CONCURRENCY = 25
+
+SAVE_SESSION = """
+    INSERT INTO player_session (guild_id, voice_channel_id, home_channel_id, volume, paused,
+                                position, current, queue, pending, saved_at)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, now())
+    ON CONFLICT (guild_id) DO UPDATE SET
+        voice_channel_id = EXCLUDED.voice_channel_id,
+        home_channel_id = EXCLUDED.home_channel_id,
+        volume = EXCLUDED.volume,
+        paused = EXCLUDED.paused,
+        position = EXCLUDED.position,
+        current = EXCLUDED.current,
+        queue = EXCLUDED.queue,
+        pending = EXCLUDED.pending,
+        saved_at = EXCLUDED.saved_at
+"""
+# `$1` are the guilds of this process, `$2` the ones that still have a player.
+DROP_SESSIONS = """
+    DELETE FROM player_session
+        WHERE guild_id = ANY($1::bigint[]) AND NOT guild_id = ANY($2::bigint[])
+"""
+SESSIONS_QUERY = """
+    SELECT * FROM player_session
+        WHERE guild_id = ANY($1::bigint[])
+"""
+
+
+def track_record(track: wavelink.Playable) -> List[Any]:
+    uri = getattr(track.extras, "uri", None) or track.uri or track.identifier
+    return [uri, *split_payload(track.raw_data)]
+
+def ref_record(ref: TrackRef) -> List[Any]:
+    if ref.track is None:
+        return [ref.uri, ref.title, ref.author]
+
+    return [ref.uri, ref.title, ref.author, *split_payload(ref.track.raw_data)]
+
+
+class Sessions(commands.Cog):
+    """Saves every player's queue and position, and brings them back after a restart."""
+    def __init__(self, bot) -> None:
+        self.bot = bot
+
+    async def cog_load(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def cog_unload(self) -> None:
+        self.task.cancel()
+        # Unloaded while the bot shuts down, keep the latest state.
+        if self.bot.is_ready():
+            await self.snapshot()
+
+    async def run(self) -> None:
+        await self.bot.wait_until_ready()
+        await self.restore()
+
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            try:
+                await self.snapshot()
+            except (asyncpg.PostgresError, OSError) as e:
+                log.warning("Saving player sessions failed: %s", e)
+
+    def record(self, player: wavelink.Player) -> Optional[tuple]:
+        home = getattr(player, "home", None)
+        if not player.guild or not player.channel or home is None:
+            return None
+
+        current = track_record(player.current) if player.current else None
+        return (
+            player.guild.id, player.channel.id, home.id, player.volume, player.paused,
+            player.position, current,
+            [track_record(track) for track in player.queue],
+            [ref_record(ref) for ref in getattr(player, "pending", ())]
+        )
+
+    async def snapshot(self) -> None:
+        records = [record for record in map(self.record, players()) if record is not None]
+        guild_ids = [guild.id for guild in self.bot.guilds]
+
+        async with self.bot.db.acquire() as db:
+            async with db.transaction():
+                if records:
+                    await db.executemany(SAVE_SESSION, records)
+                await db.execute(DROP_SESSIONS, guild_ids, [record[0] for record in records])
+
+    async def restore(self) -> None:
+        """Reconnect every saved player of this process' guilds, all at once."""
+        async with self.bot.db.acquire() as db:
+            sessions = await db.fetch(SESSIONS_QUERY, [guild.id for guild in self.bot.guilds])
+
+        if not sessions:
+            return
+
+        semaphore = asyncio.Semaphore(RESTORE_CONCURRENCY)
+
+        async def restore(session: asyncpg.Record) -> bool:
+            async with semaphore:
+                try:
+                    return await self.restore_session(session)
+                except (discord.DiscordException, wavelink.WavelinkException, asyncio.TimeoutError) as e:
+                    log.warning("Restoring the player of guild %s failed: %s", session['guild_id'], e)
+                    return False
+
+        restored = await asyncio.gather(*map(restore, sessions))
+        log.info("Restored %d of %d player sessions.", sum(restored), len(sessions))
+
+    async def restore_session(self, session: asyncpg.Record) -> bool:
+        guild = self.bot.get_guild(session['guild_id'])
+        if guild is None or guild.voice_client is not None:
+            return False
+
+        channel = guild.get_channel(session['voice_channel_id'])
+        home = guild.get_channel(session['home_channel_id'])
+        if channel is None or home is None or not any(not member.bot for member in channel.members):
+            # Nobody left to play to.
+            return False
+
+        tracks = self.bot.get_cog("Music").tracks
+        player: wavelink.Player = await channel.connect(cls=self.bot.nodes.player())
+        player.home = home
+        player.pending = deque()
+        player.fill_lock = asyncio.Lock()
+        player.autoplay = wavelink.AutoPlayMode.partial
+
+        for uri, encoded, info in session['queue']:
+            track = tracks.build(uri, {"encoded": encoded, **info})
+            if track is not None:
+                player.queue.put(track)
+
+        for record in session['pending']:
+            uri, title, author = record[:3]
+            track = None
+            if len(record) > 3:
+                track = tracks.build(uri, {"encoded": record[3], **record[4]})
+            player.pending.append(TrackRef(uri, title, author, track, track.length if track else None))
+
+        current = None
+        if session['current']:
+            uri, encoded, info = session['current']
+            current = tracks.build(uri, {"encoded": encoded, **info})
+
+        if current is not None:
+            await player.play(current, start=session['position'], volume=session['volume'],
+                              paused=session['paused'])
+        else:
+            await player.set_volume(session['volume'])
+            if player.queue:
+                await player.play(player.queue.get(), paused=session['paused'])
+
+        return True
+
+
+async def setup(bot: commands.Bot) -> None:
+    await bot.add_cog(Sessions(bot))
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import asyncpg
+
+
+log = logging.getLogger(__name__)
+
+Callback = Callable[[Optional[str]], Awaitable[None]]
+
+
+class Listener:
+    """Keeps one pooled connection LISTENing for PostgreSQL notifications.
+
+    Callbacks receive the notification payload, or ``None`` whenever the
+    connection was (re)established and notifications may have been missed.
+    ``connected`` is only true while notifications are being received,
+    ``connections`` counts how often that started.
+    """
+    RETRY_DELAY = 5.0
+
+    def __init__(self, pool: asyncpg.Pool) -> None:
+        self.pool = pool
+        self.callbacks: Dict[str, List[Callback]] = {}
+        self.task: Optional[asyncio.Task] = None
+        # Running callbacks, the loop only keeps weak references to tasks.
+        self.running: Set[asyncio.Task] = set()
+        self.connected = False
+        self.connections = 0
+
+    def add(self, channel: str, callback: Callback) -> None:
+        self.callbacks.setdefault(channel, []).append(callback)
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+            self.connected = False
+
+    def dispatch(self, channel: str, payload: Optional[str]) -> None:
+        for callback in self.callbacks.get(channel, ()):
+            task = asyncio.create_task(callback(payload))
+            self.running.add(task)
+            task.add_done_callback(self.finished)
+
+    def finished(self, task: asyncio.Task) -> None:
+        self.running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Notification callback failed", exc_info=task.exception())
+
+    async def run(self) -> None:
+        while True:
+            try:
+                async with self.pool.acquire() as conn:
+                    closed = asyncio.Event()
+
+                    def terminated(_) -> None:
+                        self.connected = False
+                        closed.set()
+
+                    conn.add_termination_listener(terminated)
+
+                    for channel in self.callbacks:
+                        await conn.add_listener(channel, self.on_notify)
+                        self.dispatch(channel, None)
+
+                    self.connections += 1
+                    self.connected = True
+                    await closed.wait()
+            except (OSError, asyncpg.PostgresError) as e:
+                log.warning("Listener connection failed: %s", e)
+            finally:
+                self.connected = False
+
+            await asyncio.sleep(self.RETRY_DELAY)
+
+    def on_notify(self, conn: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+        self.dispatch(channel, payload or None)
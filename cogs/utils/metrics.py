@@ -0,0 +1,220 @@
+import bisect
+import contextlib
+import time
+
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import asyncpg
+import wavelink
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+
+# Seconds, from a cached lookup to a slow Lavalink search.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def label_text(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        REGISTRY.append(self)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(f"{line}\n" for line in self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in self.values.items():
+            yield f"{self.name}{label_text(self.labels, labels)} {value}"
+
+
+class Gauge(Metric):
+    """A value set directly, or read from `function` whenever metrics are scraped.
+
+    `function` returns the value for every label combination, which keeps
+    things like per guild queue depth free until someone looks at them.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 function: Optional[Callable[[], Dict[Labels, float]]] = None) -> None:
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Labels, float] = {}
+        self.function = function
+
+    def set(self, value: float, *labels: str) -> None:
+        self.values[labels] = value
+
+    def samples(self) -> Iterator[str]:
+        values = self.function() if self.function else self.values
+        for labels, value in values.items():
+            yield f"{self.name}{label_text(self.labels, labels)} {value}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # Per label combination: a count for each bucket plus +Inf, and the sum.
+        self.counts: Dict[Labels, List[int]] = {}
+        self.sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts = self.counts.get(labels)
+        if counts is None:
+            counts = self.counts[labels] = [0] * (len(self.buckets) + 1)
+            self.sums[labels] = 0.0
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    @contextlib.contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self) -> Iterator[str]:
+        for labels, counts in self.counts.items():
+            total = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                total += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{label_text(self.labels, labels, le)} {total}"
+
+            yield f"{self.name}_sum{label_text(self.labels, labels)} {self.sums[labels]}"
+            yield f"{self.name}_count{label_text(self.labels, labels)} {total}"
+
+
+REGISTRY: List[Metric] = []
+
+COMMAND_LATENCY = Histogram("yadmb_command_seconds", "Time spent running a command.",
+                            ("command", "status"))
+DB_QUERY = Histogram("yadmb_db_query_seconds", "Time spent on a database statement.", ("statement",))
+DB_POOL_WAIT = Histogram("yadmb_db_pool_wait_seconds", "Time spent waiting for a pooled connection.")
+LAVALINK_SEARCH = Histogram("yadmb_lavalink_search_seconds", "Time spent on a Lavalink track search.",
+                            ("source", "result"))
+SEARCH_CACHE = Counter("yadmb_search_cache_total", "Track searches by how the search cache answered them.",
+                       ("source", "result"))
+
+
+def players() -> Iterator[wavelink.Player]:
+    for node in wavelink.Pool.nodes.values():
+        yield from node.players.values()
+
+def player_counts() -> Dict[Labels, float]:
+    counts = {("idle",): 0, ("playing",): 0}
+    for player in players():
+        counts[("playing",) if player.playing else ("idle",)] += 1
+
+    return counts
+
+def node_players() -> Dict[Labels, float]:
+    return {(node.identifier,): len(node.players) for node in wavelink.Pool.nodes.values()}
+
+def queue_depths() -> Dict[Labels, float]:
+    # Resolved tracks plus the refs still waiting behind them.
+    return {(str(player.guild.id),): len(player.queue) + len(getattr(player, "pending", ()))
+            for player in players() if player.guild}
+
+
+ACTIVE_PLAYERS = Gauge("yadmb_players", "Connected players.", ("state",), player_counts)
+NODE_PLAYERS = Gauge("yadmb_node_players", "Players on each Lavalink node.", ("node",), node_players)
+NODE_LOAD = Gauge("yadmb_node_load", "Load score new players are placed by, lower is better.", ("node",))
+NODE_PLACEMENTS = Counter("yadmb_node_placements_total", "New players placed on each node.", ("node",))
+NODE_FAILOVERS = Counter("yadmb_node_failovers_total", "Players moved off a node that went away.",
+                         ("node", "result"))
+# Updates that were coalesced or unchanged saved a Discord API call each.
+NOW_PLAYING_UPDATES = Counter("yadmb_now_playing_updates_total", "Now playing updates by how they were handled.",
+                              ("result",))
+PLAYLIST_CACHE = Counter("yadmb_playlist_cache_total", "Playlist lookups by what was looked up and whether it was cached.",
+                         ("kind", "result"))
+RECOMMENDATIONS = Counter("yadmb_recommendations_total", "Local songs picked after a queue ran out, by outcome.",
+                          ("result",))
+STARTUP_PHASE = Gauge("yadmb_startup_phase_seconds", "Time the last startup spent in each phase.", ("phase",))
+QUEUE_DEPTH = Gauge("yadmb_queue_depth", "Tracks waiting in a guild's queue.", ("guild",), queue_depths)
+
+
+def render() -> str:
+    return "".join(metric.render() for metric in REGISTRY)
+
+def statement_name(query: str) -> str:
+    # Statements are module constants, their first words tell them apart.
+    return " ".join(query.split())[:80]
+
+def record_query(record: asyncpg.connection.LoggedQuery) -> None:
+    DB_QUERY.observe(record.elapsed, statement_name(record.query))
+
+
+class TimedPool:
+    """Wraps an asyncpg pool to time how long ``acquire()`` waits for a connection."""
+    def __init__(self, pool: asyncpg.Pool) -> None:
+        self.pool = pool
+
+    def __getattr__(self, name: str):
+        return getattr(self.pool, name)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> AsyncIterator[asyncpg.Connection]:
+        start = time.perf_counter()
+        async with self.pool.acquire() as conn:
+            DB_POOL_WAIT.observe(time.perf_counter() - start)
+            yield conn
+
+
+async def scrape(request: "web.Request") -> "web.Response":
+    from aiohttp import web
+
+    return web.Response(body=render().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def serve(port: int, host: str = "127.0.0.1") -> "web.AppRunner":
+    """Serve ``/metrics`` in the Prometheus text format."""
+    # The server module is only needed when metrics are on, keep it off startup.
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_get("/metrics", scrape)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    return runner
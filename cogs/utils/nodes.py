@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+
+from typing import Dict, List, Optional
+
+import aiohttp
+import discord
+import wavelink
+
+from cogs.utils import metrics
+from config import CONFIG
+
+
+log = logging.getLogger(__name__)
+
+# Seconds between stats requests to every node.
+STATS_INTERVAL = 15
+# Seconds between checks that every node's websocket is still being read.
+HEALTH_INTERVAL = 2
+# Players moved at once when a node goes away.
+FAILOVER_CONCURRENCY = 10
+
+
+def configured_nodes(connections: int = 100) -> List[wavelink.Node]:
+    """The nodes in LL_NODES, or the single LL_HOST node.
+
+    Each node allows up to `connections` requests in flight from this process.
+    """
+    entries = CONFIG.get("LL_NODES") or [{"uri": CONFIG["LL_HOST"], "password": CONFIG["LL_PASS"]}]
+    return [wavelink.Node(identifier=entry.get("identifier", entry["uri"]),
+                          uri=entry["uri"], password=entry["password"],
+                          session=aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=connections)))
+            for entry in entries]
+
+def penalty(stats: wavelink.StatsResponsePayload) -> float:
+    """Load of a node beyond its player count, the usual Lavalink client weighting.
+
+    CPU load and lost audio frames grow the penalty exponentially, a node that
+    can't keep up loses new players long before it is full.
+    """
+    cpu = 1.05 ** (100 * stats.cpu.system_load) * 10 - 10
+    frames = 0.0
+    if stats.frames:
+        frames += 1.03 ** (500 * stats.frames.deficit / 3000) * 600 - 600
+        frames += (1.03 ** (500 * stats.frames.nulled / 3000) * 300 - 300) * 2
+
+    return cpu + frames
+
+def dropped(node: wavelink.Node) -> bool:
+    """Whether `node` lost its websocket without wavelink noticing.
+
+    wavelink stops reading when Lavalink closes the socket cleanly or the
+    read errors, but leaves the node marked as connected.
+    """
+    websocket = node._websocket
+    if node.status is not wavelink.NodeStatus.CONNECTED or websocket is None:
+        return False
+
+    task = websocket.keep_alive_task
+    return not websocket.is_connected() or task is None or task.done()
+
+
+class NodeBalancer:
+    """Places new players on the least loaded node and moves players off nodes that drop."""
+    def __init__(self, nodes: List[wavelink.Node]) -> None:
+        self.nodes = nodes
+        self.stats: Dict[str, wavelink.StatsResponsePayload] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    async def connect(self, client: discord.Client) -> None:
+        await wavelink.Pool.connect(nodes=self.nodes, client=client, cache_capacity=100)
+        client.add_listener(self.on_node_disconnected, "on_wavelink_node_disconnected")
+
+        self.task = asyncio.create_task(self.poll())
+
+    def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def poll(self) -> None:
+        next_stats = 0.0
+        while True:
+            for node in self.nodes:
+                if dropped(node):
+                    log.warning("Lost the websocket of %s, reconnecting.", node.identifier)
+                    # Reconnecting dispatches node_disconnected, which moves the players.
+                    asyncio.create_task(node._websocket.connect())
+
+            if time.monotonic() >= next_stats:
+                next_stats = time.monotonic() + STATS_INTERVAL
+                await self.fetch_stats()
+
+            await asyncio.sleep(HEALTH_INTERVAL)
+
+    async def fetch_stats(self) -> None:
+        for node in self.connected():
+            try:
+                self.stats[node.identifier] = await node.fetch_stats()
+            except (wavelink.WavelinkException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                log.warning("Fetching stats from %s failed: %s", node.identifier, e)
+                continue
+
+            metrics.NODE_LOAD.set(self.load(node), node.identifier)
+
+    def connected(self, exclude: Optional[wavelink.Node] = None) -> List[wavelink.Node]:
+        return [node for node in self.nodes
+                if node.status is wavelink.NodeStatus.CONNECTED and node is not exclude]
+
+    def load(self, node: wavelink.Node) -> float:
+        stats = self.stats.get(node.identifier)
+        if stats is None:
+            return len(node.players)
+
+        # Players placed since the last poll are not in the stats yet.
+        return max(stats.playing, len(node.players)) + penalty(stats)
+
+    def best(self, exclude: Optional[wavelink.Node] = None) -> Optional[wavelink.Node]:
+        nodes = self.connected(exclude)
+        if not nodes:
+            return None
+
+        return min(nodes, key=self.load)
+
+    def player(self) -> wavelink.Player:
+        """A player bound to the best node, pass it as ``cls`` to ``VoiceChannel.connect``."""
+        node = self.best()
+        if node is None:
+            raise wavelink.InvalidNodeException("No Lavalink node is connected.")
+
+        metrics.NODE_PLACEMENTS.inc(node.identifier)
+        return wavelink.Player(nodes=[node])
+
+    async def on_node_disconnected(self, payload: wavelink.NodeDisconnectedEventPayload) -> None:
+        await self.fail_over(payload.node)
+
+    async def fail_over(self, node: wavelink.Node) -> None:
+        """Move every player on `node` to the other nodes, keeping queue and position."""
+        players = list(node.players.values())
+        targets = self.connected(exclude=node)
+        if not players:
+            return
+        elif not targets:
+            log.warning("%s went away with %d players and no other node is connected.",
+                        node.identifier, len(players))
+            return
+
+        # Spread the players out up front, switching does not update the counts until it is done.
+        loads = {target.identifier: self.load(target) for target in targets}
+        semaphore = asyncio.Semaphore(FAILOVER_CONCURRENCY)
+
+        async def move(player: wavelink.Player, target: wavelink.Node) -> None:
+            async with semaphore:
+                try:
+                    await player.switch_node(target)
+                except (RuntimeError, wavelink.WavelinkException) as e:
+                    log.warning("Moving player %s to %s failed: %s", player.guild.id, target.identifier, e)
+                    metrics.NODE_FAILOVERS.inc(node.identifier, "failed")
+                    # Recommended by wavelink, the player is left in a stale state otherwise.
+                    await player.disconnect()
+                else:
+                    metrics.NODE_FAILOVERS.inc(node.identifier, "moved")
+
+        moves = []
+        for player in players:
+            target = min(targets, key=lambda target: loads[target.identifier])
+            loads[target.identifier] += 1
+            moves.append(move(player, target))
+
+        log.info("Moving %d players off %s.", len(players), node.identifier)
+        await asyncio.gather(*moves)
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+import discord
+
+from cogs.utils import metrics
+from config import CONFIG
+
+
+log = logging.getLogger(__name__)
+
+# Track changes within this many seconds of each other are shown as one update.
+DEBOUNCE = CONFIG.get("NOW_PLAYING_DEBOUNCE", 2.0)
+# Discord allows 5 messages per 5 seconds in a channel, leave room for command replies.
+CHANNEL_CALLS = 3
+CHANNEL_PERIOD = 5.0
+
+
+class ChannelLimiter:
+    """Spaces out the calls to one channel so they stay inside its rate limit bucket."""
+    def __init__(self, calls: int = CHANNEL_CALLS, period: float = CHANNEL_PERIOD) -> None:
+        self.calls = calls
+        self.period = period
+        self.sent: Deque[float] = deque()
+        self.lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self.lock:
+            while len(self.sent) >= self.calls:
+                delay = self.sent[0] + self.period - time.monotonic()
+                if delay <= 0:
+                    self.sent.popleft()
+                else:
+                    await asyncio.sleep(delay)
+
+            self.sent.append(time.monotonic())
+
+
+class NowPlayingManager:
+    """Keeps one now playing message per guild up to date.
+
+    Updates are held back for :data:`DEBOUNCE` seconds and only the latest
+    one is shown, so skipping through tracks costs a single edit. Updates
+    for the track that is already shown, like the ones after a failover or
+    a restore, are dropped.
+    """
+    def __init__(self) -> None:
+        self.messages: Dict[int, discord.Message] = {}
+        self.shown: Dict[int, str] = {}
+        self.pending: Dict[int, Tuple[discord.abc.Messageable, str, discord.Embed]] = {}
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.limiters: Dict[int, ChannelLimiter] = {}
+        # The channel each guild's limiter belongs to.
+        self.channels: Dict[int, int] = {}
+
+    def update(self, guild_id: int, channel: discord.abc.Messageable, key: str,
+               embed: discord.Embed) -> None:
+        """Show `embed` in `channel`, `key` tells the tracks apart."""
+        if guild_id in self.pending:
+            metrics.NOW_PLAYING_UPDATES.inc("coalesced")
+        elif self.shown.get(guild_id) == key:
+            metrics.NOW_PLAYING_UPDATES.inc("unchanged")
+            return
+
+        self.pending[guild_id] = (channel, key, embed)
+        if guild_id not in self.tasks:
+            self.tasks[guild_id] = asyncio.create_task(self.flush(guild_id))
+
+    def forget(self, guild_id: int) -> None:
+        """Drop a guild's state once its player is gone, the next track gets a new message."""
+        task = self.tasks.pop(guild_id, None)
+        if task is not None:
+            task.cancel()
+
+        self.pending.pop(guild_id, None)
+        self.messages.pop(guild_id, None)
+        self.shown.pop(guild_id, None)
+        self.limiters.pop(self.channels.pop(guild_id, None), None)
+
+    def close(self) -> None:
+        for guild_id in list(self.tasks):
+            self.forget(guild_id)
+
+    async def flush(self, guild_id: int) -> None:
+        try:
+            await asyncio.sleep(DEBOUNCE)
+            # Updates that arrive while one is being shown go out next.
+            while guild_id in self.pending:
+                await self.flush_one(guild_id)
+        finally:
+            if self.tasks.get(guild_id) is asyncio.current_task():
+                del self.tasks[guild_id]
+
+    async def flush_one(self, guild_id: int) -> None:
+        channel, _, _ = self.pending[guild_id]
+        previous = self.channels.get(guild_id)
+        if previous != channel.id:
+            # The player moved to another channel.
+            self.limiters.pop(previous, None)
+            self.channels[guild_id] = channel.id
+
+        limiter = self.limiters.setdefault(channel.id, ChannelLimiter())
+        # Updates arriving while we wait for the channel still replace this one.
+        await limiter.wait()
+
+        channel, key, embed = self.pending.pop(guild_id)
+        if self.shown.get(guild_id) == key:
+            # Queued while the same track was being shown.
+            metrics.NOW_PLAYING_UPDATES.inc("unchanged")
+            return
+
+        try:
+            await self.show(guild_id, channel, embed)
+        except discord.HTTPException as e:
+            log.warning("Updating the now playing message of guild %s failed: %s", guild_id, e)
+            metrics.NOW_PLAYING_UPDATES.inc("failed")
+        else:
+            self.shown[guild_id] = key
+
+    async def show(self, guild_id: int, channel: discord.abc.Messageable, embed: discord.Embed) -> None:
+        message = self.messages.get(guild_id)
+        if message is not None and message.channel.id == channel.id:
+            try:
+                await message.edit(embed=embed)
+            except discord.NotFound:
+                # Deleted by someone, send a new one below.
+                pass
+            else:
+                metrics.NOW_PLAYING_UPDATES.inc("edited")
+                return
+
+        self.messages[guild_id] = await channel.send(embed=embed)
+        metrics.NOW_PLAYING_UPDATES.inc("sent")
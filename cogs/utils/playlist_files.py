@@ -0,0 +1,131 @@
+import configparser
+import csv
+import io
+import re
+
+from typing import List, NamedTuple, Optional
+from urllib.parse import unquote, urlsplit
+
+
+# Column names recognised in CSV exports, lower case.
+PATH_COLUMNS = ("path", "location", "file", "filename", "uri", "url")
+TITLE_COLUMNS = ("title", "name", "track", "track name", "song")
+ARTIST_COLUMNS = ("artist", "artist name", "artists", "creator")
+
+PLS_ENTRY = re.compile(r"(file|title)(\d+)", re.IGNORECASE)
+
+
+class Entry(NamedTuple):
+    """One line of a playlist file, any of the fields may be missing."""
+    path: Optional[str]
+    title: Optional[str]
+    artist: Optional[str]
+
+
+def decode(data: bytes) -> str:
+    # M3U8 is UTF-8 by definition, plain M3U and PLS are often Latin-1.
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("latin-1")
+
+def local_path(path: Optional[str]) -> Optional[str]:
+    # Players like foobar2000 and Rhythmbox write file:// URLs.
+    if path and path.lower().startswith("file://"):
+        return unquote(urlsplit(path).path)
+
+    return path
+
+def split_title(text: str) -> tuple[Optional[str], Optional[str]]:
+    """Split the usual ``Artist - Title`` display name."""
+    artist, sep, title = text.partition(" - ")
+    if not sep:
+        return text.strip() or None, None
+
+    return title.strip() or None, artist.strip() or None
+
+def parse_m3u(text: str) -> List[Entry]:
+    entries = []
+    title = artist = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.upper().startswith("#EXTINF:"):
+            # #EXTINF:<seconds>,<display name>
+            _, _, name = line.partition(",")
+            title, artist = split_title(name)
+        elif line and not line.startswith("#"):
+            entries.append(Entry(line, title, artist))
+            title = artist = None
+
+    return entries
+
+def parse_pls(text: str) -> List[Entry]:
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    parser.read_string(text)
+    section = next((name for name in parser.sections() if name.lower() == "playlist"), None)
+    if section is None:
+        raise ValueError("The file has no [playlist] section.")
+
+    files, titles = {}, {}
+    for key, value in parser.items(section):
+        match = PLS_ENTRY.fullmatch(key)
+        if match:
+            (files if match[1].lower() == "file" else titles)[int(match[2])] = value
+
+    entries = []
+    for number in sorted(files):
+        title, artist = split_title(titles[number]) if number in titles else (None, None)
+        entries.append(Entry(files[number], title, artist))
+
+    return entries
+
+def parse_csv(text: str) -> List[Entry]:
+    rows = list(csv.reader(io.StringIO(text)))
+    if not rows:
+        return []
+
+    header = [column.strip().lower() for column in rows[0]]
+
+    def column(names: tuple) -> Optional[int]:
+        return next((header.index(name) for name in names if name in header), None)
+
+    path, title, artist = column(PATH_COLUMNS), column(TITLE_COLUMNS), column(ARTIST_COLUMNS)
+    if path is None and title is None:
+        # No header we know, take the first column as the path.
+        path, title, artist = 0, None, None
+    else:
+        rows = rows[1:]
+
+    def cell(row: List[str], index: Optional[int]) -> Optional[str]:
+        if index is None or index >= len(row):
+            return None
+
+        return row[index].strip() or None
+
+    return [Entry(cell(row, path), cell(row, title), cell(row, artist))
+            for row in rows if any(value.strip() for value in row)]
+
+PARSERS = {
+    "m3u": parse_m3u,
+    "m3u8": parse_m3u,
+    "pls": parse_pls,
+    "csv": parse_csv
+}
+
+def parse(filename: str, data: bytes) -> List[Entry]:
+    """Read the entries of an M3U, M3U8, PLS or CSV playlist.
+
+    Raises ``ValueError`` for other file types and files that don't parse.
+    """
+    extension = filename.rpartition(".")[2].lower()
+    parser = PARSERS.get(extension)
+    if parser is None:
+        raise ValueError(f"`.{extension}` files are not supported, use one of "
+                         + ", ".join(f"`.{name}`" for name in PARSERS) + ".")
+
+    try:
+        entries = parser(decode(data))
+    except (configparser.Error, csv.Error) as e:
+        raise ValueError(f"The file could not be read: {e}") from e
+
+    return [entry._replace(path=local_path(entry.path)) for entry in entries if entry.path or entry.title]
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+
+from pathlib import Path
+from typing import Any, Collection, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# Neighbours kept for every song and artist.
+NEIGHBORS = 20
+# Playlist entries this many places apart or closer count as played together.
+PLAYLIST_WINDOW = 5
+# Songs sharing an album, artist or genre are linked to this many of the
+# songs beside them, in path (and so usually track) or year order. Big
+# groups would link everything with everything otherwise.
+GROUP_WINDOW = 10
+# How much each kind of link adds to a pair's score.
+PLAYLIST_WEIGHT = 1.0
+ALBUM_WEIGHT = 0.5
+ARTIST_WEIGHT = 0.3
+GENRE_WEIGHT = 0.1
+# Songs of each similar artist tried once a song's own neighbours were all played.
+ARTIST_SONGS = 5
+
+FILES = ("neighbors", "artists", "artist_neighbors", "artist_offsets", "artist_songs",
+         "hashes", "rows", "path_offsets", "paths", "payload_offsets", "payloads")
+
+Edges = Tuple[np.ndarray, np.ndarray, np.ndarray]
+Payload = Dict[str, Any]
+
+
+def path_hash(path: str) -> int:
+    # Stable between processes, unlike hash().
+    return int.from_bytes(hashlib.blake2b(path.encode(), digest_size=8).digest(), "little")
+
+def codes(values: Sequence[Optional[object]]) -> np.ndarray:
+    """Number the distinct values from 0, None becomes -1."""
+    numbers: Dict[object, int] = {}
+    return np.fromiter((-1 if value is None else numbers.setdefault(value, len(numbers)) for value in values),
+                       dtype=np.int32, count=len(values))
+
+def pack(values: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenate `values` into one byte array, with the offsets they start at."""
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in values], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(values), dtype=np.uint8)
+
+def both_ways(src: np.ndarray, dst: np.ndarray, weight: np.ndarray) -> Edges:
+    return np.concatenate((src, dst)), np.concatenate((dst, src)), np.concatenate((weight, weight))
+
+def playlist_edges(playlists: Sequence[Sequence[int]]) -> Edges:
+    """Link the songs near each other in a playlist, closer ones more strongly."""
+    src, dst, weight = [], [], []
+    for playlist in playlists:
+        rows = np.asarray(playlist, dtype=np.int32)
+        for distance in range(1, min(PLAYLIST_WINDOW, len(rows) - 1) + 1):
+            src.append(rows[:-distance])
+            dst.append(rows[distance:])
+            weight.append(np.full(len(rows) - distance, PLAYLIST_WEIGHT / distance))
+
+    if not src:
+        return np.empty(0, np.int32), np.empty(0, np.int32), np.empty(0)
+
+    return both_ways(np.concatenate(src), np.concatenate(dst), np.concatenate(weight))
+
+def group_edges(groups: np.ndarray, order: np.ndarray, weight: float) -> Edges:
+    """Link each song to the ones beside it in its group, songs in group -1 are left out.
+
+    `order` sorts the songs within a group.
+    """
+    rows = np.lexsort((order, groups)).astype(np.int32)
+    rows = rows[groups[rows] >= 0]
+    keys = groups[rows]
+
+    src, dst = [], []
+    for distance in range(1, GROUP_WINDOW + 1):
+        same = keys[:-distance] == keys[distance:]
+        src.append(rows[:-distance][same])
+        dst.append(rows[distance:][same])
+
+    src, dst = np.concatenate(src), np.concatenate(dst)
+    return both_ways(src, dst, np.full(len(src), weight))
+
+def top(src: np.ndarray, dst: np.ndarray, weight: np.ndarray, size: int) -> np.ndarray:
+    """Sum the weights of repeated pairs and keep the best `NEIGHBORS` per source, -1 pads."""
+    neighbors = np.full((size, NEIGHBORS), -1, dtype=np.int32)
+    keep = src != dst
+    if not keep.any():
+        return neighbors
+
+    pairs, inverse = np.unique(src[keep].astype(np.int64) * size + dst[keep], return_inverse=True)
+    scores = np.bincount(inverse, weights=weight[keep])
+    src, dst = np.divmod(pairs, size)
+
+    order = np.lexsort((-scores, src))
+    src, dst = src[order], dst[order]
+    rank = np.arange(len(src)) - np.searchsorted(src, src)
+    best = rank < NEIGHBORS
+    neighbors[src[best], rank[best]] = dst[best]
+    return neighbors
+
+def build(paths: Sequence[str], artists: Sequence[Optional[int]], albums: Sequence[Optional[int]],
+          genres: Sequence[Optional[str]], years: Sequence[Optional[int]], payloads: Sequence[Optional[str]],
+          playlists: Sequence[Sequence[int]]) -> Dict[str, np.ndarray]:
+    """Build the model's arrays.
+
+    Songs are numbered by their position in `paths`, the other sequences
+    run parallel to it and `playlists` hold those numbers in playlist order.
+    `payloads` are the songs' stored Lavalink payloads as JSON, songs
+    without one are never picked.
+    """
+    size = len(paths)
+    artist = codes(artists)
+    names = np.argsort(np.asarray(paths, dtype=object)).argsort().astype(np.int32)
+    year = np.fromiter((-1 if value is None else value for value in years), dtype=np.int32, count=size)
+
+    # Links within an artist say nothing about which artists are alike, the
+    # artist level is summed up before they are added.
+    edges = [playlist_edges(playlists),
+             group_edges(codes(albums), names, ALBUM_WEIGHT),
+             group_edges(codes([genre.casefold() if genre else None for genre in genres]), year, GENRE_WEIGHT)]
+    src, dst, weight = map(np.concatenate, zip(*edges))
+    artist_src, artist_dst, artist_weight = artist[src], artist[dst], weight
+
+    src, dst, weight = map(np.concatenate, zip((src, dst, weight), group_edges(artist, names, ARTIST_WEIGHT)))
+    neighbors = top(src, dst, weight, size)
+
+    # Artists are linked through their songs' links.
+    known = (artist_src >= 0) & (artist_dst >= 0)
+    artist_count = int(artist.max()) + 1 if size else 0
+    artist_neighbors = top(artist_src[known], artist_dst[known], artist_weight[known], artist_count)
+
+    by_artist = np.lexsort((names, artist)).astype(np.int32)
+    by_artist = by_artist[artist[by_artist] >= 0]
+    artist_offsets = np.searchsorted(artist[by_artist], np.arange(artist_count + 1)).astype(np.int64)
+
+    hashes = np.fromiter((path_hash(path) for path in paths), dtype=np.uint64, count=size)
+    rows = np.argsort(hashes).astype(np.int32)
+    path_offsets, path_bytes = pack([path.encode() for path in paths])
+    payload_offsets, payload_bytes = pack([(payload or "").encode() for payload in payloads])
+
+    return {
+        "neighbors": neighbors,
+        "artists": artist,
+        "artist_neighbors": artist_neighbors,
+        "artist_offsets": artist_offsets,
+        "artist_songs": by_artist,
+        "hashes": hashes[rows],
+        "rows": rows,
+        "path_offsets": path_offsets,
+        "paths": path_bytes,
+        "payload_offsets": payload_offsets,
+        "payloads": payload_bytes
+    }
+
+def save(model: Dict[str, np.ndarray], directory: Path) -> None:
+    """Write the arrays, each file is swapped in whole so running bots keep their old mapping."""
+    directory.mkdir(parents=True, exist_ok=True)
+    for name in FILES:
+        path = directory / f"{name}.npy"
+        temporary = directory / f"{name}.tmp.npy"
+        np.save(temporary, model[name])
+        os.replace(temporary, path)
+
+
+class Recommendations:
+    """Memory mapped song and artist neighbours of the local library.
+
+    Built offline by build_recommendations.py. A lookup reads a bounded
+    number of rows out of the mapped arrays and never touches the database,
+    the picked song comes with the payload to play it from.
+    """
+    def __init__(self, arrays: Dict[str, np.ndarray]) -> None:
+        for name in FILES:
+            setattr(self, name, arrays[name])
+
+        size = len(self.neighbors)
+        if not (len(self.artists) == len(self.hashes) == len(self.rows) == len(self.path_offsets) - 1
+                == len(self.payload_offsets) - 1 == size and len(self.artist_offsets) == len(self.artist_neighbors) + 1):
+            # Files from two different builds.
+            raise ValueError("The model's arrays do not match, build it again.")
+
+    @classmethod
+    def load(cls, directory: Path) -> "Recommendations":
+        return cls({name: np.load(directory / f"{name}.npy", mmap_mode='r') for name in FILES})
+
+    def __len__(self) -> int:
+        return len(self.neighbors)
+
+    def path(self, row: int) -> str:
+        return bytes(self.paths[self.path_offsets[row]:self.path_offsets[row + 1]]).decode()
+
+    def payload(self, row: int) -> Optional[Payload]:
+        start, end = self.payload_offsets[row], self.payload_offsets[row + 1]
+        return json.loads(bytes(self.payloads[start:end])) if end > start else None
+
+    def row(self, path: str) -> Optional[int]:
+        key = np.uint64(path_hash(path))
+        index = int(np.searchsorted(self.hashes, key))
+        if index == len(self.hashes) or self.hashes[index] != key:
+            return None
+
+        row = int(self.rows[index])
+        return row if self.path(row) == path else None
+
+    def candidates(self, row: int) -> Iterator[int]:
+        """The song's neighbours, then a few songs of each similar artist."""
+        for neighbor in self.neighbors[row].tolist():
+            if neighbor < 0:
+                break
+            yield neighbor
+
+        artist = self.artists[row]
+        if artist < 0:
+            return
+
+        for similar in self.artist_neighbors[artist].tolist():
+            if similar < 0:
+                break
+
+            start = self.artist_offsets[similar]
+            end = min(self.artist_offsets[similar + 1], start + ARTIST_SONGS)
+            yield from self.artist_songs[start:end].tolist()
+
+    def next(self, path: str, recent: Collection[str]) -> Optional[Tuple[str, Payload]]:
+        """The closest song to `path` that isn't in `recent` and its payload, None for songs outside the library."""
+        row = self.row(path)
+        if row is None:
+            return None
+
+        for candidate in self.candidates(row):
+            if self.payload_offsets[candidate] == self.payload_offsets[candidate + 1]:
+                # Never resolved, it could only be played by asking Lavalink.
+                continue
+
+            candidate_path = self.path(candidate)
+            if candidate_path not in recent:
+                return candidate_path, self.payload(candidate)
+
+        return None
@@ -0,0 +1,415 @@
+import asyncio
+
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence
+
+import asyncpg
+
+from cogs.utils import metrics
+from cogs.utils.listener import Listener
+from cogs.utils.tracks import SONG_GAIN, STORED_PAYLOAD, STORED_PAYLOADS
+from config import CONFIG
+
+if TYPE_CHECKING:
+    from cogs.utils.playlist_files import Entry
+
+
+# Ranked lookup over song titles, artists and albums, served by the
+# trigram index on song_search. Fuzzy matches come in through <%.
+SEARCH_QUERY = """
+    SELECT song_path, song_name, artist_name,
+           GREATEST(similarity(song_name, $1), word_similarity($1, song_search)) AS score
+    FROM song
+        LEFT JOIN artist ON song.artist_id = artist.artist_id
+    WHERE song_search ILIKE $2 OR $1 <% song_search
+    ORDER BY score DESC, song_name
+    LIMIT $3
+"""
+
+PLAYLIST_QUERY = """
+    SELECT playlist_id, playlist_name FROM playlist 
+        WHERE playlist_name LIKE $1 AND
+        guild_id = $2;
+"""
+
+# Lengths are in milliseconds, from the song's tags or the stored Lavalink
+# payload, whichever there is.
+PLAYLIST_TRACKS_QUERY = """
+    SELECT track_uri, track_name,
+           COALESCE((song_duration * 1000)::bigint, (track_info->'info'->>'length')::bigint) AS track_length
+    FROM playlist_tracks 
+        INNER JOIN tracks ON playlist_tracks.track_id=tracks.track_id
+        LEFT JOIN song ON song.song_path = tracks.track_uri
+        WHERE playlist_id = $1
+        ORDER BY playlist_track_id
+"""
+
+# Keyset pages over (playlist_id, playlist_track_id), `$2` is the last id
+# seen going forward or the first one going back.
+PLAYLIST_PAGE_QUERY = """
+    SELECT playlist_track_id, track_name,
+           COALESCE((song_duration * 1000)::bigint, (track_info->'info'->>'length')::bigint) AS track_length
+    FROM playlist_tracks
+        INNER JOIN tracks ON playlist_tracks.track_id=tracks.track_id
+        LEFT JOIN song ON song.song_path = tracks.track_uri
+        WHERE playlist_id = $1 AND playlist_track_id > $2
+        ORDER BY playlist_track_id
+        LIMIT $3
+"""
+
+PLAYLIST_PREVIOUS_PAGE_QUERY = """
+    SELECT playlist_track_id, track_name,
+           COALESCE((song_duration * 1000)::bigint, (track_info->'info'->>'length')::bigint) AS track_length
+    FROM playlist_tracks
+        INNER JOIN tracks ON playlist_tracks.track_id=tracks.track_id
+        LEFT JOIN song ON song.song_path = tracks.track_uri
+        WHERE playlist_id = $1 AND playlist_track_id < $2
+        ORDER BY playlist_track_id DESC
+        LIMIT $3
+"""
+
+PLAYLIST_SIZE_QUERY = """
+    SELECT COUNT(*) AS total,
+           SUM(COALESCE((song_duration * 1000)::bigint, (track_info->'info'->>'length')::bigint)) AS length
+    FROM playlist_tracks
+        INNER JOIN tracks ON playlist_tracks.track_id=tracks.track_id
+        LEFT JOIN song ON song.song_path = tracks.track_uri
+        WHERE playlist_id = $1
+"""
+
+TRACK_SEARCH_QUERY = """
+    SELECT * FROM tracks
+        WHERE track_name ILIKE $1
+        ORDER BY similarity(track_name, $2) DESC
+        LIMIT $3;
+"""
+
+ALBUM_SEARCH_QUERY = """
+    SELECT * FROM album
+        WHERE album_name ILIKE $1
+        ORDER BY similarity(album_name, $2) DESC
+        LIMIT $3;
+"""
+
+ALBUM_TRACKS_QUERY = """
+    SELECT song_path, song_name, artist_name, (song_duration * 1000)::bigint AS track_length FROM song
+        LEFT JOIN artist ON song.artist_id = artist.artist_id
+        WHERE album_id = $1;
+"""
+
+# Matches imported playlist entries against the library in one go, by path
+# first and by title (and artist, when known) otherwise. Each entry keeps
+# its position so the playlist keeps the file's order.
+IMPORT_MATCH_QUERY = """
+    WITH entry AS (
+        SELECT * FROM unnest($1::text[], $2::text[], $3::text[])
+            WITH ORDINALITY AS entry(path, title, artist, position)
+    ), matched AS (
+        SELECT entry.position, song.song_path, 0 AS rank FROM entry
+            INNER JOIN song ON song.song_path = entry.path
+        UNION ALL
+        SELECT entry.position, song.song_path, 1 AS rank FROM entry
+            INNER JOIN song ON lower(song.song_name) = lower(entry.title)
+            LEFT JOIN artist ON song.artist_id = artist.artist_id
+            WHERE entry.artist IS NULL OR lower(artist.artist_name) = lower(entry.artist)
+    )
+    SELECT DISTINCT ON (position) position, song_path FROM matched
+        ORDER BY position, rank, song_path
+"""
+
+# Songs get a tracks row on first import, with their stored payload if any.
+IMPORT_TRACKS = """
+    INSERT INTO tracks (track_name, track_uri, track_encoded, track_info)
+        SELECT song_name, song_path, song_encoded, song_info FROM song
+        WHERE song_path = ANY($1::text[])
+            AND NOT EXISTS (SELECT 1 FROM tracks WHERE track_uri = song_path)
+"""
+
+IMPORT_TRACK_IDS = """
+    SELECT DISTINCT ON (track_uri) track_uri, track_id FROM tracks
+        WHERE track_uri = ANY($1::text[])
+        ORDER BY track_uri, track_id
+"""
+
+# The unique index on (guild_id, playlist_name) decides, no row comes back
+# for a name that is taken.
+CREATE_PLAYLIST = """
+    INSERT INTO playlist (guild_id, user_id, playlist_name)
+        VALUES ($1, $2, $3)
+    ON CONFLICT (guild_id, playlist_name) DO NOTHING
+    RETURNING playlist_id
+"""
+
+# Any number of tracks in one statement, in the order given.
+ADD_PLAYLIST_TRACKS = """
+    INSERT INTO playlist_tracks (playlist_id, track_id)
+        SELECT $1, track_id FROM unnest($2::integer[]) WITH ORDINALITY AS added(track_id, position)
+        ORDER BY position
+"""
+
+NEW_TRACK = """
+    INSERT INTO tracks (track_name, track_uri, track_encoded, track_info)
+        VALUES ($1, $2, $3, $4)
+    RETURNING track_id
+"""
+
+# Every process drops its cached copy when one of these arrives, the
+# payload is `guild:<guild_id>` when the names changed and
+# `playlist:<playlist_id>` when the tracks did. Sent inside the writing
+# transaction, so it arrives once the change is visible.
+PLAYLIST_CHANNEL = "playlist_changed"
+NOTIFY_PLAYLIST = "SELECT pg_notify('playlist_changed', $1)"
+
+# Run once on every pooled connection at startup, which leaves them in the
+# connection's statement cache. The arguments match nothing.
+WARM_STATEMENTS = [
+    (SEARCH_QUERY, ("", "", 0)),
+    (PLAYLIST_QUERY, ("", 0)),
+    (PLAYLIST_TRACKS_QUERY, (0,)),
+    (PLAYLIST_PAGE_QUERY, (0, 0, 0)),
+    (PLAYLIST_PREVIOUS_PAGE_QUERY, (0, 0, 0)),
+    (PLAYLIST_SIZE_QUERY, (0,)),
+    (TRACK_SEARCH_QUERY, ("", "", 0)),
+    (STORED_PAYLOADS, ([],)),
+    (STORED_PAYLOAD, ("",)),
+    (SONG_GAIN, ("",)),
+]
+
+# Playlists whose tracks are kept in memory, and looked up names per guild.
+PLAYLIST_CACHE_SIZE = CONFIG.get("PLAYLIST_CACHE_SIZE", 500)
+NAMES_PER_GUILD = 50
+
+
+class PlaylistCache:
+    """Playlist lookups and track lists, kept until a notification says otherwise.
+
+    Only used while the listener is connected, as notifications sent while
+    it is not are lost. Everything is dropped when it connects again.
+    Results fetched while an invalidation came in are not kept, they may
+    predate it.
+    """
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.listener: Optional[Listener] = None
+        self.connection = 0
+        # Bumped by every invalidation.
+        self.generation = 0
+        self.names: Dict[int, OrderedDict[str, Optional[asyncpg.Record]]] = {}
+        self.tracks: OrderedDict[int, List[asyncpg.Record]] = OrderedDict()
+
+    def fresh(self) -> bool:
+        listener = self.listener
+        if listener is None or not listener.connected:
+            return False
+
+        if listener.connections != self.connection:
+            self.clear()
+            self.connection = listener.connections
+
+        return True
+
+    def clear(self) -> None:
+        self.generation += 1
+        self.names.clear()
+        self.tracks.clear()
+
+    async def changed(self, payload: Optional[str]) -> None:
+        if payload is None:
+            self.clear()
+            return
+
+        self.generation += 1
+        kind, _, key = payload.partition(":")
+        if kind == "guild":
+            self.names.pop(int(key), None)
+        elif kind == "playlist":
+            self.tracks.pop(int(key), None)
+
+    async def library_changed(self, payload: Optional[str]) -> None:
+        # Songs were retitled or re-tagged, their lengths may be different.
+        self.generation += 1
+        self.tracks.clear()
+
+    def playlist(self, guild_id: int, name: str) -> tuple[bool, Optional[asyncpg.Record]]:
+        names = self.names.get(guild_id)
+        if not self.fresh() or names is None or name not in names:
+            return False, None
+
+        names.move_to_end(name)
+        return True, names[name]
+
+    def keep_playlist(self, generation: int, guild_id: int, name: str,
+                      playlist: Optional[asyncpg.Record]) -> None:
+        if not self.fresh() or generation != self.generation:
+            return
+
+        names = self.names.setdefault(guild_id, OrderedDict())
+        names[name] = playlist
+        if len(names) > NAMES_PER_GUILD:
+            names.popitem(last=False)
+
+    def playlist_tracks(self, playlist_id: int) -> Optional[List[asyncpg.Record]]:
+        if not self.fresh() or playlist_id not in self.tracks:
+            return None
+
+        self.tracks.move_to_end(playlist_id)
+        return self.tracks[playlist_id]
+
+    def keep_tracks(self, generation: int, playlist_id: int, tracks: List[asyncpg.Record]) -> None:
+        if not self.fresh() or generation != self.generation:
+            return
+
+        self.tracks[playlist_id] = tracks
+        if len(self.tracks) > self.capacity:
+            self.tracks.popitem(last=False)
+
+
+class Repository:
+    """The playlist and library queries behind the music commands.
+
+    Every method takes a pooled connection for its own statements and hands
+    it back before returning, so nothing holds one while a command waits on
+    a user. The statements are the same strings on every call, which keeps
+    them in asyncpg's per connection statement cache after the first use.
+    """
+    def __init__(self, bot) -> None:
+        self.bot = bot
+        self.cache = PlaylistCache(PLAYLIST_CACHE_SIZE)
+
+    def listen(self, listener: Listener) -> None:
+        """Serve playlists from memory while `listener` keeps them up to date."""
+        listener.add(PLAYLIST_CHANNEL, self.cache.changed)
+        listener.add("library_changed", self.cache.library_changed)
+        self.cache.listener = listener
+
+    async def warm(self) -> None:
+        """Prepare the statements behind the common commands on every pooled connection."""
+        async def warm() -> None:
+            async with self.bot.db.acquire() as db:
+                for query, args in WARM_STATEMENTS:
+                    await db.fetch(query, *args)
+
+        # As many at once as the pool holds, so each one gets its own connection.
+        await asyncio.gather(*(warm() for _ in range(self.bot.db.get_size())))
+
+    async def search_songs(self, query: str, limit: int) -> List[asyncpg.Record]:
+        async with self.bot.db.acquire() as db:
+            return await db.fetch(SEARCH_QUERY, query, f"%{query}%", limit)
+
+    async def find_playlist(self, name: str, guild_id: int) -> Optional[asyncpg.Record]:
+        cached, playlist = self.cache.playlist(guild_id, name)
+        metrics.PLAYLIST_CACHE.inc("playlist", "hit" if cached else "miss")
+        if cached:
+            return playlist
+
+        generation = self.cache.generation
+        async with self.bot.db.acquire() as db:
+            playlist = await db.fetchrow(PLAYLIST_QUERY, name, guild_id)
+
+        # Names that match nothing are kept too, until a playlist is created.
+        self.cache.keep_playlist(generation, guild_id, name, playlist)
+        return playlist
+
+    async def create_playlist(self, guild_id: int, user_id: int, name: str) -> Optional[int]:
+        """Returns the new playlist's id, or None if the guild already has one by that name."""
+        async with self.bot.db.acquire() as db:
+            async with db.transaction():
+                playlist_id = await db.fetchval(CREATE_PLAYLIST, guild_id, user_id, name)
+                if playlist_id is not None:
+                    await db.execute(NOTIFY_PLAYLIST, f"guild:{guild_id}")
+
+        if playlist_id is not None:
+            # Our own copy goes once the write committed, the notification
+            # takes a moment longer to come back.
+            await self.cache.changed(f"guild:{guild_id}")
+
+        return playlist_id
+
+    async def playlist_size(self, playlist_id: int) -> Dict[str, Any]:
+        tracks = self.cache.playlist_tracks(playlist_id)
+        if tracks is None:
+            async with self.bot.db.acquire() as db:
+                return dict(await db.fetchrow(PLAYLIST_SIZE_QUERY, playlist_id))
+
+        lengths = [track['track_length'] for track in tracks if track['track_length'] is not None]
+        return {"total": len(tracks), "length": sum(lengths) if lengths else None}
+
+    async def playlist_tracks(self, playlist_id: int) -> List[asyncpg.Record]:
+        tracks = self.cache.playlist_tracks(playlist_id)
+        metrics.PLAYLIST_CACHE.inc("tracks", "miss" if tracks is None else "hit")
+        if tracks is not None:
+            return tracks
+
+        generation = self.cache.generation
+        async with self.bot.db.acquire() as db:
+            tracks = await db.fetch(PLAYLIST_TRACKS_QUERY, playlist_id)
+
+        self.cache.keep_tracks(generation, playlist_id, tracks)
+        return tracks
+
+    async def playlist_page(self, playlist_id: int, after: int, size: int) -> List[asyncpg.Record]:
+        async with self.bot.db.acquire() as db:
+            return await db.fetch(PLAYLIST_PAGE_QUERY, playlist_id, after, size)
+
+    async def playlist_page_before(self, playlist_id: int, before: int, size: int) -> List[asyncpg.Record]:
+        """The page ending just before `before`, in playlist order."""
+        async with self.bot.db.acquire() as db:
+            tracks = await db.fetch(PLAYLIST_PREVIOUS_PAGE_QUERY, playlist_id, before, size)
+
+        tracks.reverse()
+        return tracks
+
+    async def search_tracks(self, query: str, limit: int) -> List[asyncpg.Record]:
+        async with self.bot.db.acquire() as db:
+            return await db.fetch(TRACK_SEARCH_QUERY, f"%{query}%", query, limit)
+
+    async def add_tracks(self, playlist_id: int, track_ids: Sequence[int]) -> None:
+        async with self.bot.db.acquire() as db:
+            async with db.transaction():
+                await db.execute(ADD_PLAYLIST_TRACKS, playlist_id, list(track_ids))
+                await db.execute(NOTIFY_PLAYLIST, f"playlist:{playlist_id}")
+
+        await self.cache.changed(f"playlist:{playlist_id}")
+
+    async def add_new_track(self, playlist_id: int, title: str, uri: str,
+                            encoded: Optional[str], info: Optional[Dict[str, Any]]) -> None:
+        """Save a track found on Lavalink and add it to a playlist."""
+        async with self.bot.db.acquire() as db:
+            async with db.transaction():
+                track_id = await db.fetchval(NEW_TRACK, title, uri, encoded, info)
+                await db.execute(ADD_PLAYLIST_TRACKS, playlist_id, [track_id])
+                await db.execute(NOTIFY_PLAYLIST, f"playlist:{playlist_id}")
+
+        await self.cache.changed(f"playlist:{playlist_id}")
+
+    async def search_albums(self, query: str, limit: int) -> List[asyncpg.Record]:
+        async with self.bot.db.acquire() as db:
+            return await db.fetch(ALBUM_SEARCH_QUERY, f"%{query}%", query, limit)
+
+    async def album_tracks(self, album_id: int) -> List[asyncpg.Record]:
+        async with self.bot.db.acquire() as db:
+            return await db.fetch(ALBUM_TRACKS_QUERY, album_id)
+
+    async def import_entries(self, playlist_id: int, entries: List['Entry']) -> Dict[int, str]:
+        """Add the entries found in the library to a playlist, in the file's order.
+
+        Returns the matched song paths by entry position, counted from 1.
+        """
+        async with self.bot.db.acquire() as db:
+            rows = await db.fetch(IMPORT_MATCH_QUERY, *map(list, zip(*entries)))
+            paths = {row['position']: row['song_path'] for row in rows}
+            matched = [paths[position] for position in sorted(paths)]
+
+            if matched:
+                async with db.transaction():
+                    await db.execute(IMPORT_TRACKS, matched)
+                    track_ids = {row['track_uri']: row['track_id']
+                                 for row in await db.fetch(IMPORT_TRACK_IDS, matched)}
+                    await db.copy_records_to_table("playlist_tracks", columns=("playlist_id", "track_id"),
+                                                   records=[(playlist_id, track_ids[path]) for path in matched])
+                    await db.execute(NOTIFY_PLAYLIST, f"playlist:{playlist_id}")
+
+        if matched:
+            await self.cache.changed(f"playlist:{playlist_id}")
+
+        return paths
@@ -0,0 +1,206 @@
+import heapq
+import math
+import re
+
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import asyncpg
+
+
+# Rows fetched when (re)building the index. `$1` limits the fetch to rows
+# touched after a given time.
+SONGS_QUERY = """
+    SELECT song_id, song_name, song_path, artist_name, album_name, song_updated
+    FROM song
+        LEFT JOIN artist ON song.artist_id = artist.artist_id
+        LEFT JOIN album ON song.album_id = album.album_id
+"""
+CHANGED_SONGS_QUERY = SONGS_QUERY + """
+    WHERE song_updated > $1::timestamptz - interval '1 minute'
+"""
+
+WORD_SPLIT = re.compile(r"[^\w]+")
+
+# Row numbers counted per search. Postings are consumed rarest first, common
+# trigrams (think " th") past this budget say next to nothing about a match
+# and are skipped.
+POSTING_BUDGET = 20000
+# Dead rows tolerated before postings are rebuilt.
+COMPACT_RATIO = 0.25
+# Fraction of the query's trigrams a song has to contain.
+MIN_SCORE = 0.5
+
+
+def trigrams(text: str) -> set[str]:
+    """Split `text` into trigrams the same way pg_trgm does."""
+    grams = set()
+    for word in WORD_SPLIT.split(text.casefold()):
+        if not word:
+            continue
+
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+
+    return grams
+
+
+class SearchIndex:
+    """In-memory trigram index over the local library.
+
+    Row data lives in parallel arrays and every trigram maps to an array of
+    row numbers, so the per-song overhead is a handful of machine words plus
+    the strings themselves. Removed or updated songs leave a dead row behind
+    until enough of them pile up to warrant a compaction.
+    """
+    def __init__(self) -> None:
+        self.song_ids = array('q')
+        self.names: List[str] = []
+        self.artists: List[str] = []
+        self.paths: List[str] = []
+        self.gram_counts = array('H')
+        self.alive = bytearray()
+
+        self.postings: Dict[str, array] = {}
+        self.rows: Dict[int, int] = {}
+        self.dead = 0
+        self.updated_at = None
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def add(self, song_id: int, name: str, artist: Optional[str],
+            album: Optional[str], path: str) -> None:
+        if song_id in self.rows:
+            self.remove(song_id)
+
+        row = len(self.song_ids)
+        grams = trigrams(" ".join(filter(None, (name, artist, album))))
+
+        self.song_ids.append(song_id)
+        self.names.append(name)
+        self.artists.append(artist or "Unknown")
+        self.paths.append(path)
+        self.gram_counts.append(min(len(grams), 0xFFFF))
+        self.alive.append(1)
+        self.rows[song_id] = row
+
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array('I')
+            posting.append(row)
+
+    def add_records(self, records: Iterable[asyncpg.Record]) -> None:
+        for record in records:
+            self.add(record['song_id'], record['song_name'], record['artist_name'],
+                     record['album_name'], record['song_path'])
+
+            if self.updated_at is None or record['song_updated'] > self.updated_at:
+                self.updated_at = record['song_updated']
+
+    def remove(self, song_id: int) -> None:
+        row = self.rows.pop(song_id, None)
+        if row is None:
+            return
+
+        self.alive[row] = 0
+        self.dead += 1
+
+    def compact(self) -> None:
+        live = [row for row in range(len(self.song_ids)) if self.alive[row]]
+        songs = [(self.song_ids[row], self.names[row], self.artists[row], self.paths[row])
+                 for row in live]
+
+        # Album names are not kept per row, so the postings are remapped
+        # instead of being rebuilt from the songs.
+        old_postings, updated_at = self.postings, self.updated_at
+        remap = {old: new for new, old in enumerate(live)}
+
+        self.__init__()
+        self.updated_at = updated_at
+        for song_id, name, artist, path in songs:
+            self.rows[song_id] = len(self.song_ids)
+            self.song_ids.append(song_id)
+            self.names.append(name)
+            self.artists.append(artist)
+            self.paths.append(path)
+            self.alive.append(1)
+
+        counts = Counter()
+        for gram, posting in old_postings.items():
+            rows = array('I', (remap[row] for row in posting if row in remap))
+            if rows:
+                self.postings[gram] = rows
+                counts.update(rows)
+
+        self.gram_counts = array('H', (min(counts[row], 0xFFFF) for row in range(len(live))))
+
+    def search(self, query: str, limit: int) -> List[Dict]:
+        grams = trigrams(query)
+        postings = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not postings:
+            return []
+
+        used = []
+        budget = POSTING_BUDGET
+        for posting in sorted(postings, key=len):
+            if used and len(posting) > budget:
+                break
+
+            used.append(posting)
+            budget -= len(posting)
+
+        hits: Counter = Counter()
+        for posting in used:
+            hits.update(posting)
+
+        # Trigrams missing from the index count against every song, skipped
+        # common ones count for none.
+        total = len(grams) - (len(postings) - len(used))
+        needed = math.ceil(MIN_SCORE * total)
+        alive, gram_counts = self.alive, self.gram_counts
+
+        # Like pg_trgm's word_similarity(), songs are scored by how much of
+        # the query they cover. Ties go to the song with less unrelated text.
+        scored = [
+            (shared, -gram_counts[row], row)
+            for row, shared in hits.items()
+            if shared >= needed and alive[row]
+        ]
+
+        return [
+            {
+                "song_id": self.song_ids[row],
+                "song_name": self.names[row],
+                "artist_name": self.artists[row],
+                "song_path": self.paths[row],
+                "score": shared / total
+            }
+            for shared, _, row in heapq.nlargest(limit, scored)
+        ]
+
+    async def refresh(self, db: asyncpg.Connection) -> None:
+        """Apply every library change since the last load or refresh."""
+        if self.updated_at is None:
+            self.add_records(await db.fetch(SONGS_QUERY))
+            return
+
+        # The minute of overlap covers ingest transactions that were still
+        # running during the previous refresh, re-adding a song is harmless.
+        self.add_records(await db.fetch(CHANGED_SONGS_QUERY, self.updated_at))
+
+        current = set(await db.fetchval("SELECT array_agg(song_id) FROM song") or ())
+        for song_id in [song_id for song_id in self.rows if song_id not in current]:
+            self.remove(song_id)
+
+        if self.dead > COMPACT_RATIO * len(self.song_ids):
+            self.compact()
+
+    @classmethod
+    def from_records(cls, records: Sequence[asyncpg.Record]) -> "SearchIndex":
+        index = cls()
+        index.add_records(records)
+
+        return index
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import math
+import os
+import time
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import wavelink
+
+from discord.ext import commands
+
+
+# Seconds between heartbeat writes, the supervisor allows a few to go missing.
+HEARTBEAT_INTERVAL = 10
+
+Heartbeat = Dict[str, Any]
+
+
+def shard_ranges(first: int, processes: int, per_process: int) -> List[List[int]]:
+    """Consecutive shard ids for each process, starting at `first`."""
+    return [list(range(first + i * per_process, first + (i + 1) * per_process)) for i in range(processes)]
+
+def share(total: int, processes: int, minimum: int = 1) -> int:
+    """One process' part of a per host budget like database connections."""
+    return max(minimum, math.ceil(total / processes))
+
+def latency(value: float) -> Optional[float]:
+    # Shards that are not connected report an infinite latency.
+    return round(value, 4) if math.isfinite(value) else None
+
+def heartbeat(bot: commands.AutoShardedBot, process: int) -> Heartbeat:
+    guilds: Dict[int, int] = {}
+    for guild in bot.guilds:
+        guilds[guild.shard_id] = guilds.get(guild.shard_id, 0) + 1
+
+    shards = {
+        str(shard_id): {
+            "latency": latency(shard.latency),
+            "closed": shard.is_closed(),
+            "guilds": guilds.get(shard_id, 0)
+        }
+        for shard_id, shard in bot.shards.items()
+    }
+    return {
+        "pid": os.getpid(),
+        "process": process,
+        "time": time.time(),
+        "ready": bot.is_ready(),
+        "shards": shards,
+        "players": sum(len(node.players) for node in wavelink.Pool.nodes.values())
+    }
+
+def write_heartbeat(path: Path, data: Heartbeat) -> None:
+    # Written next to the target and renamed, readers never see half a file.
+    temp = path.with_suffix(".tmp")
+    temp.write_text(json.dumps(data))
+    os.replace(temp, path)
+
+def read_heartbeat(path: Path) -> Optional[Heartbeat]:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+async def beat(bot: commands.AutoShardedBot, path: Path, process: int) -> None:
+    """Keep writing this process' shard health to `path` for the supervisor."""
+    while True:
+        await asyncio.to_thread(write_heartbeat, path, heartbeat(bot, process))
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
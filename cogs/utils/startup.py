@@ -0,0 +1,38 @@
+import contextlib
+import logging
+import time
+
+from typing import AsyncIterator, Dict
+
+from cogs.utils import metrics
+
+
+log = logging.getLogger(__name__)
+
+
+class Phases:
+    """Times the phases of startup, phases running side by side are timed on their own."""
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.times: Dict[str, float] = {}
+
+    @contextlib.asynccontextmanager
+    async def phase(self, name: str) -> AsyncIterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float) -> None:
+        self.times[name] = seconds
+        metrics.STARTUP_PHASE.set(round(seconds, 4), name)
+
+    def done(self) -> None:
+        """Record the time since start and log every phase."""
+        self.record("total", time.perf_counter() - self.start)
+        log.info("Ready after %s.", ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.times.items()))
+
+
+# Created when the bot is imported, which is as close to process start as it gets.
+phases = Phases()
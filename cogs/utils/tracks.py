@@ -0,0 +1,367 @@
+import asyncio
+import time
+
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import wavelink
+
+from cogs.utils.metrics import LAVALINK_SEARCH, SEARCH_CACHE
+from config import CONFIG
+
+
+# Stored alongside every resolved track or song, `$1` is the URI.
+STORE_TRACK = """
+    UPDATE tracks SET track_encoded = $2, track_info = $3
+        WHERE track_uri = $1
+"""
+STORE_SONG = """
+    UPDATE song SET song_encoded = $2, song_info = $3
+        WHERE song_path = $1
+"""
+# Payloads for a window of queued references, songs share their URI with a tracks row.
+STORED_PAYLOADS = """
+    SELECT DISTINCT ON (track_uri) track_uri, track_encoded, track_info FROM tracks
+        WHERE track_uri = ANY($1::text[]) AND track_encoded IS NOT NULL
+"""
+# Payload for a single URI, the song row is there even if the song was never queued.
+STORED_PAYLOAD = """
+    SELECT song_encoded AS encoded, song_info AS info FROM song
+        WHERE song_path = $1 AND song_encoded IS NOT NULL
+    UNION ALL
+    SELECT track_encoded, track_info FROM tracks
+        WHERE track_uri = $1 AND track_encoded IS NOT NULL
+    LIMIT 1
+"""
+FORGET_TRACK = """
+    UPDATE tracks SET track_encoded = NULL, track_info = NULL
+        WHERE track_uri = $1
+"""
+FORGET_SONG = """
+    UPDATE song SET song_encoded = NULL, song_info = NULL
+        WHERE song_path = $1
+"""
+SONG_GAIN = """
+    SELECT song_gain, song_peak FROM song
+        WHERE song_path = $1
+"""
+
+# Metric labels for the sources tracks are searched on, None passes the query as is.
+SOURCE_NAMES = {
+    None: "local",
+    wavelink.TrackSource.YouTubeMusic: "youtube_music",
+    wavelink.TrackSource.YouTube: "youtube"
+}
+
+# Headroom added to every ReplayGain value, in dB.
+PREAMP = CONFIG.get("REPLAYGAIN_PREAMP", 0.0)
+# Most a quiet song is boosted by, its peak can only lower this.
+MAX_LEVEL = 2.0
+
+Payload = Dict[str, Any]
+# A URI with its stored encoded string and metadata, if any.
+Entry = Tuple[str, Optional[str], Optional[Payload]]
+# Source name and normalized query.
+SearchKey = Tuple[str, str]
+
+
+class SearchCache:
+    """Recent search results, shared between every guild.
+
+    Results are kept for `ttl` seconds in a bounded LRU, searches that found
+    nothing only for `empty_ttl` so a flaky source gets asked again soon.
+    Identical searches arriving while one is in flight wait for its result
+    instead of asking Lavalink again.
+    """
+    def __init__(self, capacity: int, ttl: float, empty_ttl: float) -> None:
+        self.capacity = capacity
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self.results: OrderedDict[SearchKey, Tuple[float, wavelink.Search]] = OrderedDict()
+        self.searching: Dict[SearchKey, asyncio.Task] = {}
+
+    async def get(self, key: SearchKey, fetch: Callable[[], Awaitable[wavelink.Search]]) -> wavelink.Search:
+        cached = self.results.get(key)
+        if cached is not None:
+            expires, result = cached
+            if expires > time.monotonic():
+                self.results.move_to_end(key)
+                SEARCH_CACHE.inc(key[0], "hit")
+                return result
+
+            del self.results[key]
+
+        task = self.searching.get(key)
+        if task is None:
+            SEARCH_CACHE.inc(key[0], "miss")
+            task = asyncio.create_task(self.fetch(key, fetch))
+            self.searching[key] = task
+        else:
+            SEARCH_CACHE.inc(key[0], "shared")
+
+        # A waiter giving up doesn't cancel the search for the others.
+        return await asyncio.shield(task)
+
+    async def fetch(self, key: SearchKey, fetch: Callable[[], Awaitable[wavelink.Search]]) -> wavelink.Search:
+        try:
+            result = await fetch()
+        finally:
+            del self.searching[key]
+
+        ttl = self.ttl if result else self.empty_ttl
+        self.results[key] = (time.monotonic() + ttl, result)
+        if len(self.results) > self.capacity:
+            self.results.popitem(last=False)
+
+        return result
+
+    def forget(self, query: str) -> None:
+        """Drop the results for `query` on every source."""
+        for source in SOURCE_NAMES:
+            self.results.pop(search_key(query, source), None)
+
+
+search_cache = SearchCache(CONFIG.get("SEARCH_CACHE_SIZE", 1000), CONFIG.get("SEARCH_CACHE_TTL", 600),
+                           CONFIG.get("SEARCH_CACHE_EMPTY_TTL", 30))
+
+
+def search_key(query: str, source: Optional[wavelink.TrackSource]) -> SearchKey:
+    name = SOURCE_NAMES.get(source, str(source))
+    if source is None:
+        # Paths and URLs are case sensitive.
+        return name, query.strip()
+
+    return name, " ".join(query.casefold().split())
+
+async def search(query: str,
+                 source: Optional[wavelink.TrackSource] = wavelink.TrackSource.YouTubeMusic) -> wavelink.Search:
+    """``wavelink.Playable.search`` through the search cache.
+
+    The result may be shared with other callers, don't modify it.
+    """
+    return await search_cache.get(search_key(query, source), lambda: search_lavalink(query, source))
+
+async def search_lavalink(query: str, source: Optional[wavelink.TrackSource]) -> wavelink.Search:
+    """``wavelink.Playable.search``, timed per source."""
+    name = SOURCE_NAMES.get(source, str(source))
+    start = time.perf_counter()
+    try:
+        result = await wavelink.Playable.search(query, source=source)
+    except wavelink.WavelinkException:
+        LAVALINK_SEARCH.observe(time.perf_counter() - start, name, "error")
+        raise
+
+    LAVALINK_SEARCH.observe(time.perf_counter() - start, name, "found" if result else "empty")
+    return result
+
+async def search_uri(uri: str) -> Optional[wavelink.Playable]:
+    """Resolve `uri` through Lavalink, trying local files, then the default source, then YouTube."""
+    result: wavelink.Search = await search(uri, source=None)
+    if not result:
+        result = await search(uri)
+
+        if not result:
+            result = await search(uri, source=wavelink.TrackSource.YouTube)
+
+    if not result:
+        return None
+
+    return result[0]
+
+def gain_level(gain: Optional[float], peak: Optional[float]) -> float:
+    """Volume multiplier for a song's ReplayGain `gain` in dB, limited by its `peak`."""
+    if gain is None:
+        return 1.0
+
+    level = 10 ** ((gain + PREAMP) / 20)
+    limit = 1 / peak if peak else MAX_LEVEL
+    return round(min(level, limit, MAX_LEVEL), 3)
+
+def split_payload(payload: Payload) -> Tuple[str, Payload]:
+    """Split a Lavalink track payload into its encoded string and metadata."""
+    return payload["encoded"], {"info": payload["info"], "pluginInfo": payload.get("pluginInfo", {})}
+
+
+class TrackRef:
+    """A queued track that has not been resolved yet.
+
+    Playlists and albums are queued as these, only the upcoming few are
+    turned into full ``Playable`` objects. A ref can also carry a track that
+    was already resolved, so it keeps its place behind earlier refs.
+    """
+    __slots__ = ("uri", "title", "author", "track", "length")
+
+    def __init__(self, uri: str, title: str, author: Optional[str] = None,
+                 track: Optional[wavelink.Playable] = None, length: Optional[int] = None) -> None:
+        self.uri = uri
+        self.title = title
+        self.author = author
+        self.track = track
+        # Milliseconds, like ``Playable.length``.
+        self.length = length
+
+    @classmethod
+    def from_track(cls, track: wavelink.Playable) -> "TrackRef":
+        return cls(track.uri or track.identifier, track.title, track.author, track, track.length)
+
+
+class TrackStore:
+    """Turns stored URIs into playable tracks without asking Lavalink twice.
+
+    The first resolution of a URI is saved with its ``tracks`` and ``song``
+    rows. Later loads rebuild the ``Playable`` from that payload, with a
+    bounded LRU in front of the database. A payload is only searched for
+    again once it no longer decodes or Lavalink fails to play it.
+    """
+    def __init__(self, bot, capacity: int) -> None:
+        self.bot = bot
+        self.capacity = capacity
+        self.cache: OrderedDict[str, Payload] = OrderedDict()
+        self.levels: OrderedDict[str, float] = OrderedDict()
+
+    def remember(self, uri: str, payload: Payload) -> None:
+        self.cache[uri] = payload
+        self.cache.move_to_end(uri)
+
+        if len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+
+    def build(self, uri: str, payload: Payload) -> Optional[wavelink.Playable]:
+        try:
+            track = wavelink.Playable(payload)
+        except (KeyError, TypeError):
+            return None
+
+        # Lavalink hands the extras back on events, see forget().
+        track.extras = {"uri": uri}
+        return track
+
+    async def load(self, uri: str, encoded: Optional[str] = None,
+                   info: Optional[Payload] = None,
+                   resolved: Optional[List[Tuple[str, str, Payload]]] = None,
+                   lookup: bool = True) -> Optional[wavelink.Playable]:
+        """Load a single track.
+
+        Without an `encoded` payload the stored one is looked up, unless
+        `lookup` is off because the caller already did. Fresh resolutions
+        are stored right away, unless a `resolved` list is passed to collect
+        them for a later :meth:`store`.
+        """
+        payload = self.cache.get(uri)
+        if payload is None and encoded is None and lookup:
+            async with self.bot.db.acquire() as db:
+                row = await db.fetchrow(STORED_PAYLOAD, uri)
+
+            if row is not None:
+                encoded, info = row['encoded'], row['info']
+
+        if payload is None and encoded and info:
+            payload = {"encoded": encoded, **info}
+
+        if payload is not None:
+            track = self.build(uri, payload)
+            if track is not None:
+                self.remember(uri, payload)
+                return track
+
+        found = await search_uri(uri)
+        if found is None:
+            return None
+
+        encoded, info = split_payload(found.raw_data)
+        payload = {"encoded": encoded, **info}
+        self.remember(uri, payload)
+        if resolved is None:
+            await self.store([(uri, encoded, info)])
+        else:
+            resolved.append((uri, encoded, info))
+
+        return self.build(uri, payload)
+
+    async def load_ordered(self, entries: Sequence[Entry],
+                           limit: int) -> AsyncIterator[Tuple[str, Optional[wavelink.Playable]]]:
+        """Load `entries` with up to `limit` in flight, yielding them in their original order.
+
+        Tracks that fail to resolve are yielded as ``None``.
+        """
+        semaphore = asyncio.Semaphore(limit)
+        resolved: List[Tuple[str, str, Payload]] = []
+
+        async def load(entry: Entry) -> Optional[wavelink.Playable]:
+            async with semaphore:
+                try:
+                    # The entries carry whatever was stored.
+                    return await self.load(*entry, resolved=resolved, lookup=False)
+                except wavelink.WavelinkException:
+                    return None
+
+        tasks = [asyncio.create_task(load(entry)) for entry in entries]
+        try:
+            for entry, task in zip(entries, tasks):
+                yield entry[0], await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            if resolved:
+                await self.store(resolved)
+
+    async def load_refs(self, refs: Sequence[TrackRef],
+                        limit: int) -> AsyncIterator[Tuple[str, Optional[wavelink.Playable]]]:
+        """Like :meth:`load_ordered`, fetching the stored payloads of `refs` in one query first."""
+        missing = [ref.uri for ref in refs if ref.track is None and ref.uri not in self.cache]
+        stored: Dict[str, Tuple[str, Payload]] = {}
+        if missing:
+            async with self.bot.db.acquire() as db:
+                rows = await db.fetch(STORED_PAYLOADS, missing)
+
+            stored = {row['track_uri']: (row['track_encoded'], row['track_info']) for row in rows}
+
+        unresolved = [ref for ref in refs if ref.track is None]
+        entries = [(ref.uri, *stored.get(ref.uri, (None, None))) for ref in unresolved]
+        loaded = self.load_ordered(entries, limit)
+
+        try:
+            for ref in refs:
+                if ref.track is not None:
+                    yield ref.uri, ref.track
+                else:
+                    yield await anext(loaded)
+        finally:
+            # Stores whatever was newly resolved.
+            await loaded.aclose()
+
+    async def store(self, resolved: List[Tuple[str, str, Payload]]) -> None:
+        async with self.bot.db.acquire() as db:
+            async with db.transaction():
+                await db.executemany(STORE_TRACK, resolved)
+                await db.executemany(STORE_SONG, resolved)
+
+    async def level(self, uri: str) -> float:
+        """Volume multiplier that evens out the loudness of the song at `uri`."""
+        level = self.levels.get(uri)
+        if level is not None:
+            self.levels.move_to_end(uri)
+            return level
+
+        if uri.startswith(("http://", "https://")):
+            # Only local songs are tagged.
+            return 1.0
+
+        async with self.bot.db.acquire() as db:
+            row = await db.fetchrow(SONG_GAIN, uri)
+
+        level = gain_level(row['song_gain'], row['song_peak']) if row else 1.0
+        self.levels[uri] = level
+        if len(self.levels) > self.capacity:
+            self.levels.popitem(last=False)
+
+        return level
+
+    async def forget(self, uri: str) -> None:
+        self.cache.pop(uri, None)
+        search_cache.forget(uri)
+
+        async with self.bot.db.acquire() as db:
+            await db.execute(FORGET_TRACK, uri)
+            await db.execute(FORGET_SONG, uri)
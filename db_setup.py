@@ -1,99 +1,895 @@
+import argparse
 import asyncio
+import hashlib
+import itertools
+import math
+import os
+import re
+import socket
+import time
+import zlib
 import asyncpg
 
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
 from pathlib import Path
-from tinytag import TinyTag
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+from tinytag import TinyTag, TinyTagException
 
 from config import CONFIG
 
 LIB_PATH = Path(CONFIG["MUSIC_PATH"])
+# Workers on other hosts reach the database over the network.
+DB_HOST = CONFIG.get("DB_HOST", "127.0.0.1")
 
-with open("setup.sql", 'r') as script:
-    query = script.read()
+# Paths handed to a worker process in one go, keeps IPC overhead low.
+WALK_BATCH = 256
+# Parsed batches allowed to wait on the writer, per worker.
+QUEUE_DEPTH = 4
+PROGRESS_INTERVAL = 5.0
+# Songs copied into the staging table per transaction.
+LOAD_BATCH = 5000
+# Bytes read from each end of a file for its content hash.
+HASH_SAMPLE = 64 * 1024
+# Seconds to let a burst of file system events settle in watch mode.
+WATCH_DEBOUNCE = 2.0
+YEAR = re.compile(r"\d{4}")
+# Files per shard handed to distributed workers, bigger directories are split.
+SHARD_FILES = 500
+# Seconds between a worker's heartbeats, a shard that misses them for
+# SHARD_TIMEOUT is claimed again by someone else.
+HEARTBEAT_INTERVAL = 15
+SHARD_TIMEOUT = timedelta(seconds=60)
+# Seconds a worker waits before looking for work again while other hosts
+# still hold shards that could time out.
+POLL_INTERVAL = 5
+# Attempts at a shard before it is marked as failed.
+SHARD_ATTEMPTS = 3
 
-async def run(lib_path: Path):
-    conn: asyncpg.connection.Connection = await asyncpg.connect(user=CONFIG["DB_USER"],
-                                                                database=CONFIG["DB_DATABASE"],
-                                                                host="127.0.0.1")
-    
-    await conn.execute(query)
+STAGING_COLUMNS = ["song_name", "song_path", "artist_name", "album_name",
+                   "song_size", "song_mtime", "song_hash", "song_duration", "song_bitrate",
+                   "song_samplerate", "song_gain", "song_peak", "song_genre", "song_year"]
 
-    await setup_lib(conn, lib_path)
-    await conn.close()
+# Resolves a whole staged batch in one round-trip. Names are inserted in
+# order, so distributed workers adding the same ones can't deadlock.
+MERGE_STAGING = """
+    INSERT INTO artist (artist_name)
+        SELECT DISTINCT artist_name FROM song_staging ORDER BY artist_name
+    ON CONFLICT (artist_name) DO NOTHING;
 
-def iter_dir(directory):
-    for file in directory.iterdir():
-        if file.is_dir():
-            iter_dir(file)
-        else:
-            if TinyTag.is_supported(file):
-                tag = TinyTag.get(file)
-                print(file)
+    INSERT INTO album (album_name)
+        SELECT DISTINCT album_name FROM song_staging ORDER BY album_name
+    ON CONFLICT (album_name) DO NOTHING;
 
-async def insert_data(conn: asyncpg.connection.Connection, tag: TinyTag, path: Path):
-    artist = tag.artist
-    if artist is None:
-        artist = "Unknown"
+    WITH upserted AS (
+        INSERT INTO song (song_name, song_path, artist_id, album_id,
+                          song_size, song_mtime, song_hash, song_search, song_duration,
+                          song_bitrate, song_samplerate, song_gain, song_peak, song_genre, song_year)
+            SELECT DISTINCT ON (staged.song_path)
+                staged.song_name, staged.song_path, artist.artist_id, album.album_id,
+                staged.song_size, staged.song_mtime, staged.song_hash,
+                concat_ws(' ', staged.song_name, staged.artist_name, staged.album_name),
+                staged.song_duration, staged.song_bitrate, staged.song_samplerate,
+                staged.song_gain, staged.song_peak, staged.song_genre, staged.song_year
+            FROM song_staging staged
+                INNER JOIN artist ON artist.artist_name = staged.artist_name
+                INNER JOIN album ON album.album_name = staged.album_name
+        ON CONFLICT (song_path) DO UPDATE SET
+            song_name = EXCLUDED.song_name,
+            artist_id = EXCLUDED.artist_id,
+            album_id = EXCLUDED.album_id,
+            song_size = EXCLUDED.song_size,
+            song_mtime = EXCLUDED.song_mtime,
+            song_hash = EXCLUDED.song_hash,
+            song_search = EXCLUDED.song_search,
+            song_duration = EXCLUDED.song_duration,
+            song_bitrate = EXCLUDED.song_bitrate,
+            song_samplerate = EXCLUDED.song_samplerate,
+            song_gain = EXCLUDED.song_gain,
+            song_peak = EXCLUDED.song_peak,
+            song_genre = EXCLUDED.song_genre,
+            song_year = EXCLUDED.song_year,
+            song_updated = now()
+        RETURNING song_name, song_path, (xmax = 0) AS inserted
+    ), retitled AS (
+        UPDATE tracks SET track_name = upserted.song_name
+            FROM upserted
+            WHERE NOT upserted.inserted AND tracks.track_uri = upserted.song_path
+    )
+    INSERT INTO tracks (track_uri, track_name)
+        SELECT song_path, song_name FROM upserted WHERE inserted;
+"""
 
-    artist_query = "SELECT artist_id FROM artist WHERE artist_name = $1"
-    result = await conn.fetchrow(artist_query, artist)
+MOVE_SONGS = """
+    WITH moves AS (
+        SELECT * FROM unnest($1::text[], $2::text[]) AS m(old_path, new_path)
+    ), moved_tracks AS (
+        UPDATE tracks SET track_uri = moves.new_path
+            FROM moves
+            WHERE tracks.track_uri = moves.old_path
+    )
+    UPDATE song SET song_path = moves.new_path, song_updated = now()
+        FROM moves
+        WHERE song.song_path = moves.old_path
+"""
 
-    if result is None:
-        await conn.execute(
-            "INSERT INTO artist (artist_name) VALUES ($1)",
-            artist
+# Tracks still referenced by a playlist are kept around.
+DELETE_SONGS = """
+    WITH removed AS (
+        DELETE FROM song WHERE song_path = ANY($1::text[])
+    )
+    DELETE FROM tracks
+        WHERE track_uri = ANY($1::text[]) AND NOT EXISTS (
+            SELECT 1 FROM playlist_tracks
+                WHERE playlist_tracks.track_id = tracks.track_id
         )
+"""
 
-        result = await conn.fetchrow(artist_query, artist)
-        artist_id = result['artist_id']
-    else:
-        artist_id = result['artist_id']
-
-    album = tag.album
-    if album is None:
-        album = "Unknown"
-    album_query = "SELECT album_id FROM album WHERE album_name = $1"
-    result = await conn.fetchrow(album_query, album)
-  
-    if result is None:
+# Distributed ingestion, see migrations/0007_ingest_jobs.sql.
+CREATE_RUN = """
+    INSERT INTO ingest_run (run_full) VALUES ($1)
+    RETURNING run_id
+"""
+# Shards whose worker died `$3` times are given up on, they may be what
+# kills it.
+CLAIM_SHARD = """
+    WITH abandoned AS (
+        UPDATE ingest_job SET job_state = 'failed', job_worker = NULL,
+                              job_error = 'Its worker stopped responding ' || job_attempts || ' times'
+            WHERE job_state = 'running' AND job_heartbeat < now() - $2::interval AND job_attempts >= $3
+    )
+    UPDATE ingest_job SET job_state = 'running', job_worker = $1, job_heartbeat = now(),
+                          job_attempts = job_attempts + 1
+        WHERE job_id = (
+            SELECT job_id FROM ingest_job
+                WHERE job_state = 'pending'
+                    OR (job_state = 'running' AND job_heartbeat < now() - $2::interval AND job_attempts < $3)
+                ORDER BY job_id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+        )
+    RETURNING job_id, job_dirs, job_part, job_parts,
+              (SELECT run_full FROM ingest_run WHERE ingest_run.run_id = ingest_job.run_id)
+"""
+HEARTBEAT = """
+    UPDATE ingest_job SET job_heartbeat = now()
+        WHERE job_id = $1 AND job_worker = $2
+"""
+FINISH_SHARD = """
+    UPDATE ingest_job SET job_state = 'done', job_tagged = $3, job_vanished = $4,
+                          job_error = NULL, job_finished = now()
+        WHERE job_id = $1 AND job_worker = $2
+"""
+FAIL_SHARD = """
+    UPDATE ingest_job SET job_state = CASE WHEN job_attempts >= $4 THEN 'failed' ELSE 'pending' END,
+                          job_error = $3, job_worker = NULL
+        WHERE job_id = $1 AND job_worker = $2
+"""
+SHARDS_LEFT = """
+    SELECT EXISTS (SELECT 1 FROM ingest_job WHERE job_state IN ('pending', 'running'))
+"""
+SHARD_SONGS = """
+    SELECT song_path, song_size, song_mtime, song_hash FROM song
+        WHERE regexp_replace(song_path, '/[^/]*$', '') = ANY($1::text[])
+"""
+SONGS_BY_HASH = """
+    SELECT song_hash, song_path FROM song
+        WHERE song_hash = ANY($1::text[])
+"""
+FAILED_SHARDS = """
+    SELECT job_id, job_dirs, job_error FROM ingest_job
+        WHERE run_id = $1 AND job_state = 'failed'
+"""
+# Songs that vanished from a shard and weren't moved by another, and the
+# songs of directories that are gone altogether. `$2` is the library root.
+RUN_VANISHED = """
+    SELECT unnest(job_vanished) AS song_path FROM ingest_job
+        WHERE run_id = $1 AND job_state = 'done'
+    UNION
+    SELECT song_path FROM song
+        WHERE starts_with(song_path, $2) AND regexp_replace(song_path, '/[^/]*$', '') NOT IN (
+            SELECT unnest(job_dirs) FROM ingest_job WHERE run_id = $1
+        )
+"""
+FINISH_RUN = """
+    UPDATE ingest_run SET run_finished = now()
+        WHERE run_id = $1
+"""
+
+MIGRATIONS_PATH = Path(__file__).parent / "migrations"
+# Held while migrating so two runs cannot apply the same migration.
+MIGRATION_LOCK = 0x7961646d62
+
+
+class ParsedSong(NamedTuple):
+    title: str
+    path: str
+    artist: str
+    album: str
+    size: int
+    mtime: float
+    hash: str
+    duration: Optional[float]
+    bitrate: Optional[float]
+    samplerate: Optional[int]
+    gain: Optional[float]
+    peak: Optional[float]
+    genre: Optional[str]
+    year: Optional[int]
+
+
+class KnownSong(NamedTuple):
+    size: Optional[int]
+    mtime: Optional[float]
+    hash: Optional[str]
+
+
+class Progress:
+    def __init__(self) -> None:
+        self.files = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.start
+        return self.files / elapsed if elapsed > 0 else 0.0
+
+    def update(self, count: int) -> None:
+        self.files += count
+
+        now = time.perf_counter()
+        if now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            print(f"{self.files} files ingested ({self.rate:.0f} files/sec)")
+
+    def done(self) -> None:
+        elapsed = time.perf_counter() - self.start
+        print(f"Finished: {self.files} files in {elapsed:.1f}s ({self.rate:.0f} files/sec)")
+
+
+class ChangeCollector:
+    """Gathers paths from watchdog events, which arrive on the observer thread."""
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self.paths: Set[str] = set()
+        self.changed = asyncio.Event()
+
+    def dispatch(self, event) -> None:
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+
+        paths = [event.src_path]
+        if getattr(event, "dest_path", None):
+            paths.append(event.dest_path)
+
+        self.loop.call_soon_threadsafe(self.add, paths)
+
+    def add(self, paths: List[str]) -> None:
+        self.paths.update(paths)
+        self.changed.set()
+
+    def drain(self) -> Set[str]:
+        paths, self.paths = self.paths, set()
+        self.changed.clear()
+
+        return paths
+
+
+async def connect() -> asyncpg.connection.Connection:
+    return await asyncpg.connect(user=CONFIG["DB_USER"], database=CONFIG["DB_DATABASE"], host=DB_HOST)
+
+async def run(lib_path: Path, workers: int, full: bool, watch: bool, migrate_only: bool):
+    conn = await connect()
+
+    await migrate(conn)
+    if migrate_only:
+        await conn.close()
+        return
+
+    known = await fetch_known(conn)
+    await sync_lib(conn, known, walk_lib(lib_path), workers, full)
+
+    if watch:
+        await watch_lib(conn, lib_path, workers)
+
+    await conn.close()
+
+async def migrate(conn: asyncpg.connection.Connection):
+    """Apply every migration in `MIGRATIONS_PATH` the database has not seen yet."""
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK)
+    try:
         await conn.execute(
-            "INSERT INTO album (album_name) VALUES ($1)",
-            album
+            '''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version integer PRIMARY KEY,
+                name text NOT NULL,
+                applied_at timestamptz NOT NULL DEFAULT now()
+            )
+            '''
         )
 
-        result = await conn.fetchrow(album_query, album)
-        album_id = result['album_id']
+        applied = {row['version'] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+        if not applied and await conn.fetchval("SELECT to_regclass('public.song')") is not None:
+            # Created by setup.sql before there were migrations.
+            await conn.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (1, '0001_initial')"
+            )
+            applied.add(1)
+
+        for path in sorted(MIGRATIONS_PATH.glob("*.sql")):
+            version = int(path.name.split("_", 1)[0])
+            if version in applied:
+                continue
+
+            async with conn.transaction():
+                await conn.execute(path.read_text())
+                await conn.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                    version, path.stem
+                )
+
+            print(f"Applied migration {path.name}")
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK)
+
+def walk_lib(directory: Path) -> Iterator[Path]:
+    """Lazily yield every supported file below `directory`."""
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(Path(entry.path))
+                elif TinyTag.is_supported(entry.path):
+                    yield Path(entry.path)
+
+def content_hash(path: Path, size: int) -> str:
+    # Hashing whole files would mean reading the entire library, the size
+    # plus both ends of the file is enough to recognise a moved file.
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, 'rb') as file:
+        digest.update(file.read(HASH_SAMPLE))
+        if size > HASH_SAMPLE:
+            file.seek(max(HASH_SAMPLE, size - HASH_SAMPLE))
+            digest.update(file.read(HASH_SAMPLE))
+
+    return digest.hexdigest()
+
+def tag_number(tag: TinyTag, name: str) -> Optional[float]:
+    # Free form tags come as lists of strings like "-6.48 dB".
+    values = tag.other.get(name)
+    if not values:
+        return None
+
+    try:
+        return float(values[0].split()[0])
+    except (ValueError, IndexError):
+        return None
+
+def replay_gain(tag: TinyTag) -> Tuple[Optional[float], Optional[float]]:
+    """Track gain in dB and linear peak, from ReplayGain or Opus R128 tags."""
+    gain = tag_number(tag, "replaygain_track_gain")
+    if gain is None:
+        gain = tag_number(tag, "replaygain_album_gain")
+    if gain is None:
+        r128 = tag_number(tag, "r128_track_gain")
+        if r128 is not None:
+            # Q7.8 fixed point relative to -23 LUFS, ReplayGain aims 5 dB louder.
+            gain = r128 / 256 + 5
+
+    peak = tag_number(tag, "replaygain_track_peak")
+    if peak is None:
+        peak = tag_number(tag, "replaygain_album_peak")
+
+    return gain, peak
+
+def tag_year(tag: TinyTag) -> Optional[int]:
+    # Dates come as "2004", "2004-05-01" or worse.
+    match = YEAR.match(tag.year or "")
+    return int(match[0]) if match else None
+
+def parse_batch(paths: List[Path]) -> List[ParsedSong]:
+    # Runs inside a worker process.
+    songs = []
+    for path in paths:
+        try:
+            stat = path.stat()
+            tag = TinyTag.get(path)
+            digest = content_hash(path, stat.st_size)
+        except (TinyTagException, OSError) as e:
+            print(f"Skipping {path}: {e}")
+            continue
+
+        gain, peak = replay_gain(tag)
+        songs.append(ParsedSong(
+            tag.title or "Unknown",
+            str(path),
+            tag.artist or "Unknown",
+            tag.album or "Unknown",
+            stat.st_size,
+            stat.st_mtime,
+            digest,
+            tag.duration,
+            tag.bitrate,
+            tag.samplerate,
+            gain,
+            peak,
+            (tag.genre or "").strip() or None,
+            tag_year(tag)
+        ))
+
+    return songs
+
+async def fetch_known(conn: asyncpg.connection.Connection,
+                      paths: Optional[List[str]] = None) -> Dict[str, KnownSong]:
+    """Fetch stored file state, either for the whole library or for `paths` and anything below them."""
+    known_query = "SELECT song_path, song_size, song_mtime, song_hash FROM song"
+    if paths is None:
+        rows = await conn.fetch(known_query)
     else:
-        album_id = result['album_id']
+        prefixes = [os.path.join(path, "") for path in paths]
+        rows = await conn.fetch(
+            known_query + """
+                WHERE song_path = ANY($1::text[]) OR EXISTS (
+                    SELECT 1 FROM unnest($2::text[]) AS prefix
+                        WHERE starts_with(song_path, prefix)
+                )
+            """,
+            paths, prefixes
+        )
 
-    if tag.title is None:
-        tag.title = "Unknown"
+    return {row['song_path']: KnownSong(row['song_size'], row['song_mtime'], row['song_hash'])
+            for row in rows}
 
+async def create_staging(conn: asyncpg.connection.Connection):
     await conn.execute(
         '''
-        INSERT INTO song (song_name, song_path, artist_id, album_id)
-            VALUES ($1, $2, $3, $4)
-        ''',
-        tag.title, str(path), artist_id, album_id
-    )
-
-    await conn.execute(
+        CREATE TEMPORARY TABLE IF NOT EXISTS song_staging (
+            song_name text,
+            song_path text,
+            artist_name text,
+            album_name text,
+            song_size bigint,
+            song_mtime double precision,
+            song_hash text,
+            song_duration double precision,
+            song_bitrate real,
+            song_samplerate integer,
+            song_gain real,
+            song_peak real,
+            song_genre text,
+            song_year integer
+        ) ON COMMIT DELETE ROWS
         '''
-        INSERT INTO tracks (track_uri, track_name)
-            VALUES ($1, $2)
-        ''',
-        str(path), tag.title
     )
 
-async def setup_lib(conn: asyncpg.connection.Connection, lib_path: Path):
-    for file in lib_path.iterdir():
-        if file.is_dir():
-            await setup_lib(conn, file)
+async def load_batch(conn: asyncpg.connection.Connection, songs: List[ParsedSong],
+                     moves: Dict[str, str]):
+    async with conn.transaction():
+        if moves:
+            await conn.execute(MOVE_SONGS, list(moves.keys()), list(moves.values()))
+
+        await conn.copy_records_to_table("song_staging", records=songs, columns=STAGING_COLUMNS)
+        await conn.execute(MERGE_STAGING)
+
+async def read_lib(paths: Iterable[Path], pool: ProcessPoolExecutor, queue: asyncio.Queue):
+    loop = asyncio.get_running_loop()
+    paths = iter(paths)
+
+    while True:
+        # Directory listing can block on slow disks, keep it off the loop.
+        batch = await asyncio.to_thread(list, itertools.islice(paths, WALK_BATCH))
+        if not batch:
+            break
+
+        # The queue is bounded, so this waits whenever the writer falls behind.
+        await queue.put(loop.run_in_executor(pool, parse_batch, batch))
+
+    await queue.put(None)
+
+async def write_lib(conn: asyncpg.connection.Connection, queue: asyncio.Queue,
+                    progress: Progress, known: Dict[str, KnownSong],
+                    hashes: Set[str], held: List[ParsedSong]):
+    """Load parsed songs as they come in.
+
+    New files carrying the hash of a stored song may have been moved there,
+    which is only known once the walk is done. They are put in `held`
+    instead, everything else is loaded right away.
+    """
+    await create_staging(conn)
+
+    pending: List[ParsedSong] = []
+    while (future := await queue.get()) is not None:
+        for song in await future:
+            if song.path not in known and song.hash in hashes:
+                held.append(song)
+            else:
+                pending.append(song)
+
+        if len(pending) >= LOAD_BATCH:
+            await load_batch(conn, pending, {})
+            progress.update(len(pending))
+            pending = []
+
+    if pending:
+        await load_batch(conn, pending, {})
+        progress.update(len(pending))
+
+async def sync_lib(conn: asyncpg.connection.Connection, known: Dict[str, KnownSong],
+                   files: Iterable[Path], workers: int, full: bool = False):
+    """Bring the rows in `known` in line with `files`.
+
+    Only new or modified files are tagged, or every file if `full` is set.
+    Rows whose file is gone are either moved onto a new file with the same
+    hash or deleted.
+    """
+    seen: Set[str] = set()
+    changed = 0
+
+    def changed_files() -> Iterator[Path]:
+        nonlocal changed
+        for path in files:
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+
+            seen.add(str(path))
+            song = known.get(str(path))
+            if not full and song and song.size == stat.st_size and song.mtime == stat.st_mtime:
+                continue
+
+            changed += 1
+            yield path
+
+    hashes = {song.hash for song in known.values() if song.hash}
+    held: List[ParsedSong] = []
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * QUEUE_DEPTH)
+    progress = Progress()
+
+    # Parsing starts with the first batch walked, processes are only
+    # spawned once one is submitted.
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        await asyncio.gather(
+            read_lib(changed_files(), pool, queue),
+            write_lib(conn, queue, progress, known, hashes, held)
+        )
+
+    # Only now is it known which files are gone.
+    vanished = [path for path in known if path not in seen]
+    gone = {known[path].hash: path for path in vanished if known[path].hash}
+    moves: Dict[str, str] = {}
+    for song in held:
+        # A new file carrying the hash of a vanished one was moved or renamed.
+        old_path = gone.pop(song.hash, None)
+        if old_path is not None:
+            moves[old_path] = song.path
+
+    if held:
+        await load_batch(conn, held, moves)
+        progress.update(len(held))
+
+    if changed:
+        progress.done()
+
+    deleted = [path for path in vanished if path not in moves]
+    if deleted:
+        await conn.execute(DELETE_SONGS, deleted)
+
+    if changed or deleted:
+        # Lets running bots refresh their search index.
+        await conn.execute("NOTIFY library_changed")
+
+    print(f"{changed} new or changed, {len(moves)} moved, {len(deleted)} removed.")
+
+async def sync_paths(conn: asyncpg.connection.Connection, paths: Set[str], workers: int):
+    def existing_files() -> List[Path]:
+        files = []
+        for path in map(Path, paths):
+            if path.is_dir():
+                files.extend(walk_lib(path))
+            elif path.is_file() and TinyTag.is_supported(path):
+                files.append(path)
+
+        return files
+
+    files = await asyncio.to_thread(existing_files)
+    known = await fetch_known(conn, list(paths))
+
+    await sync_lib(conn, known, files, workers)
+
+async def watch_lib(conn: asyncpg.connection.Connection, lib_path: Path, workers: int):
+    try:
+        from watchdog.observers import Observer
+    except ImportError:
+        print("Watch mode requires watchdog, install it with `pip install watchdog`.")
+        return
+
+    collector = ChangeCollector(asyncio.get_running_loop())
+    observer = Observer()
+    observer.schedule(collector, str(lib_path), recursive=True)
+    observer.start()
+    print(f"Watching {lib_path} for changes.")
+
+    try:
+        while True:
+            await collector.changed.wait()
+            # Copies and moves arrive as bursts of events, apply them together.
+            await asyncio.sleep(WATCH_DEBOUNCE)
+            await sync_paths(conn, collector.drain(), workers)
+    finally:
+        observer.stop()
+        observer.join()
+
+def plan_shards(directory: Path) -> Iterator[Tuple[List[str], int, int, int]]:
+    """Group the directories below `directory` into shards of about `SHARD_FILES` files.
+
+    Yields (directories, part, parts, files). Only directories are walked,
+    the files are left for the workers to stat and tag. Directories without
+    songs are kept too, their vanished songs are found through them.
+    """
+    directories: List[str] = []
+    files = 0
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        count = 0
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(Path(entry.path))
+                elif TinyTag.is_supported(entry.path):
+                    count += 1
+
+        if count > SHARD_FILES:
+            parts = math.ceil(count / SHARD_FILES)
+            for part in range(parts):
+                yield [str(current)], part, parts, count // parts + (part < count % parts)
+            continue
+
+        directories.append(str(current))
+        files += count
+        if files >= SHARD_FILES:
+            yield directories, 0, 1, files
+            directories, files = [], 0
+
+    if directories:
+        yield directories, 0, 1, files
+
+def in_part(path: str, part: int, parts: int) -> bool:
+    return parts == 1 or zlib.crc32(os.path.basename(path).encode()) % parts == part
+
+async def find_moves(conn: asyncpg.connection.Connection, songs: List[ParsedSong],
+                     stored: Dict[str, KnownSong], gone: Dict[str, str]) -> Dict[str, str]:
+    """Match new files with the songs they were moved from, in this shard or any other."""
+    moves: Dict[str, str] = {}
+    new = [song for song in songs if song.path not in stored]
+    for song in new:
+        old_path = gone.pop(song.hash, None)
+        if old_path is not None:
+            moves[old_path] = song.path
+
+    rest = [song for song in new if song.path not in moves.values()]
+    if not rest:
+        return moves
+
+    candidates: Dict[str, List[str]] = {}
+    for row in await conn.fetch(SONGS_BY_HASH, [song.hash for song in rest]):
+        candidates.setdefault(row['song_hash'], []).append(row['song_path'])
+
+    for song in rest:
+        for old_path in candidates.get(song.hash, ()):
+            # The shard it was in may not have been scanned yet, so look for the file itself.
+            if old_path not in moves and not await asyncio.to_thread(os.path.exists, old_path):
+                moves[old_path] = song.path
+                break
+
+    return moves
+
+async def ingest_shard(conn: asyncpg.connection.Connection, pool: ProcessPoolExecutor,
+                       shard: asyncpg.Record) -> Tuple[int, List[str]]:
+    """Tag the new and changed files of a shard.
+
+    Returns how many were tagged and the songs that vanished from it, which
+    are only deleted once the whole run is done.
+    """
+    part, parts = shard['job_part'], shard['job_parts']
+
+    def shard_files() -> List[Path]:
+        files = []
+        for directory in shard['job_dirs']:
+            try:
+                with os.scandir(directory) as entries:
+                    files.extend(Path(entry.path) for entry in entries
+                                 if not entry.is_dir() and TinyTag.is_supported(entry.path)
+                                 and in_part(entry.path, part, parts))
+            except FileNotFoundError:
+                # Removed since the run was planned, its songs count as vanished.
+                pass
+
+        return files
+
+    files = await asyncio.to_thread(shard_files)
+    stored = {row['song_path']: KnownSong(row['song_size'], row['song_mtime'], row['song_hash'])
+              for row in await conn.fetch(SHARD_SONGS, shard['job_dirs'])
+              if in_part(row['song_path'], part, parts)}
+    full = shard['run_full']
+
+    def changed_files() -> List[Path]:
+        changed = []
+        for path in files:
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+
+            song = stored.get(str(path))
+            if full or not song or song.size != stat.st_size or song.mtime != stat.st_mtime:
+                changed.append(path)
+
+        return changed
+
+    changed = await asyncio.to_thread(changed_files)
+    present = {str(path) for path in files}
+    vanished = [path for path in stored if path not in present]
+
+    loop = asyncio.get_running_loop()
+    batches = [changed[i:i + WALK_BATCH] for i in range(0, len(changed), WALK_BATCH)]
+    songs = [song for batch in await asyncio.gather(*(loop.run_in_executor(pool, parse_batch, batch)
+                                                      for batch in batches))
+             for song in batch]
+
+    gone = {stored[path].hash: path for path in vanished if stored[path].hash}
+    moves = await find_moves(conn, songs, stored, gone)
+    if songs:
+        await create_staging(conn)
+        await load_batch(conn, songs, moves)
+
+    return len(songs), [path for path in vanished if path not in moves]
+
+async def heartbeat(db: asyncpg.Pool, job_id: int, worker: str):
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        try:
+            await db.execute(HEARTBEAT, job_id, worker)
+        except (asyncpg.PostgresError, OSError) as e:
+            print(f"Heartbeat for shard {job_id} failed: {e}")
+
+async def work_shards(db: asyncpg.Pool, pool: ProcessPoolExecutor, worker: str, progress: Progress):
+    while True:
+        shard = await db.fetchrow(CLAIM_SHARD, worker, SHARD_TIMEOUT, SHARD_ATTEMPTS)
+        if shard is None:
+            if not await db.fetchval(SHARDS_LEFT):
+                return
+
+            # Held by others, wait in case one of them dies.
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+
+        beat = asyncio.create_task(heartbeat(db, shard['job_id'], worker))
+        try:
+            async with db.acquire() as conn:
+                tagged, vanished = await ingest_shard(conn, pool, shard)
+        except Exception as e:
+            # Anything from a broken process pool to a tag the parser chokes
+            # on, the shard is retried or given up on instead of hanging.
+            print(f"Shard {shard['job_id']} failed: {e!r}")
+            await db.execute(FAIL_SHARD, shard['job_id'], worker, repr(e), SHARD_ATTEMPTS)
+            if isinstance(e, BrokenProcessPool):
+                # Every shard after it would fail the same way.
+                raise
         else:
-            if TinyTag.is_supported(file):
-                tag = TinyTag.get(file)
-                await insert_data(conn, tag, file)
+            await db.execute(FINISH_SHARD, shard['job_id'], worker, tagged, vanished)
+            progress.update(tagged)
+        finally:
+            beat.cancel()
+
+async def run_worker(workers: int):
+    """Claim and ingest shards, `workers` at a time, until none are left."""
+    db = await asyncpg.create_pool(user=CONFIG["DB_USER"], database=CONFIG["DB_DATABASE"], host=DB_HOST,
+                                   min_size=1, max_size=workers * 2)
+    host = f"{socket.gethostname()}:{os.getpid()}"
+    progress = Progress()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            await asyncio.gather(*(work_shards(db, pool, f"{host}:{i}", progress) for i in range(workers)))
+    finally:
+        await db.close()
+
+    progress.done()
+
+def progress_text(row: asyncpg.Record) -> str:
+    return (f"Run {row['run_id']}: {row['done']}/{row['jobs']} shards done, "
+            f"{row['running']} running on {row['workers']} workers, {row['failed']} failed, "
+            f"{row['files_done']}/{row['files']} files, {row['tagged']} tagged")
+
+async def show_progress():
+    conn = await connect()
+    for row in await conn.fetch("SELECT * FROM ingest_progress ORDER BY run_id DESC LIMIT 5"):
+        state = "finished" if row['run_finished'] else f"started {row['run_started']:%Y-%m-%d %H:%M}"
+        print(f"{progress_text(row)} ({state})")
+
+    await conn.close()
+
+async def distribute(lib_path: Path, workers: int, full: bool):
+    """Queue the library as shards for workers on any host, work on them too and clean up after."""
+    conn = await connect()
+    await migrate(conn)
+
+    shards = await asyncio.to_thread(list, plan_shards(lib_path))
+    async with conn.transaction():
+        run_id = await conn.fetchval(CREATE_RUN, full)
+        await conn.copy_records_to_table("ingest_job", columns=("run_id", "job_dirs", "job_part", "job_parts", "job_size"),
+                                         records=[(run_id, *shard) for shard in shards])
+
+    print(f"Queued run {run_id}: {sum(shard[3] for shard in shards)} files in {len(shards)} shards.")
+
+    local = asyncio.create_task(run_worker(workers)) if workers else None
+    while True:
+        row = await conn.fetchrow("SELECT * FROM ingest_progress WHERE run_id = $1", run_id)
+        if not row['pending'] and not row['running']:
+            break
+
+        if local is not None and local.done():
+            # Raises if the local workers died.
+            local.result()
+
+        print(progress_text(row))
+        await asyncio.sleep(PROGRESS_INTERVAL)
+
+    if local is not None:
+        await local
+
+    print(progress_text(row))
+    deleted = []
+    failed = await conn.fetch(FAILED_SHARDS, run_id)
+    if failed:
+        for shard in failed:
+            print(f"Shard {shard['job_id']} ({shard['job_dirs'][0]}) failed: {shard['job_error']}")
+        # A failed shard may hold the new place of a vanished song.
+        print("Vanished songs are kept while shards failed, run again to retry them.")
+    else:
+        deleted = [row['song_path'] for row in await conn.fetch(RUN_VANISHED, run_id, os.path.join(lib_path, ""))]
+        if deleted:
+            await conn.execute(DELETE_SONGS, deleted)
+
+    await conn.execute(FINISH_RUN, run_id)
+    if row['tagged'] or deleted:
+        # Lets running bots refresh their search index.
+        await conn.execute("NOTIFY library_changed")
+
+    print(f"{row['tagged']} new or changed, {len(deleted)} removed.")
+    await conn.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(run(LIB_PATH))
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Load the music library into the database.")
+    parser.add_argument("--workers", type=int,
+                        default=CONFIG.get("INGEST_WORKERS") or os.cpu_count(),
+                        help="number of tag parsing processes (defaults to the core count)")
+    parser.add_argument("--full", action="store_true",
+                        help="re-tag every file instead of only new or changed ones")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and apply library changes as they happen")
+    parser.add_argument("--migrate", action="store_true",
+                        help="only upgrade the database schema, without scanning the library")
+    parser.add_argument("--distribute", action="store_true",
+                        help="split the library into shards for --worker processes on any host, and work on them too")
+    parser.add_argument("--worker", action="store_true",
+                        help="tag the shards queued by --distribute until none are left")
+    parser.add_argument("--progress", action="store_true",
+                        help="show the progress of the latest distributed runs")
+    args = parser.parse_args()
+
+    if args.progress:
+        asyncio.run(show_progress())
+    elif args.worker:
+        asyncio.run(run_worker(args.workers))
+    elif args.distribute:
+        asyncio.run(distribute(LIB_PATH, args.workers, args.full))
+    else:
+        asyncio.run(run(LIB_PATH, args.workers, args.full, args.watch, args.migrate))
@@ -4,6 +4,51 @@ CONFIG["MUSIC_PATH"] = "path/to/your/music/library"
 
 CONFIG["DB_USER"] = "test"
 CONFIG["DB_DATABASE"] = "yadmbdb"
+# Where db_setup.py finds the database, workers on other hosts point this at it.
+CONFIG["DB_HOST"] = "127.0.0.1"
+# Database connections for the bot, supervisor.py splits them between its processes.
+CONFIG["DB_POOL_SIZE"] = 10
+# Wiped and refilled by the benchmarks in bench/, never point it at the real database.
+CONFIG["BENCH_DATABASE"] = "yadmbdb_bench"
 
 CONFIG["LL_HOST"] = "http://0.0.0.0:8080"
-CONFIG["LL_PASS"] = "test"
\ No newline at end of file
+CONFIG["LL_PASS"] = "test"
+# Several Lavalink nodes, new players go to the least loaded one and move to
+# another node when theirs goes down. Leave empty to use LL_HOST and LL_PASS.
+CONFIG["LL_NODES"] = [
+    # {"identifier": "main", "uri": "http://0.0.0.0:8080", "password": "test"},
+]
+# Requests in flight to each node, split between processes like DB_POOL_SIZE.
+CONFIG["LL_CONNECTIONS"] = 100
+
+# Tag parsing processes used by db_setup.py, defaults to the core count.
+CONFIG["INGEST_WORKERS"] = None
+
+# Resolved Lavalink tracks kept in memory, on top of the ones stored in the database.
+CONFIG["TRACK_CACHE_SIZE"] = 1000
+# Search results shared between guilds, kept for SEARCH_CACHE_TTL seconds.
+# Searches that found nothing are asked again after SEARCH_CACHE_EMPTY_TTL.
+CONFIG["SEARCH_CACHE_SIZE"] = 1000
+CONFIG["SEARCH_CACHE_TTL"] = 600
+CONFIG["SEARCH_CACHE_EMPTY_TTL"] = 30
+# Playlists whose tracks are kept in memory. Every process drops its copy
+# when a playlist changes, wherever the change was made.
+CONFIG["PLAYLIST_CACHE_SIZE"] = 500
+# Lavalink searches run at once while loading a playlist or album.
+CONFIG["RESOLVE_CONCURRENCY"] = 8
+# Upcoming tracks resolved ahead of playback, the rest of a playlist stays unresolved.
+CONFIG["QUEUE_WINDOW"] = 5
+# Evens out the loudness of local songs with their ReplayGain tags, on top of the player volume.
+CONFIG["NORMALIZE_LOUDNESS"] = True
+# Added to every song's ReplayGain value, in dB. Lower it if normalized songs sound too loud.
+CONFIG["REPLAYGAIN_PREAMP"] = 0.0
+# Directory build_recommendations.py writes the similarity model to. When it
+# exists, local songs picked from it keep playing after the queue runs out.
+CONFIG["RECOMMEND_MODEL"] = "recommend"
+# Seconds between saves of every player's queue and position, restored after a restart.
+CONFIG["SESSION_SNAPSHOT_INTERVAL"] = 30
+# Seconds track changes are held back, only the last one updates the now playing message.
+CONFIG["NOW_PLAYING_DEBOUNCE"] = 2.0
+
+# Serves Prometheus metrics on http://127.0.0.1:<port>/metrics, None turns it off.
+CONFIG["METRICS_PORT"] = None
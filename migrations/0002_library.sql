@@ -0,0 +1,88 @@
+-- Library schema used by db_setup.py and the Music cog: file state for
+-- incremental scans, trigram search, stored Lavalink tracks and the
+-- unique constraints the bulk loader relies on.
+--
+-- Some databases were created from intermediate versions of setup.sql that
+-- already have parts of this, so every step is idempotent.
+
+-- object: pg_trgm | type: EXTENSION --
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+-- ddl-end --
+
+ALTER TABLE public.song
+	ADD COLUMN IF NOT EXISTS song_size bigint,
+	ADD COLUMN IF NOT EXISTS song_mtime double precision,
+	ADD COLUMN IF NOT EXISTS song_hash text,
+	ADD COLUMN IF NOT EXISTS song_search text,
+	ADD COLUMN IF NOT EXISTS song_updated timestamptz NOT NULL DEFAULT now(),
+	ADD COLUMN IF NOT EXISTS song_encoded text,
+	ADD COLUMN IF NOT EXISTS song_info jsonb;
+-- ddl-end --
+
+ALTER TABLE public.tracks
+	ADD COLUMN IF NOT EXISTS track_encoded text,
+	ADD COLUMN IF NOT EXISTS track_info jsonb;
+-- ddl-end --
+
+-- Ingests without constraints could create duplicates, fold them onto the
+-- oldest row before the constraints go in.
+UPDATE public.song SET artist_id = keep.artist_id
+	FROM public.artist dup
+		INNER JOIN (
+			SELECT artist_name, min(artist_id) AS artist_id FROM public.artist
+				GROUP BY artist_name
+		) keep ON keep.artist_name = dup.artist_name
+	WHERE song.artist_id = dup.artist_id AND dup.artist_id <> keep.artist_id;
+
+DELETE FROM public.artist dup USING public.artist keep
+	WHERE dup.artist_name = keep.artist_name AND dup.artist_id > keep.artist_id;
+
+UPDATE public.song SET album_id = keep.album_id
+	FROM public.album dup
+		INNER JOIN (
+			SELECT album_name, min(album_id) AS album_id FROM public.album
+				GROUP BY album_name
+		) keep ON keep.album_name = dup.album_name
+	WHERE song.album_id = dup.album_id AND dup.album_id <> keep.album_id;
+
+DELETE FROM public.album dup USING public.album keep
+	WHERE dup.album_name = keep.album_name AND dup.album_id > keep.album_id;
+
+DELETE FROM public.song dup USING public.song keep
+	WHERE dup.song_path = keep.song_path AND dup.song_id > keep.song_id;
+
+DO $$
+BEGIN
+	IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'song_path_uq') THEN
+		ALTER TABLE public.song ADD CONSTRAINT song_path_uq UNIQUE (song_path);
+	END IF;
+
+	IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'artist_name_uq') THEN
+		ALTER TABLE public.artist ADD CONSTRAINT artist_name_uq UNIQUE (artist_name);
+	END IF;
+
+	IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'album_name_uq') THEN
+		ALTER TABLE public.album ADD CONSTRAINT album_name_uq UNIQUE (album_name);
+	END IF;
+END $$;
+-- ddl-end --
+
+UPDATE public.song SET song_search = concat_ws(' ', song_name,
+	(SELECT artist_name FROM public.artist WHERE artist.artist_id = song.artist_id),
+	(SELECT album_name FROM public.album WHERE album.album_id = song.album_id))
+	WHERE song_search IS NULL;
+
+-- object: song_search_trgm_idx | type: INDEX --
+CREATE INDEX IF NOT EXISTS song_search_trgm_idx ON public.song
+USING gin (song_search gin_trgm_ops);
+-- ddl-end --
+
+-- object: album_name_trgm_idx | type: INDEX --
+CREATE INDEX IF NOT EXISTS album_name_trgm_idx ON public.album
+USING gin (album_name gin_trgm_ops);
+-- ddl-end --
+
+-- object: track_name_trgm_idx | type: INDEX --
+CREATE INDEX IF NOT EXISTS track_name_trgm_idx ON public.tracks
+USING gin (track_name gin_trgm_ops);
+-- ddl-end --
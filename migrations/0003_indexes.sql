@@ -0,0 +1,50 @@
+-- Indexes behind every lookup the bot runs, checked by check_plans.py.
+
+-- Playlist names are unique per guild, rename any duplicates that slipped
+-- past playlist create.
+UPDATE public.playlist SET playlist_name = dup.playlist_name || ' (' || dup.playlist_id || ')'
+	FROM public.playlist dup
+		INNER JOIN public.playlist keep
+			ON keep.guild_id = dup.guild_id
+			AND keep.playlist_name = dup.playlist_name
+			AND keep.playlist_id < dup.playlist_id
+	WHERE playlist.playlist_id = dup.playlist_id;
+
+-- object: playlist_guild_name_uq | type: INDEX --
+CREATE UNIQUE INDEX IF NOT EXISTS playlist_guild_name_uq ON public.playlist
+USING btree (guild_id, playlist_name);
+-- ddl-end --
+
+-- The primary key leads with track_id after playlist_id, so it cannot
+-- serve playlist_track_id ordering.
+-- object: playlist_tracks_order_idx | type: INDEX --
+CREATE INDEX IF NOT EXISTS playlist_tracks_order_idx ON public.playlist_tracks
+USING btree (playlist_id, playlist_track_id);
+-- ddl-end --
+
+-- object: playlist_tracks_track_idx | type: INDEX --
+CREATE INDEX IF NOT EXISTS playlist_tracks_track_idx ON public.playlist_tracks
+USING btree (track_id);
+-- ddl-end --
+
+-- object: song_album_idx | type: INDEX --
+CREATE INDEX IF NOT EXISTS song_album_idx ON public.song
+USING btree (album_id);
+-- ddl-end --
+
+-- object: song_artist_idx | type: INDEX --
+CREATE INDEX IF NOT EXISTS song_artist_idx ON public.song
+USING btree (artist_id);
+-- ddl-end --
+
+-- object: song_updated_idx | type: INDEX --
+CREATE INDEX IF NOT EXISTS song_updated_idx ON public.song
+USING btree (song_updated);
+-- ddl-end --
+
+-- object: tracks_uri_idx | type: INDEX --
+CREATE INDEX IF NOT EXISTS tracks_uri_idx ON public.tracks
+USING btree (track_uri);
+-- ddl-end --
+
+ANALYZE public.playlist, public.playlist_tracks, public.song, public.tracks;
@@ -0,0 +1,19 @@
+-- Player state saved by the sessions cog, restored after a restart.
+-- Tracks are stored as [uri, encoded, info] so they rebuild without Lavalink,
+-- pending refs as [uri, title, author].
+
+-- object: public.player_session | type: TABLE --
+CREATE TABLE IF NOT EXISTS public.player_session (
+	guild_id bigint NOT NULL,
+	voice_channel_id bigint NOT NULL,
+	home_channel_id bigint NOT NULL,
+	volume integer NOT NULL,
+	paused boolean NOT NULL,
+	position integer NOT NULL,
+	current jsonb,
+	queue jsonb NOT NULL,
+	pending jsonb NOT NULL,
+	saved_at timestamptz NOT NULL DEFAULT now(),
+	CONSTRAINT player_session_pk PRIMARY KEY (guild_id)
+);
+-- ddl-end --
@@ -0,0 +1,11 @@
+-- Audio properties read from the tags by db_setup.py. Durations are in
+-- seconds, gain is the ReplayGain track gain in dB and peak its linear
+-- sample peak, both NULL for untagged files.
+
+ALTER TABLE public.song
+	ADD COLUMN IF NOT EXISTS song_duration double precision,
+	ADD COLUMN IF NOT EXISTS song_bitrate real,
+	ADD COLUMN IF NOT EXISTS song_samplerate integer,
+	ADD COLUMN IF NOT EXISTS song_gain real,
+	ADD COLUMN IF NOT EXISTS song_peak real;
+-- ddl-end --
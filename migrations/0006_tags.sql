@@ -0,0 +1,8 @@
+-- Descriptive tags read by db_setup.py, the recommendation model groups
+-- songs by them. Year is the first four digits of the date tag, both are
+-- NULL for untagged files.
+
+ALTER TABLE public.song
+	ADD COLUMN IF NOT EXISTS song_genre text,
+	ADD COLUMN IF NOT EXISTS song_year integer;
+-- ddl-end --
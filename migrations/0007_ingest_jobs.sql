@@ -0,0 +1,79 @@
+-- Distributed ingestion, see `db_setup.py --distribute` and `--worker`.
+-- A run splits the library into shards of directories. Workers on any host
+-- claim them with FOR UPDATE SKIP LOCKED and heartbeat while they work, a
+-- shard whose heartbeat stops is claimed again.
+
+-- object: public.ingest_run | type: TABLE --
+CREATE TABLE IF NOT EXISTS public.ingest_run (
+	run_id serial NOT NULL,
+	run_full boolean NOT NULL DEFAULT false,
+	run_started timestamptz NOT NULL DEFAULT now(),
+	run_finished timestamptz,
+	CONSTRAINT ingest_run_pk PRIMARY KEY (run_id)
+);
+-- ddl-end --
+
+-- A shard is a list of directories, or one part of a directory too big
+-- for a single shard. Parts split the files by a hash of their name.
+-- object: public.ingest_job | type: TABLE --
+CREATE TABLE IF NOT EXISTS public.ingest_job (
+	job_id serial NOT NULL,
+	run_id integer NOT NULL,
+	job_dirs text[] NOT NULL,
+	job_part integer NOT NULL DEFAULT 0,
+	job_parts integer NOT NULL DEFAULT 1,
+	job_size integer NOT NULL,
+	job_state text NOT NULL DEFAULT 'pending',
+	job_attempts integer NOT NULL DEFAULT 0,
+	job_worker text,
+	job_heartbeat timestamptz,
+	job_tagged integer,
+	job_vanished text[],
+	job_error text,
+	job_finished timestamptz,
+	CONSTRAINT ingest_job_pk PRIMARY KEY (job_id),
+	CONSTRAINT ingest_job_run_fk FOREIGN KEY (run_id)
+		REFERENCES public.ingest_run (run_id) ON DELETE CASCADE,
+	CONSTRAINT ingest_job_state_ck CHECK (job_state IN ('pending', 'running', 'done', 'failed'))
+);
+-- ddl-end --
+
+-- Workers only ever look through the unfinished shards.
+-- object: ingest_job_open_idx | type: INDEX --
+CREATE INDEX IF NOT EXISTS ingest_job_open_idx ON public.ingest_job
+USING btree (job_id) WHERE job_state IN ('pending', 'running');
+-- ddl-end --
+
+-- object: ingest_job_run_idx | type: INDEX --
+CREATE INDEX IF NOT EXISTS ingest_job_run_idx ON public.ingest_job
+USING btree (run_id);
+-- ddl-end --
+
+-- Workers read a shard's songs back by directory, and find songs moved in
+-- from another shard by their hash.
+-- object: song_dir_idx | type: INDEX --
+CREATE INDEX IF NOT EXISTS song_dir_idx ON public.song
+USING btree (regexp_replace(song_path, '/[^/]*$', ''));
+-- ddl-end --
+
+-- object: song_hash_idx | type: INDEX --
+CREATE INDEX IF NOT EXISTS song_hash_idx ON public.song
+USING btree (song_hash);
+-- ddl-end --
+
+-- object: public.ingest_progress | type: VIEW --
+CREATE OR REPLACE VIEW public.ingest_progress AS
+	SELECT ingest_run.run_id, run_started, run_finished,
+		count(job_id) AS jobs,
+		count(job_id) FILTER (WHERE job_state = 'pending') AS pending,
+		count(job_id) FILTER (WHERE job_state = 'running') AS running,
+		count(job_id) FILTER (WHERE job_state = 'done') AS done,
+		count(job_id) FILTER (WHERE job_state = 'failed') AS failed,
+		count(DISTINCT job_worker) FILTER (WHERE job_state = 'running') AS workers,
+		coalesce(sum(job_size), 0) AS files,
+		coalesce(sum(job_size) FILTER (WHERE job_state = 'done'), 0) AS files_done,
+		coalesce(sum(job_tagged), 0) AS tagged
+	FROM public.ingest_run
+		LEFT JOIN public.ingest_job ON ingest_job.run_id = ingest_run.run_id
+	GROUP BY ingest_run.run_id;
+-- ddl-end --
@@ -0,0 +1,7 @@
+-- Playlist imports match entries without a known path by their title,
+-- see IMPORT_MATCH_QUERY.
+
+-- object: song_name_lower_idx | type: INDEX --
+CREATE INDEX IF NOT EXISTS song_name_lower_idx ON public.song
+USING btree (lower(song_name));
+-- ddl-end --
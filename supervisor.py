@@ -0,0 +1,169 @@
+"""Run the bot as several processes on this host, each with a range of shards.
+
+Processes are restarted when they exit or stop writing their heartbeat, and
+the health of every shard is printed periodically:
+
+    python supervisor.py --processes 4 --shards-per-process 4
+
+Hosts splitting one bot between them pass the same --shard-count and their
+own --first-shard.
+"""
+import argparse
+import asyncio
+import signal
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+from typing import List, Optional
+
+from cogs.utils.shards import HEARTBEAT_INTERVAL, read_heartbeat, shard_ranges, share
+from config import CONFIG
+
+
+# A process gets this long to log in and connect its shards before its heartbeat counts.
+STARTUP_GRACE = 120
+# Heartbeats older than this mean the process is stuck.
+HEARTBEAT_TIMEOUT = HEARTBEAT_INTERVAL * 6
+REPORT_INTERVAL = 60
+# Seconds before restarting a process, doubled for every crash in a row.
+RESTART_DELAY = 5
+MAX_RESTART_DELAY = 300
+# A process that ran this long is considered healthy again.
+STABLE_AFTER = 600
+STOP_TIMEOUT = 30
+
+
+class Worker:
+    def __init__(self, index: int, shard_ids: List[int], shard_count: int,
+                 pool_size: int, lavalink_connections: int, heartbeat: Path) -> None:
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.pool_size = pool_size
+        self.lavalink_connections = lavalink_connections
+        self.heartbeat = heartbeat
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.started = 0.0
+        self.restarts = 0
+
+    def command(self) -> List[str]:
+        return [
+            sys.executable, "bot.py",
+            "--shard-ids", *map(str, self.shard_ids),
+            "--shard-count", str(self.shard_count),
+            "--process", str(self.index),
+            "--pool-size", str(self.pool_size),
+            "--lavalink-connections", str(self.lavalink_connections),
+            "--heartbeat", str(self.heartbeat)
+        ]
+
+    def stale(self) -> bool:
+        """Whether the process stopped writing heartbeats after its startup grace."""
+        if time.monotonic() - self.started < STARTUP_GRACE:
+            return False
+
+        data = read_heartbeat(self.heartbeat)
+        return data is None or data["pid"] != self.process.pid or time.time() - data["time"] > HEARTBEAT_TIMEOUT
+
+    async def stop(self) -> None:
+        if self.process is None or self.process.returncode is not None:
+            return
+
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+    async def run(self) -> None:
+        delay = RESTART_DELAY
+        while True:
+            self.heartbeat.unlink(missing_ok=True)
+            self.process = await asyncio.create_subprocess_exec(*self.command())
+            self.started = time.monotonic()
+            print(f"Process {self.index} started with shards {self.shard_ids[0]}-{self.shard_ids[-1]} "
+                  f"(pid {self.process.pid}).")
+
+            while self.process.returncode is None:
+                try:
+                    await asyncio.wait_for(self.process.wait(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    if self.stale():
+                        print(f"Process {self.index} stopped sending heartbeats, restarting it.")
+                        await self.stop()
+
+            if time.monotonic() - self.started > STABLE_AFTER:
+                delay = RESTART_DELAY
+
+            self.restarts += 1
+            print(f"Process {self.index} exited with {self.process.returncode}, restarting in {delay}s.")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+
+
+def report(workers: List[Worker]) -> None:
+    for worker in workers:
+        data = read_heartbeat(worker.heartbeat)
+        if data is None:
+            print(f"Process {worker.index}: no heartbeat yet, {worker.restarts} restarts")
+            continue
+
+        age = time.time() - data["time"]
+        print(f"Process {worker.index} (pid {data['pid']}): heartbeat {age:.0f}s ago, "
+              f"{data['players']} players, {worker.restarts} restarts")
+        for shard_id in worker.shard_ids:
+            shard = data["shards"].get(str(shard_id))
+            if shard is None:
+                print(f"  shard {shard_id}: not started")
+            elif shard["closed"] or shard["latency"] is None:
+                print(f"  shard {shard_id}: disconnected, {shard['guilds']} guilds")
+            else:
+                print(f"  shard {shard_id}: {shard['latency'] * 1000:.0f}ms, {shard['guilds']} guilds")
+
+async def supervise(workers: List[Worker]) -> None:
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    tasks = [asyncio.create_task(worker.run()) for worker in workers]
+    while not stopping.is_set():
+        try:
+            await asyncio.wait_for(stopping.wait(), REPORT_INTERVAL)
+        except asyncio.TimeoutError:
+            report(workers)
+
+    print("Stopping all processes.")
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*(worker.stop() for worker in workers))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--shards-per-process", type=int, default=2)
+    parser.add_argument("--first-shard", type=int, default=0)
+    parser.add_argument("--shard-count", type=int, help="shards across every host, defaults to this host's")
+    parser.add_argument("--heartbeat-dir", type=Path, default=Path(tempfile.gettempdir()) / "yadmb")
+    args = parser.parse_args()
+
+    ranges = shard_ranges(args.first_shard, args.processes, args.shards_per_process)
+    shard_count = args.shard_count or args.first_shard + args.processes * args.shards_per_process
+    if ranges[-1][-1] >= shard_count:
+        parser.error(f"shard {ranges[-1][-1]} does not fit into --shard-count {shard_count}")
+
+    args.heartbeat_dir.mkdir(parents=True, exist_ok=True)
+    # The host's database and Lavalink budgets are split between the processes.
+    # The listener holds one pooled connection for good, which leaves at
+    # least two for commands, session snapshots and index refreshes.
+    pool_size = share(CONFIG.get("DB_POOL_SIZE", 10), args.processes, minimum=3)
+    connections = share(CONFIG.get("LL_CONNECTIONS", 100), args.processes)
+
+    workers = [Worker(i, shard_ids, shard_count, pool_size, connections,
+                      args.heartbeat_dir / f"process-{i}.json")
+               for i, shard_ids in enumerate(ranges)]
+    asyncio.run(supervise(workers))